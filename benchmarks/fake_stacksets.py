@@ -0,0 +1,611 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+fake_stacksets.py simulates the AWS services used by the stack set
+deployer, so the deployer can be measured without an AWS Organization.
+
+FakeStackSetsService keeps the stack sets, stack instances and operations
+of a simulated organization of Org Units, accounts and regions in memory.
+Every API call can be delayed and randomly throttled, and the operations
+run for a simulated duration per batch of accounts and region given by
+their operation preferences, a drift detection marks a random drift_rate
+fraction of the stack instances DRIFTED. With managed execution active an operation
+is queued behind the running operations sharing one of its regions. FakeCloudFormationClient and FakeOrganizationsClient
+implement the client methods used by the deployer, and FakeSession hands
+them out in place of boto3 together with a real S3 client whose requests
+are answered from memory.
+"""
+
+import io
+import math
+import random
+import hashlib
+import itertools
+import threading
+from time import sleep, monotonic
+from datetime import datetime, timezone
+from email.utils import formatdate
+from xml.sax.saxutils import escape
+from urllib.parse import unquote, urlparse, parse_qs
+import boto3
+from botocore.config import Config
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ClientError
+
+DEFAULT_PAGE_SIZE = 100
+
+
+class ApiCounter:
+    def __init__(self):
+        self.counts = {}
+        self.counter_lock = threading.Lock()
+
+    def add(self, api_method):
+        """
+        This method counts a call of the supplied API method
+        """
+        with self.counter_lock:
+            self.counts[api_method] = self.counts.get(api_method, 0) + 1
+
+    def reset(self):
+        """
+        This method clears the counters
+        """
+        with self.counter_lock:
+            self.counts.clear()
+
+    def get_counts(self):
+        """
+        This method returns the call count per API method
+        """
+        with self.counter_lock:
+            return dict(self.counts)
+
+
+class FakeStackSetsService:
+    def __init__(self, ou_count=1, accounts_per_ou=5, regions=None, api_latency=0.0,
+                 operation_duration=0.0, throttle_rate=0.0, drift_rate=0.0, page_size=DEFAULT_PAGE_SIZE, seed=None):
+        self.ou_accounts = {f"ou-fake-{ou_index:04d}": [f"{ou_index:04d}{account_index:08d}" for account_index in range(accounts_per_ou)]
+                            for ou_index in range(ou_count)}
+        self.regions = regions if regions else ['us-east-1', 'us-west-2']
+        self.api_latency = api_latency
+        self.operation_duration = operation_duration
+        self.throttle_rate = throttle_rate
+        self.drift_rate = drift_rate
+        self.page_size = page_size
+        self.random = random.Random(seed)
+        # stack set name -> stack set
+        self.stack_sets = {}
+        # stack set name -> (OU, Account, Region) -> stack instance
+        self.stack_instances = {}
+        # operation id -> operation
+        self.operations = {}
+        self.operation_ids = itertools.count()
+        self.api_counter = ApiCounter()
+        self.service_lock = threading.RLock()
+
+    def get_ou_ids(self):
+        """
+        This method returns the ids of the simulated Org Units
+        """
+        return sorted(self.ou_accounts)
+
+    def get_instance_count(self, stackset_name):
+        """
+        This method returns the number of stack instances of the stack set
+        """
+        with self.service_lock:
+            return len(self.stack_instances.get(stackset_name, {}))
+
+    def call(self, api_method):
+        """
+        This method simulates the latency and throttling of an API call
+        """
+        self.api_counter.add(api_method)
+        if self.api_latency:
+            sleep(self.api_latency)
+        if self.throttle_rate and self.random.random() < self.throttle_rate:
+            raise_error('ThrottlingException', 'Rate exceeded', api_method)
+
+    def seed_stack_set(self, stackset_name, ou_ids=None, regions=None, managed_execution=True):
+        """
+        This method creates a stack set with stack instances in the supplied
+        Org Units and regions without going through the API
+        """
+        with self.service_lock:
+            self.stack_sets[stackset_name] = {
+                                                    "StackSetName": stackset_name,
+                                                    "StackSetId": f"{stackset_name}:{hashlib.md5(stackset_name.encode()).hexdigest()}",
+                                                    "Status": "ACTIVE",
+                                                    "ManagedExecution": {"Active": managed_execution}
+                                             }
+            instances = self.stack_instances.setdefault(stackset_name, {})
+            for ou_id in (ou_ids if ou_ids is not None else self.get_ou_ids()):
+                for account in self.ou_accounts[ou_id]:
+                    for region in (regions if regions is not None else self.regions):
+                        instances[(ou_id, account, region)] = {"status": "CURRENT", "detailed_status": "SUCCEEDED", "operation_id": None}
+
+    def submit_operation(self, stackset_name, action, operation_id=None, instance_keys=(), preferences=None):
+        """
+        This method starts a simulated operation on the stack set and returns its id,
+        the operation starts after the running operations of its regions when managed
+        execution is active
+        """
+        with self.service_lock:
+            stack_set = self.get_stack_set(stackset_name)
+            if operation_id and operation_id in self.operations:
+                raise_error('OperationIdAlreadyExistsException', f"Operation {operation_id} already exists", action)
+            self.advance(stackset_name)
+            now = monotonic()
+            pending_operations = [operation for operation in self.operations.values()
+                                  if operation['stackset_name'] == stackset_name and operation['ends_at'] > now]
+            if pending_operations and not stack_set['ManagedExecution'].get('Active'):
+                raise_error('OperationInProgressException', f"Another operation is in progress on {stackset_name}", action)
+            regions = {instance_key[2] for instance_key in instance_keys}
+            starts_at = max([now] + [operation['ends_at'] for operation in pending_operations
+                                     if is_conflicting(regions, operation['regions'])])
+
+            operation_id = operation_id if operation_id else f"fake-operation-{next(self.operation_ids):08d}"
+            self.operations[operation_id] = {
+                                                "stackset_name": stackset_name,
+                                                "action": action,
+                                                "instance_keys": list(instance_keys),
+                                                "regions": regions,
+                                                "created_at": datetime.now(timezone.utc),
+                                                "starts_at": starts_at,
+                                                "ends_at": starts_at + self.get_operation_duration(instance_keys, preferences or {}),
+                                                "preferences": preferences or {},
+                                                "is_applied": False
+                                            }
+            instances = self.stack_instances.setdefault(stackset_name, {})
+            for instance_key in instance_keys:
+                if action == 'DETECT_DRIFT':
+                    continue
+                if action == 'CREATE':
+                    instances[instance_key] = {"status": "OUTDATED", "detailed_status": "PENDING", "operation_id": operation_id}
+                elif instance_key in instances:
+                    instances[instance_key].update(status="OUTDATED", detailed_status="PENDING", operation_id=operation_id)
+            self.advance(stackset_name)
+            return operation_id
+
+    def get_operation_duration(self, instance_keys, preferences):
+        """
+        This method returns the simulated duration of an operation, one operation
+        duration per batch of accounts of a region, the regions of the operation
+        run one after the other unless the region concurrency is PARALLEL
+        """
+        region_accounts = {}
+        for instance_key in instance_keys:
+            region_accounts[instance_key[2]] = region_accounts.get(instance_key[2], 0) + 1
+        if not region_accounts:
+            return self.operation_duration
+        account_count = max(region_accounts.values())
+        if preferences.get('MaxConcurrentCount'):
+            concurrent_count = preferences['MaxConcurrentCount']
+        else:
+            concurrent_count = math.floor(account_count * preferences.get('MaxConcurrentPercentage', 100) / 100)
+        batch_count = math.ceil(account_count / max(1, concurrent_count))
+        region_count = 1 if preferences.get('RegionConcurrencyType') == 'PARALLEL' else len(region_accounts)
+        return self.operation_duration * batch_count * region_count
+
+    def advance(self, stackset_name):
+        """
+        This method applies the simulated operations of the stack set
+        that are running or completed by now
+        """
+        now = monotonic()
+        instances = self.stack_instances.get(stackset_name, {})
+        for operation_id, operation in self.operations.items():
+            if operation['stackset_name'] != stackset_name or operation['is_applied']:
+                continue
+            if operation['ends_at'] <= now:
+                for instance_key in operation['instance_keys']:
+                    if operation['action'] == 'DELETE':
+                        instances.pop(instance_key, None)
+                    elif operation['action'] == 'DETECT_DRIFT':
+                        if instance_key in instances:
+                            instances[instance_key]['drift_status'] = "DRIFTED" if self.random.random() < self.drift_rate else "IN_SYNC"
+                    elif instance_key in instances:
+                        instances[instance_key].update(status="CURRENT", detailed_status="SUCCEEDED")
+                operation['is_applied'] = True
+            elif operation['starts_at'] <= now and operation['action'] != 'DETECT_DRIFT':
+                for instance_key in operation['instance_keys']:
+                    if instance_key in instances:
+                        instances[instance_key]['detailed_status'] = "RUNNING"
+
+    def get_operation_status(self, operation):
+        """
+        This method returns the status of the simulated operation
+        """
+        now = monotonic()
+        if operation['ends_at'] <= now:
+            return 'SUCCEEDED'
+        if operation['starts_at'] <= now:
+            return 'RUNNING'
+        return 'QUEUED'
+
+    def get_stack_set(self, stackset_name):
+        """
+        This method returns the stack set or raises StackSetNotFoundException
+        """
+        stack_set = self.stack_sets.get(stackset_name)
+        if not stack_set:
+            raise_error('StackSetNotFoundException', f"StackSet {stackset_name} not found", 'DescribeStackSet')
+        return stack_set
+
+    def get_target_keys(self, stackset_name, deployment_targets, regions, is_delete=False):
+        """
+        This method resolves the deployment targets of an operation
+        to the (OU, Account, Region) keys of the stack instances
+        """
+        filter_type = deployment_targets.get('AccountFilterType', 'NONE')
+        filter_accounts = set(deployment_targets.get('Accounts', []))
+        instance_keys = []
+        for ou_id in deployment_targets.get('OrganizationalUnitIds', []):
+            for account in self.ou_accounts.get(ou_id, []):
+                if filter_type == 'INTERSECTION' and account not in filter_accounts:
+                    continue
+                if filter_type == 'DIFFERENCE' and account in filter_accounts:
+                    continue
+                for region in regions:
+                    instance_keys.append((ou_id, account, region))
+        if is_delete:
+            instances = self.stack_instances.get(stackset_name, {})
+            instance_keys = [instance_key for instance_key in instance_keys if instance_key in instances]
+        return instance_keys
+
+
+def is_conflicting(regions, other_regions):
+    """
+    This function checks whether two operations of a stack set conflict,
+    operations without stack instances, updating the stack set, conflict with all
+    """
+    return not regions or not other_regions or bool(regions & other_regions)
+
+
+def raise_error(error_code, message, operation_name):
+    """
+    This function raises the botocore ClientError of the supplied error code
+    """
+    raise ClientError({'Error': {'Code': error_code, 'Message': message}}, operation_name)
+
+
+class FakePaginator:
+    def __init__(self, client, api_method):
+        self.client = client
+        self.api_method = api_method
+
+    def paginate(self, **request):
+        """
+        This method yields the pages of the API method following the NextToken
+        """
+        while True:
+            page = getattr(self.client, self.api_method)(**request)
+            yield page
+            if not page.get('NextToken'):
+                return
+            request = dict(request, NextToken=page['NextToken'])
+
+
+class FakeCloudFormationClient:
+    def __init__(self, service):
+        self.service = service
+        # (stack set name, query) -> stack instance summaries of a listing in progress
+        self.listings = {}
+
+    def get_paginator(self, api_method):
+        """
+        This method returns the paginator of the API method
+        """
+        return FakePaginator(self, api_method)
+
+    def get_page(self, items, request):
+        """
+        This method returns the page of the items starting at the NextToken
+        """
+        start = int(request.get('NextToken') or 0)
+        page_size = min(int(request.get('MaxResults', self.service.page_size)), self.service.page_size)
+        page = {"Summaries": items[start:start + page_size]}
+        if start + page_size < len(items):
+            page["NextToken"] = str(start + page_size)
+        return page
+
+    def list_stack_sets(self, **request):
+        self.service.call('list_stack_sets')
+        with self.service.service_lock:
+            summaries = [{"StackSetName": stack_set['StackSetName'],
+                          "StackSetId": stack_set['StackSetId'],
+                          "Status": stack_set['Status'],
+                          "ManagedExecution": stack_set['ManagedExecution']}
+                         for stack_set in self.service.stack_sets.values()
+                         if stack_set['Status'] == request.get('Status', stack_set['Status'])]
+        return self.get_page(sorted(summaries, key=lambda summary: summary['StackSetName']), request)
+
+    def describe_stack_set(self, StackSetName, **request):
+        self.service.call('describe_stack_set')
+        with self.service.service_lock:
+            return {"StackSet": dict(self.service.get_stack_set(StackSetName))}
+
+    def create_stack_set(self, StackSetName, **request):
+        self.service.call('create_stack_set')
+        with self.service.service_lock:
+            if StackSetName in self.service.stack_sets:
+                raise_error('NameAlreadyExistsException', f"StackSet {StackSetName} already exists", 'CreateStackSet')
+            self.service.seed_stack_set(StackSetName, [], [], request.get('ManagedExecution', {}).get('Active', False))
+            return {"StackSetId": self.service.stack_sets[StackSetName]['StackSetId']}
+
+    def update_stack_set(self, StackSetName, **request):
+        self.service.call('update_stack_set')
+        with self.service.service_lock:
+            self.service.get_stack_set(StackSetName)
+            if 'ManagedExecution' in request:
+                self.service.stack_sets[StackSetName]['ManagedExecution'] = request['ManagedExecution']
+            instance_keys = list(self.service.stack_instances.get(StackSetName, {}))
+            operation_id = self.service.submit_operation(StackSetName, 'UPDATE', request.get('OperationId'),
+                                                         instance_keys, request.get('OperationPreferences'))
+        return {"OperationId": operation_id}
+
+    def delete_stack_set(self, StackSetName, **request):
+        self.service.call('delete_stack_set')
+        with self.service.service_lock:
+            self.service.get_stack_set(StackSetName)
+            self.service.advance(StackSetName)
+            if self.service.stack_instances.get(StackSetName):
+                raise_error('StackSetNotEmptyException', f"StackSet {StackSetName} has stack instances", 'DeleteStackSet')
+            del self.service.stack_sets[StackSetName]
+            self.service.stack_instances.pop(StackSetName, None)
+        return {}
+
+    def create_stack_instances(self, StackSetName, DeploymentTargets, Regions, **request):
+        self.service.call('create_stack_instances')
+        with self.service.service_lock:
+            instance_keys = self.service.get_target_keys(StackSetName, DeploymentTargets, Regions)
+            operation_id = self.service.submit_operation(StackSetName, 'CREATE', request.get('OperationId'),
+                                                         instance_keys, request.get('OperationPreferences'))
+        return {"OperationId": operation_id}
+
+    def delete_stack_instances(self, StackSetName, DeploymentTargets, Regions, **request):
+        self.service.call('delete_stack_instances')
+        with self.service.service_lock:
+            instance_keys = self.service.get_target_keys(StackSetName, DeploymentTargets, Regions, is_delete=True)
+            operation_id = self.service.submit_operation(StackSetName, 'DELETE', request.get('OperationId'),
+                                                         instance_keys, request.get('OperationPreferences'))
+        return {"OperationId": operation_id}
+
+    def detect_stack_set_drift(self, StackSetName, **request):
+        self.service.call('detect_stack_set_drift')
+        with self.service.service_lock:
+            instance_keys = list(self.service.stack_instances.get(StackSetName, {}))
+            operation_id = self.service.submit_operation(StackSetName, 'DETECT_DRIFT', request.get('OperationId'),
+                                                         instance_keys, request.get('OperationPreferences'))
+        return {"OperationId": operation_id}
+
+    def list_stack_instances(self, StackSetName, **request):
+        self.service.call('list_stack_instances')
+        # the first page takes a snapshot of the listing, the next pages are served from it
+        listing_key = (StackSetName, repr(sorted((name, value) for name, value in request.items() if name not in ['NextToken', 'MaxResults'])))
+        with self.service.service_lock:
+            if request.get('NextToken') and listing_key in self.listings:
+                summaries = self.listings[listing_key]
+            else:
+                summaries = self.get_stack_instance_summaries(StackSetName, request)
+                self.listings[listing_key] = summaries
+            page = self.get_page(summaries, request)
+            if not page.get('NextToken'):
+                self.listings.pop(listing_key, None)
+        return page
+
+    def get_stack_instance_summaries(self, StackSetName, request):
+        """
+        This method returns the stack instance summaries of the stack set matching the request
+        """
+        filters = {stack_filter['Name']: stack_filter['Values'] for stack_filter in request.get('Filters', [])}
+        stack_set = self.service.get_stack_set(StackSetName)
+        self.service.advance(StackSetName)
+        summaries = []
+        for (ou_id, account, region), instance in self.service.stack_instances.get(StackSetName, {}).items():
+            if request.get('StackInstanceAccount') not in [None, account]:
+                continue
+            if request.get('StackInstanceRegion') not in [None, region]:
+                continue
+            if filters.get('DETAILED_STATUS') not in [None, instance['detailed_status']]:
+                continue
+            if filters.get('LAST_OPERATION_ID') not in [None, instance['operation_id']]:
+                continue
+            summaries.append({
+                                "StackSetId": stack_set['StackSetId'],
+                                "Region": region,
+                                "Account": account,
+                                "OrganizationalUnitId": ou_id,
+                                "StackId": f"arn:aws:cloudformation:{region}:{account}:stack/StackSet-{StackSetName}",
+                                "Status": instance['status'],
+                                "StackInstanceStatus": {"DetailedStatus": instance['detailed_status']},
+                                "DriftStatus": instance.get('drift_status', 'NOT_CHECKED'),
+                                "LastOperationId": instance['operation_id']
+                             })
+        return summaries
+
+    def describe_stack_set_operation(self, StackSetName, OperationId, **request):
+        self.service.call('describe_stack_set_operation')
+        with self.service.service_lock:
+            operation = self.service.operations.get(OperationId)
+            if not operation or operation['stackset_name'] != StackSetName:
+                raise_error('OperationNotFoundException', f"Operation {OperationId} not found", 'DescribeStackSetOperation')
+            self.service.advance(StackSetName)
+            status = self.service.get_operation_status(operation)
+            stack_set_operation = {
+                                        "OperationId": OperationId,
+                                        "StackSetId": self.service.stack_sets.get(StackSetName, {}).get('StackSetId'),
+                                        "Action": operation['action'],
+                                        "Status": status,
+                                        "OperationPreferences": operation['preferences'],
+                                        "CreationTimestamp": operation['created_at']
+                                  }
+            if status == 'SUCCEEDED':
+                stack_set_operation["EndTimestamp"] = datetime.now(timezone.utc)
+            if operation['action'] == 'DETECT_DRIFT':
+                stack_set_operation["StackSetDriftDetectionDetails"] = self.get_drift_detection_details(StackSetName, status)
+        return {"StackSetOperation": stack_set_operation}
+
+    def get_drift_detection_details(self, StackSetName, status):
+        """
+        This method returns the drift detection details of the stack set
+        from the drift status of its stack instances
+        """
+        drift_statuses = [instance.get('drift_status', 'NOT_CHECKED') for instance in self.service.stack_instances.get(StackSetName, {}).values()]
+        drifted_count = drift_statuses.count('DRIFTED')
+        in_sync_count = drift_statuses.count('IN_SYNC')
+        return {
+                    "DriftStatus": "DRIFTED" if drifted_count else "IN_SYNC" if in_sync_count else "NOT_CHECKED",
+                    "DriftDetectionStatus": "COMPLETED" if status == 'SUCCEEDED' else "IN_PROGRESS",
+                    "TotalStackInstancesCount": len(drift_statuses),
+                    "DriftedStackInstancesCount": drifted_count,
+                    "InSyncStackInstancesCount": in_sync_count
+               }
+
+    def list_stack_set_operations(self, StackSetName, **request):
+        self.service.call('list_stack_set_operations')
+        with self.service.service_lock:
+            self.service.get_stack_set(StackSetName)
+            self.service.advance(StackSetName)
+            # the most recent operations are listed first
+            summaries = [{"OperationId": operation_id,
+                          "Action": operation['action'],
+                          "Status": self.service.get_operation_status(operation),
+                          "CreationTimestamp": operation['created_at']}
+                         for operation_id, operation in reversed(list(self.service.operations.items()))
+                         if operation['stackset_name'] == StackSetName]
+        return self.get_page(summaries, request)
+
+    def list_stack_set_operation_results(self, StackSetName, OperationId, **request):
+        self.service.call('list_stack_set_operation_results')
+        with self.service.service_lock:
+            operation = self.service.operations.get(OperationId)
+            if not operation:
+                raise_error('OperationNotFoundException', f"Operation {OperationId} not found", 'ListStackSetOperationResults')
+            status = self.service.get_operation_status(operation)
+            summaries = [{"Account": account,
+                          "Region": region,
+                          "Status": status,
+                          "AccountGateResult": {"Status": "SKIPPED"},
+                          "OrganizationalUnitId": ou_id}
+                         for ou_id, account, region in operation['instance_keys']]
+        return self.get_page(summaries, request)
+
+
+class FakeOrganizationsClient:
+    def __init__(self, service):
+        self.service = service
+
+    def get_paginator(self, api_method):
+        """
+        This method returns the paginator of the API method
+        """
+        return FakePaginator(self, api_method)
+
+    def list_accounts_for_parent(self, ParentId, **request):
+        self.service.call('list_accounts_for_parent')
+        accounts = [{"Id": account, "Status": "ACTIVE"} for account in self.service.ou_accounts.get(ParentId, [])]
+        start = int(request.get('NextToken') or 0)
+        page = {"Accounts": accounts[start:start + 20]}
+        if start + 20 < len(accounts):
+            page["NextToken"] = str(start + 20)
+        return page
+
+    def list_organizational_units_for_parent(self, ParentId, **request):
+        self.service.call('list_organizational_units_for_parent')
+        return {"OrganizationalUnits": []}
+
+
+class FakeS3Store:
+    def __init__(self):
+        # (bucket, key) -> (body, metadata)
+        self.objects = {}
+        self.store_lock = threading.Lock()
+
+    def handle_request(self, request, **kwargs):
+        """
+        This method answers the S3 request from memory, it is registered
+        as before-send handler of a real S3 client
+        """
+        bucket, _, key = unquote(urlparse(request.url).path).lstrip('/').partition('/')
+        query = parse_qs(urlparse(request.url).query)
+        headers = {}
+        body = b''
+        status_code = 200
+        with self.store_lock:
+            if request.method == 'PUT':
+                request_body = request.body.read() if hasattr(request.body, 'read') else (request.body or b'')
+                if request.headers.get('If-None-Match') in ['*', b'*'] and (bucket, key) in self.objects:
+                    return self.get_error(412, 'PreconditionFailed')
+                metadata = {name[len('x-amz-meta-'):]: value.decode() if isinstance(value, bytes) else value
+                            for name, value in request.headers.items()
+                            if name.lower().startswith('x-amz-meta-')}
+                self.objects[(bucket, key)] = (request_body if isinstance(request_body, bytes) else request_body.encode(), metadata)
+                headers['ETag'] = f"\"{hashlib.md5(self.objects[(bucket, key)][0]).hexdigest()}\""
+            elif request.method == 'DELETE':
+                self.objects.pop((bucket, key), None)
+                status_code = 204
+            elif request.method in ['GET', 'HEAD'] and 'list-type' in query:
+                prefix = query.get('prefix', [''])[0]
+                contents = ''.join(f"<Contents><Key>{escape(object_key)}</Key><Size>{len(object_body)}</Size></Contents>"
+                                   for (object_bucket, object_key), (object_body, _) in sorted(self.objects.items())
+                                   if object_bucket == bucket and object_key.startswith(prefix))
+                body = (f"<?xml version=\"1.0\" encoding=\"UTF-8\"?><ListBucketResult><Name>{bucket}</Name>"
+                        f"<Prefix>{escape(prefix)}</Prefix><IsTruncated>false</IsTruncated>{contents}</ListBucketResult>").encode()
+            else:
+                if (bucket, key) not in self.objects:
+                    return self.get_error(404, 'NoSuchKey', request.method == 'HEAD')
+                object_body, metadata = self.objects[(bucket, key)]
+                headers.update({f"x-amz-meta-{name}": value for name, value in metadata.items()})
+                headers['Content-Length'] = str(len(object_body))
+                headers['ETag'] = f"\"{hashlib.md5(object_body).hexdigest()}\""
+                headers['Last-Modified'] = formatdate(usegmt=True)
+                body = object_body if request.method == 'GET' else b''
+        return AWSResponse(request.url, status_code, headers, FakeRawResponse(body))
+
+    def get_error(self, status_code, error_code, is_head=False):
+        """
+        This method returns the S3 error response of the supplied error code
+        """
+        body = b'' if is_head else f"<Error><Code>{error_code}</Code><Message>{error_code}</Message></Error>".encode()
+        return AWSResponse('', status_code, {}, FakeRawResponse(body))
+
+
+class FakeRawResponse(io.BytesIO):
+    def stream(self, **kwargs):
+        yield self.getvalue()
+
+
+class FakeSession:
+    def __init__(self, service, region='us-east-1'):
+        self.service = service
+        self.s3_store = FakeS3Store()
+        self.boto3_session = boto3.Session(aws_access_key_id='fake', aws_secret_access_key='fake', region_name=region)
+        self.cf_client = FakeCloudFormationClient(service)
+        self.org_client = FakeOrganizationsClient(service)
+
+    def client(self, service_name, *args, **kwargs):
+        """
+        This method returns the simulated client of the supplied service
+        """
+        if service_name == 'cloudformation':
+            return self.cf_client
+        if service_name == 'organizations':
+            return self.org_client
+        if service_name == 's3':
+            return self.resource('s3', *args, **kwargs).meta.client
+        raise Exception(f"Service {service_name} is not simulated")
+
+    def resource(self, service_name, *args, **kwargs):
+        """
+        This method returns a real boto3 resource whose requests
+        are answered by the in memory S3 store
+        """
+        # path style addressing keeps the bucket name in the request path and
+        # without checksums the request bodies are sent as is, not aws-chunked
+        s3_config = Config(s3={'addressing_style': 'path'}, request_checksum_calculation='when_required')
+        kwargs['config'] = kwargs['config'].merge(s3_config) if kwargs.get('config') else s3_config
+        resource = self.boto3_session.resource(service_name, *args, **kwargs)
+        resource.meta.client.meta.events.register('before-send.s3', self.s3_store.handle_request)
+        return resource
@@ -0,0 +1,308 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+run_benchmarks.py measures the stack set deployer against the simulated
+StackSets service of fake_stacksets.py, without an AWS account.
+
+Every scenario runs the deployer code path on a simulated organization of
+the selected scale and reports the wall clock time and the number of API
+calls received by the simulated service (retries included) as a table and,
+optionally, as a JSON file to compare runs before and after a change.
+
+Scales:
+
+small   1 Org Unit x 5 accounts x 2 regions = 10 stack instances
+medium  10 Org Units x 10 accounts x 10 regions = 1,000 stack instances
+large   50 Org Units x 100 accounts x 10 regions = 50,000 stack instances
+
+Scenarios:
+
+inventory      list the stack sets of the organization
+list_instances list the stack instances of a stack set
+diff           plan the operations of a stack set gaining a region
+deploy_create  AutoDeployer run creating the stack sets
+plan           AutoDeployer plan run of the stack sets gaining a region
+deploy_update  AutoDeployer run updating the stack sets to a new region
+deploy_noop    AutoDeployer run with unchanged templates
+undeploy       AutoDeployer run deleting the stack sets
+health         drift and health sweep of the stack sets matching a prefix
+teardown       bulk teardown of the stack sets matching a prefix
+"""
+
+import os
+import sys
+import json
+import shutil
+import logging
+import argparse
+import tempfile
+from time import monotonic
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_PATH, 'prereqs', 'deployer', 'deploy_scripts'))
+
+import deploy
+import stackset_deployer
+import config_model
+import stackset_teardown
+import stackset_health
+import fake_stacksets
+
+LOGGER = logging.getLogger()
+
+SCALES = {
+            "small": {"ou_count": 1, "accounts_per_ou": 5, "region_count": 2},
+            "medium": {"ou_count": 10, "accounts_per_ou": 10, "region_count": 10},
+            "large": {"ou_count": 50, "accounts_per_ou": 100, "region_count": 10}
+         }
+SCENARIOS = ['inventory', 'list_instances', 'diff', 'deploy_create', 'plan', 'deploy_update', 'deploy_noop', 'undeploy', 'health', 'teardown']
+REGIONS = ['us-east-1', 'us-east-2', 'us-west-1', 'us-west-2', 'eu-west-1',
+           'eu-west-2', 'eu-central-1', 'ap-south-1', 'ap-southeast-1', 'ap-northeast-1', 'sa-east-1']
+DEPLOYMENT_CONFIG_FILE = os.path.join(REPO_PATH, 'prereqs', 'app_prereqs', 'deploy_configs', 'deployment_config.json')
+APP_NAME = 'benchmark'
+ARTIFACT_BUCKET = 'benchmark-artifacts'
+
+
+class BenchmarkWorkspace:
+    def __init__(self, service, args):
+        self.service = service
+        self.args = args
+        self.work_dir = tempfile.mkdtemp(prefix='stackset_benchmark_')
+        self.session = fake_stacksets.FakeSession(service, args.region)
+        for folder in ['templates', 'parameters', 'deploy_configs']:
+            os.makedirs(os.path.join(self.work_dir, folder))
+
+    def write_app(self, regions, deployment_action='deploy'):
+        """
+        This method writes the templates, parameter files and deployment config
+        of the benchmark application deploying to all the Org Units and the supplied regions
+        """
+        with open(DEPLOYMENT_CONFIG_FILE) as file:
+            deployment_config = json.load(file)
+        deployment_config.update({
+                                    "deployment_action": deployment_action,
+                                    "stack_set_name": APP_NAME,
+                                    "stack_set_desciption": "Stack set deployer benchmark",
+                                    "deployment_engine": self.args.engine,
+                                    "template_stack_sets": "True",
+                                    "metrics_report_file": os.path.join(self.work_dir, 'deploy_run_report.json'),
+                                    "stackset_lock_backend": "file",
+                                    "resumable_deployments": "True",
+                                    "stackset_lock_dir": os.path.join(self.work_dir, 'stackset_locks'),
+                                    "waiter_initial_delay": self.args.waiter_delay,
+                                    "waiter_max_delay": self.args.waiter_delay * 8,
+                                    "progress_poll_interval": self.args.waiter_delay
+                                 })
+        for environment in self.args.environments:
+            deployment_config["deployment_targets"][config_model.get_env_key(environment)] = {
+                                                                                               "org_units": self.service.get_ou_ids(),
+                                                                                               "regions": regions,
+                                                                                               "filter_accounts": [],
+                                                                                               "filter_type": ""
+                                                                                           }
+        for name, value in self.args.config_overrides:
+            deployment_config[name] = value
+        with open(os.path.join(self.work_dir, 'deploy_configs', 'deployment_config.json'), 'w') as file:
+            json.dump(deployment_config, file, indent=4)
+
+        for template_index in range(self.args.templates):
+            with open(os.path.join(self.work_dir, 'templates', f"app{template_index}.yml"), 'w') as file:
+                file.write("Resources:\n  Topic:\n    Type: AWS::SNS::Topic\n")
+            for environment in self.args.environments:
+                with open(os.path.join(self.work_dir, 'parameters', f"app{template_index}-parameter-{environment}.json"), 'w') as file:
+                    json.dump({"Parameters": {"Name": f"app{template_index}"}}, file)
+
+    def run_auto_deployer(self, is_plan=False):
+        """
+        This method runs the AutoDeployer of the benchmark application in the workspace
+        """
+        current_dir = os.getcwd()
+        os.chdir(self.work_dir)
+        try:
+            deploy.AutoDeployer(','.join(self.args.environments), self.args.region, ARTIFACT_BUCKET, APP_NAME, self.session,
+                                is_plan=is_plan).deploy()
+        finally:
+            os.chdir(current_dir)
+
+    def get_deployer(self):
+        """
+        This method returns a Deployer of the first benchmark stack set on the simulated service
+        """
+        ss_deployer = stackset_deployer.Deployer(self.args.environments[0], self.args.region,
+                                                 cf_client=self.session.cf_client,
+                                                 org_resolver=deploy.target_diff.OrganizationResolver(self.session.org_client))
+        ss_deployer.deployment_configs = ss_deployer.get_deployment_configs(os.path.join(self.work_dir, 'deploy_configs', 'deployment_config.json'))
+        ss_deployer.stack_set_name = ss_deployer.get_stack_set_name()
+        return ss_deployer
+
+    def run_teardown(self, prefix):
+        """
+        This method runs the bulk teardown of the stack sets matching the supplied prefix
+        """
+        stackset_teardown.teardown_stack_sets(self.args.region, os.path.join(self.work_dir, 'deploy_configs', 'deployment_config.json'),
+                                              prefix=prefix, s3_bucket=ARTIFACT_BUCKET, session=self.session, is_confirmed=True)
+
+    def run_health_sweep(self, prefix):
+        """
+        This method runs the drift and health sweep of the stack sets matching the supplied prefix
+        """
+        stackset_health.sweep_stack_sets(self.args.region, os.path.join(self.work_dir, 'deploy_configs', 'deployment_config.json'),
+                                         prefix=prefix, report_file=os.path.join(self.work_dir, 'stackset_health.json'),
+                                         session=self.session)
+
+    def cleanup(self):
+        """
+        This method removes the workspace
+        """
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+def get_scenarios(workspace, regions):
+    """
+    This function returns the (setup, run) functions of every scenario,
+    setup prepares the simulated service and is not measured
+    """
+    service = workspace.service
+    stack_set_name = f"{APP_NAME}-{workspace.args.environments[0]}"
+    new_regions = REGIONS[:len(regions) + 1]
+
+    def seed_stack_sets():
+        workspace.write_app(regions)
+        service.seed_stack_set(stack_set_name, regions=regions)
+        for stack_set_index in range(workspace.args.stack_sets - 1):
+            service.seed_stack_set(f"other-{stack_set_index:04d}", ou_ids=[], regions=[])
+
+    def seed_teardown_stack_sets():
+        workspace.write_app(regions, 'delete')
+        for stack_set_index in range(workspace.args.templates):
+            service.seed_stack_set(f"{APP_NAME}-teardown-{stack_set_index:04d}", regions=regions)
+
+    def plan_diff():
+        ss_deployer = workspace.get_deployer()
+        return ss_deployer.plan_deployment_operations(*ss_deployer.get_deployment_targets())
+
+    return {
+                "inventory": (seed_stack_sets, lambda: workspace.get_deployer().get_current_stacksets()),
+                "list_instances": (seed_stack_sets, lambda: workspace.get_deployer().get_stack_instances(stack_set_name)),
+                "diff": (lambda: (seed_stack_sets(), workspace.write_app(new_regions)), plan_diff),
+                "deploy_create": (lambda: workspace.write_app(regions), workspace.run_auto_deployer),
+                "deploy_update": (lambda: workspace.write_app(new_regions), workspace.run_auto_deployer),
+                "deploy_noop": (lambda: workspace.write_app(new_regions), workspace.run_auto_deployer),
+                "plan": (lambda: workspace.write_app(new_regions), lambda: workspace.run_auto_deployer(is_plan=True)),
+                "undeploy": (lambda: workspace.write_app(new_regions, 'delete'), workspace.run_auto_deployer),
+                "health": (seed_teardown_stack_sets, lambda: workspace.run_health_sweep(f"{APP_NAME}-teardown-")),
+                "teardown": (seed_teardown_stack_sets, lambda: workspace.run_teardown(f"{APP_NAME}-teardown-"))
+           }
+
+
+def run_benchmarks(args):
+    """
+    This function runs the selected scenarios at the selected scale
+    and returns their results
+    """
+    scale = SCALES[args.scale]
+    regions = REGIONS[:scale["region_count"]]
+    service = fake_stacksets.FakeStackSetsService(ou_count=scale["ou_count"],
+                                                  accounts_per_ou=scale["accounts_per_ou"],
+                                                  regions=REGIONS,
+                                                  api_latency=args.api_latency,
+                                                  operation_duration=args.operation_duration,
+                                                  throttle_rate=args.throttle_rate,
+                                                  drift_rate=args.drift_rate,
+                                                  seed=args.seed)
+    workspace = BenchmarkWorkspace(service, args)
+    results = []
+    try:
+        scenarios = get_scenarios(workspace, regions)
+        # the deploy scenarios build on each other, the read scenarios run on their own seeded stack sets
+        for scenario in args.scenarios:
+            setup, run = scenarios[scenario]
+            if scenario in ['inventory', 'list_instances', 'diff']:
+                service.stack_sets.clear()
+                service.stack_instances.clear()
+            setup()
+            service.api_counter.reset()
+            started = monotonic()
+            error = None
+            try:
+                run()
+            except Exception as excep:
+                error = str(excep)
+                LOGGER.error(f"Scenario {scenario} failed: {error}")
+            api_calls = service.api_counter.get_counts()
+            results.append({
+                                "scenario": scenario,
+                                "scale": args.scale,
+                                "engine": args.engine,
+                                "stack_instances": scale["ou_count"] * scale["accounts_per_ou"] * scale["region_count"],
+                                "wall_clock_seconds": round(monotonic() - started, 3),
+                                "api_call_count": sum(api_calls.values()),
+                                "api_calls": api_calls,
+                                "error": error
+                           })
+    finally:
+        workspace.cleanup()
+    return results
+
+
+def print_results(results):
+    """
+    This function prints the results as a table
+    """
+    print(f"{'scenario':<16}{'scale':<8}{'engine':<8}{'instances':>10}{'seconds':>10}{'api calls':>11}  top APIs")
+    for result in results:
+        top_apis = ", ".join(f"{api_method}={count}" for api_method, count in
+                             sorted(result["api_calls"].items(), key=lambda item: -item[1])[:3])
+        status = f"  FAILED: {result['error']}" if result["error"] else ""
+        print(f"{result['scenario']:<16}{result['scale']:<8}{result['engine']:<8}{result['stack_instances']:>10}"
+              f"{result['wall_clock_seconds']:>10.3f}{result['api_call_count']:>11}  {top_apis}{status}")
+
+
+def parse_config_override(override):
+    """
+    This function parses a name=value deployment config override,
+    the value is read as JSON when possible
+    """
+    name, _, value = override.partition('=')
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        return name, value
+
+
+def main():
+    """
+    This is main function running the benchmarks from the command line
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the stack set deployer against a simulated StackSets service")
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small', help="size of the simulated organization")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS, help="scenarios to run, in order")
+    parser.add_argument('--engine', choices=deploy.DEPLOYMENT_ENGINES, default='threads', help="deployment engine")
+    parser.add_argument('--env', dest='environments', type=lambda env: env.split(','), default=['dev'],
+                        help="environment, or comma separated environments deployed in one run, the read scenarios use the first")
+    parser.add_argument('--templates', type=int, default=2, help="number of templates of the benchmark application and of stack sets of the health and teardown scenarios")
+    parser.add_argument('--stack-sets', type=int, default=100, help="number of stack sets in the organization for the read scenarios")
+    parser.add_argument('--api-latency', type=float, default=0.02, help="simulated latency of every API call in seconds")
+    parser.add_argument('--operation-duration', type=float, default=0.5, help="simulated duration of every stack set operation in seconds")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="fraction of the API calls failing with throttling")
+    parser.add_argument('--drift-rate', type=float, default=0.05, help="fraction of the stack instances found drifted by a drift detection")
+    parser.add_argument('--waiter-delay', type=float, default=0.1, help="initial waiter delay and progress poll interval in seconds")
+    parser.add_argument('--config', dest='config_overrides', type=parse_config_override, action='append', default=[],
+                        metavar='NAME=VALUE', help="deployment config override, e.g. api_rate_limit=50")
+    parser.add_argument('--region', default='us-east-1', help="region of the simulated pipeline")
+    parser.add_argument('--seed', type=int, default=None, help="seed of the simulated throttling")
+    parser.add_argument('--output', help="JSON file to write the results to")
+    parser.add_argument('--verbose', action='store_true', help="show the deployer logs")
+    args = parser.parse_args()
+
+    LOGGER.setLevel(logging.INFO if args.verbose else logging.CRITICAL)
+    results = run_benchmarks(args)
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=4)
+    return 1 if any(result["error"] for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
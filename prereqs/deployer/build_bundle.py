@@ -0,0 +1,164 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+build_bundle.py builds ou_deployer.pyz, a self-contained zipapp of the
+deployer scripts and their pinned dependencies, so a deploy stage
+downloads and runs a single file instead of installing boto3 and
+unzipping the deployer.
+
+The dependencies of requirements.txt are vendored from wheels, without the
+API models of the AWS services the deployer does not call, and the bundle
+is built deterministically: the same sources and requirements always give
+the same file, identified by the content hash stored in its BUNDLE_ID.
+
+This python module takes below inputs
+
+1. Output file of the bundle (default ou_deployer.pyz)
+2. Requirements file of the vendored dependencies (default requirements.txt)
+"""
+
+import os
+import sys
+import stat
+import hashlib
+import argparse
+import logging
+import tempfile
+import subprocess
+import zipfile
+
+LOGGER = logging.getLogger()
+
+DEPLOYER_PATH = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = 'deploy_scripts'
+VENDOR_DIR = 'vendor'
+SHEBANG = b'#!/usr/bin/env python3\n'
+# the API models of the services called by the deployer, sts and sso resolve credentials
+BUNDLED_SERVICES = ['cloudformation', 's3', 'organizations', 'sts', 'sso', 'sso-oidc']
+BUNDLED_RESOURCES = ['s3']
+EXCLUDED_DIRS = ['__pycache__', 'bin']
+# zip entries carry a fixed timestamp so the bundle only depends on its content
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+def install_dependencies(requirements_file, target_dir):
+    """
+    This function installs the pinned dependencies of the
+    requirements file from wheels into the target directory
+    """
+    try:
+        subprocess.run([sys.executable, '-m', 'pip', 'install', '--quiet', '--no-deps', '--no-compile',
+                        '--only-binary=:all:', '--target', target_dir, '-r', requirements_file],
+                       capture_output=True, text=True, check=True)
+    except subprocess.CalledProcessError as excep:
+        error_msg = f"Error while installing the dependencies of {requirements_file}: {excep.stderr.strip()}"
+        raise Exception(error_msg)
+
+
+def is_bundled(relative_path):
+    """
+    This function checks whether a vendored file is part of the bundle,
+    the API models of the services the deployer does not call are left out
+    """
+    parts = relative_path.split('/')
+    if any(part in EXCLUDED_DIRS or part.endswith('.dist-info') for part in parts[:-1]):
+        return False
+    if parts[:2] == ['botocore', 'data'] and len(parts) > 3:
+        return parts[2] in BUNDLED_SERVICES
+    if parts[:2] == ['boto3', 'data'] and len(parts) > 3:
+        return parts[2] in BUNDLED_RESOURCES
+    return True
+
+
+def list_files(root_path, arc_prefix, is_included=lambda relative_path: True):
+    """
+    This function returns the (archive name, file path) of the files under the
+    supplied directory accepted by is_included, compiled files excluded
+    """
+    files = []
+    for dir_path, dir_names, file_names in os.walk(root_path):
+        dir_names[:] = [dir_name for dir_name in dir_names if dir_name not in EXCLUDED_DIRS]
+        for file_name in file_names:
+            if file_name.endswith(('.pyc', '.pyo')):
+                continue
+            file_path = os.path.join(dir_path, file_name)
+            relative_path = os.path.relpath(file_path, root_path).replace(os.sep, '/')
+            if is_included(relative_path):
+                files.append((f"{arc_prefix}/{relative_path}", file_path))
+    return files
+
+
+def get_bundle_id(files):
+    """
+    This function returns the content hash of the supplied bundle files
+    """
+    bundle_hash = hashlib.sha256()
+    for arc_name, file_path in sorted(files):
+        bundle_hash.update(arc_name.encode('utf-8') + b'\0')
+        with open(file_path, 'rb') as file:
+            bundle_hash.update(hashlib.sha256(file.read()).digest())
+    return bundle_hash.hexdigest()[:16]
+
+
+def write_bundle(output_file, files, bundle_id):
+    """
+    This function writes the supplied files and the bundle id
+    to an executable zipapp
+    """
+    with open(output_file, 'wb') as file:
+        file.write(SHEBANG)
+        with zipfile.ZipFile(file, 'w', compression=zipfile.ZIP_DEFLATED) as bundle:
+            for arc_name, file_path in sorted(files):
+                with open(file_path, 'rb') as source:
+                    content = source.read()
+                bundle.writestr(zipfile.ZipInfo(arc_name, ZIP_DATE_TIME), content, zipfile.ZIP_DEFLATED)
+            bundle.writestr(zipfile.ZipInfo('BUNDLE_ID', ZIP_DATE_TIME), f"{bundle_id}\n")
+    os.chmod(output_file, os.stat(output_file).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def build_bundle(output_file, requirements_file):
+    """
+    This function builds the deployer bundle and returns its bundle id
+    """
+    with tempfile.TemporaryDirectory() as vendor_path:
+        LOGGER.info(f"Vendoring the dependencies of {requirements_file}")
+        install_dependencies(requirements_file, vendor_path)
+        files = [('__main__.py', os.path.join(DEPLOYER_PATH, 'bundle_main.py'))]
+        files.extend(list_files(os.path.join(DEPLOYER_PATH, SCRIPTS_DIR), SCRIPTS_DIR,
+                                lambda relative_path: relative_path.endswith('.py')))
+        files.extend(list_files(vendor_path, VENDOR_DIR, is_bundled))
+        bundle_id = get_bundle_id(files)
+        write_bundle(output_file, files, bundle_id)
+    LOGGER.info(f"Bundle {bundle_id} of {len(files)} file(s) written to {output_file}, "
+                f"{os.path.getsize(output_file) / (1024 * 1024):.1f} MB")
+    return bundle_id
+
+
+def main(args):
+    """
+    This is main function triggers the build of the deployer bundle
+    """
+    build_bundle(args.output, args.requirements)
+
+
+if __name__ == "__main__":
+    FORMAT = '%(asctime)s %(levelname)s %(message)s'
+    logging.basicConfig(format=FORMAT,
+                        datefmt="%Y-%m-%d %H:%M:%S",
+                        handlers=[logging.StreamHandler(sys.stdout)]
+                        )
+    LOGGER.setLevel(logging.INFO)
+
+    parser = argparse.ArgumentParser(prog='build_bundle.py',
+                                     usage='%(prog)s [--output <bundle file>] [--requirements <requirements file>]',
+                                     description="Delegated Admin Service Managed Stack Set Deployer Bundle Builder")
+    parser.add_argument('--output',
+                        action='store',
+                        type=str,
+                        default=os.path.join(os.getcwd(), 'ou_deployer.pyz'))
+    parser.add_argument('--requirements',
+                        action='store',
+                        type=str,
+                        default=os.path.join(DEPLOYER_PATH, 'requirements.txt'))
+    arguments = parser.parse_args()
+    main(arguments)
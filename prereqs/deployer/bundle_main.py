@@ -0,0 +1,68 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+bundle_main.py is the __main__.py of the ou_deployer.pyz bundle built by
+build_bundle.py.
+
+botocore reads its API models from files, so the bundle is extracted once
+to a directory named after its content hash and the following runs on the
+same host reuse it. The first argument selects the script run, deploy
+(the default), teardown or health, the remaining arguments are passed to it.
+
+    python ou_deployer.pyz --env dev --region us-east-1 --s3_bucket <bucket> --app_name <app>
+    python ou_deployer.pyz teardown --region us-east-1 --prefix <stack set name prefix> --yes
+    python ou_deployer.pyz health --region us-east-1 --prefix <stack set name prefix>
+"""
+
+import os
+import sys
+import runpy
+import shutil
+import zipfile
+import tempfile
+
+ENTRY_POINTS = {'deploy': 'deploy.py', 'teardown': 'stackset_teardown.py', 'health': 'stackset_health.py'}
+DEFAULT_ENTRY_POINT = 'deploy'
+
+
+def get_bundle_dir(bundle_file):
+    """
+    This function returns the directory the supplied bundle is extracted to,
+    extracting it when no previous run on this host did
+    """
+    cache_dir = os.environ.get('OU_DEPLOYER_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'ou_deployer'))
+    with zipfile.ZipFile(bundle_file) as bundle:
+        bundle_id = bundle.read('BUNDLE_ID').decode('utf-8').strip()
+        bundle_dir = os.path.join(cache_dir, bundle_id)
+        if os.path.isdir(bundle_dir):
+            return bundle_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        staging_dir = tempfile.mkdtemp(prefix=f"{bundle_id}.", dir=cache_dir)
+        bundle.extractall(staging_dir)
+    try:
+        # the rename is atomic, an existing bundle directory is always complete
+        os.rename(staging_dir, bundle_dir)
+    except OSError:
+        # a concurrent run extracted the same bundle first
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    return bundle_dir
+
+
+def main():
+    """
+    This is main function runs the selected deployer script from the extracted
+    bundle, with the vendored dependencies ahead of any installed ones
+    """
+    bundle_file = os.path.dirname(os.path.abspath(__file__))
+    args = sys.argv[1:]
+    entry_point = args.pop(0) if args and args[0] in ENTRY_POINTS else DEFAULT_ENTRY_POINT
+    bundle_dir = get_bundle_dir(bundle_file)
+    scripts_dir = os.path.join(bundle_dir, 'deploy_scripts')
+    sys.path[:0] = [scripts_dir, os.path.join(bundle_dir, 'vendor')]
+    script_file = os.path.join(scripts_dir, ENTRY_POINTS[entry_point])
+    sys.argv = [script_file] + args
+    runpy.run_path(script_file, run_name='__main__')
+
+
+if __name__ == "__main__":
+    main()
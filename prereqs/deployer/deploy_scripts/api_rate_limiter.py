@@ -0,0 +1,274 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+api_rate_limiter.py wraps the CloudFormation client with a shared
+rate limiter and a throttling aware retry layer.
+
+Every API call, including each page fetched through a paginator, takes a
+token from the global token bucket and, when a budget is configured for the
+API, from the token bucket of the API. Calls failing with throttling errors
+or with StackSetNotFoundException right after the stack set was created are
+retried with exponential backoff and jitter. Mutating calls failing with
+OperationInProgressException are retried as well, a bounded number of times,
+unless the caller opts out to skip the call or wait for the operation in
+progress itself. Calls, retries and wait times are counted per API.
+One wrapped client is shared by all the deployers of a run, the async engine
+draws from the same token buckets and applies the same retry policy.
+"""
+
+import random
+import logging
+import threading
+from time import sleep, monotonic
+
+LOGGER = logging.getLogger()
+
+DEFAULT_API_RATE_LIMIT = 10
+DEFAULT_API_BURST_LIMIT = 20
+DEFAULT_API_MAX_RETRIES = 8
+DEFAULT_API_RETRY_BASE_DELAY = 1
+DEFAULT_API_RETRY_MAX_DELAY = 30
+DEFAULT_API_IN_PROGRESS_MAX_RETRIES = 20
+
+THROTTLING_ERROR_CODES = ['Throttling', 'ThrottlingException', 'TooManyRequestsException', 'RequestLimitExceeded']
+STACK_SET_NOT_FOUND_ERROR_CODES = ['StackSetNotFoundException']
+OPERATION_IN_PROGRESS_ERROR_CODES = ['OperationInProgressException']
+# API methods starting a stack set operation, retried while another operation is in progress
+MUTATING_API_METHODS = ['create_stack_set', 'update_stack_set', 'delete_stack_set', 'create_stack_instances',
+                        'update_stack_instances', 'delete_stack_instances', 'detect_stack_set_drift']
+
+
+def get_client_error():
+    """
+    This function returns the botocore ClientError class, botocore is
+    imported on first use so a run failing its input validation never loads it
+    """
+    from botocore.exceptions import ClientError
+    return ClientError
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = monotonic()
+        self.bucket_lock = threading.Lock()
+
+    def reserve(self):
+        """
+        This method takes a token from the bucket and returns the time to wait
+        before using it, zero when a token is available. An empty bucket goes
+        into debt, so the callers are served in the order of their reservations
+        """
+        with self.bucket_lock:
+            now = monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self):
+        """
+        This method takes a token from the bucket, waiting until one is
+        refilled when the bucket is empty, and returns the time waited
+        """
+        delay = self.reserve()
+        if delay:
+            sleep(delay)
+        return delay
+
+
+class RateLimitedPaginator:
+    def __init__(self, client, api_method):
+        self.client = client
+        self.api_method = api_method
+
+    def paginate(self, **request):
+        """
+        This method yields the pages of the API method, every page
+        is fetched through the rate limited client
+        """
+        while True:
+            page = self.client.call(self.api_method, **request)
+            self.client.record_call(self.api_method, is_page=True)
+            yield page
+            if not page.get('NextToken'):
+                return
+            request = dict(request, NextToken=page['NextToken'])
+
+
+class RateLimitedClient:
+    def __init__(self, client, rate=DEFAULT_API_RATE_LIMIT, burst=DEFAULT_API_BURST_LIMIT, api_budgets=None,
+                 max_retries=DEFAULT_API_MAX_RETRIES, retry_base_delay=DEFAULT_API_RETRY_BASE_DELAY,
+                 retry_max_delay=DEFAULT_API_RETRY_MAX_DELAY, in_progress_max_retries=DEFAULT_API_IN_PROGRESS_MAX_RETRIES):
+        self.client = client
+        self.global_bucket = TokenBucket(rate, burst)
+        # API method -> token bucket of the API
+        self.api_buckets = {api_method: TokenBucket(float(budget['rate']), float(budget.get('burst', budget['rate'])))
+                            for api_method, budget in (api_budgets or {}).items()}
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.in_progress_max_retries = in_progress_max_retries
+        # stack sets created through this client and not yet visible to the other APIs
+        self.created_stack_sets = set()
+        self.api_stats = {}
+        self.stats_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, client, deployment_configs):
+        """
+        This method creates the rate limited client from the API settings
+        of the deployment config, missing settings use the defaults.
+        """
+        try:
+            return cls(client,
+                       rate=deployment_configs.get_value('api_rate_limit', DEFAULT_API_RATE_LIMIT),
+                       burst=deployment_configs.get_value('api_burst_limit', DEFAULT_API_BURST_LIMIT),
+                       api_budgets=deployment_configs.get_value('api_rate_limits', {}),
+                       max_retries=deployment_configs.get_value('api_max_retries', DEFAULT_API_MAX_RETRIES),
+                       retry_base_delay=deployment_configs.get_value('api_retry_base_delay', DEFAULT_API_RETRY_BASE_DELAY),
+                       retry_max_delay=deployment_configs.get_value('api_retry_max_delay', DEFAULT_API_RETRY_MAX_DELAY),
+                       in_progress_max_retries=deployment_configs.get_value('api_in_progress_max_retries', DEFAULT_API_IN_PROGRESS_MAX_RETRIES))
+        except Exception as excep:
+            error_msg = f"Error while reading the API rate limit settings from deployment config: {str(excep)}"
+            raise Exception(error_msg)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not callable(attribute) or name.startswith('_') or name in ['can_paginate', 'get_waiter']:
+            return attribute
+        return lambda **request: self.call(name, **request)
+
+    def get_paginator(self, api_method):
+        """
+        This method returns a paginator fetching every page
+        through the rate limited client
+        """
+        return RateLimitedPaginator(self, api_method)
+
+    def is_retryable(self, api_method, request, error_code, retry_in_progress=True):
+        """
+        This method checks whether the supplied error of the API call is retried
+        """
+        if error_code in THROTTLING_ERROR_CODES:
+            return True
+        if error_code in OPERATION_IN_PROGRESS_ERROR_CODES:
+            return retry_in_progress and api_method in MUTATING_API_METHODS
+        if error_code in STACK_SET_NOT_FOUND_ERROR_CODES:
+            # a new stack set can take a moment to be visible to the other APIs
+            with self.stats_lock:
+                return request.get('StackSetName') in self.created_stack_sets
+        return False
+
+    def get_retry_delay(self, attempt):
+        """
+        This method returns the delay before the next retry, growing
+        exponentially with full jitter up to the retry max delay
+        """
+        return random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * (2 ** attempt)))
+
+    def reserve(self, api_method):
+        """
+        This method takes a token of the global bucket and of the bucket
+        of the API method, and returns the time to wait before the call
+        """
+        throttle_wait = self.global_bucket.reserve()
+        api_bucket = self.api_buckets.get(api_method)
+        if api_bucket:
+            throttle_wait = max(throttle_wait, api_bucket.reserve())
+        return throttle_wait
+
+    def get_retry_wait(self, api_method, request, excep, attempt, retry_in_progress=True):
+        """
+        This method returns the time to wait before retrying the API call
+        which failed with the supplied error, None when it is not retried,
+        and records the retry
+        """
+        error_code = excep.response['Error']['Code']
+        max_retries = self.in_progress_max_retries if error_code in OPERATION_IN_PROGRESS_ERROR_CODES else self.max_retries
+        if attempt >= max_retries or not self.is_retryable(api_method, request, error_code, retry_in_progress):
+            return None
+        retry_wait = self.get_retry_delay(attempt)
+        LOGGER.warning(f"{api_method} failed with {error_code}, retry {attempt + 1} of {max_retries} in {retry_wait:.1f}s")
+        self.record_call(api_method, retry_wait=retry_wait, is_retry=True, is_throttled=error_code in THROTTLING_ERROR_CODES)
+        return retry_wait
+
+    def record_success(self, api_method, request):
+        """
+        This method records the stack set created by the successful API call,
+        until another API call of the stack set succeeds
+        """
+        stackset_name = request.get('StackSetName')
+        if stackset_name:
+            with self.stats_lock:
+                if api_method == 'create_stack_set':
+                    self.created_stack_sets.add(stackset_name)
+                else:
+                    self.created_stack_sets.discard(stackset_name)
+
+    def call(self, api_method, retry_in_progress=True, **request):
+        """
+        This method calls the supplied API method of the wrapped client
+        within the token budgets, retrying the retryable errors.
+        retry_in_progress False raises OperationInProgressException right away
+        """
+        attempt = 0
+        while True:
+            throttle_wait = self.reserve(api_method)
+            if throttle_wait:
+                sleep(throttle_wait)
+            self.record_call(api_method, throttle_wait=throttle_wait)
+            try:
+                response = getattr(self.client, api_method)(**request)
+            except get_client_error() as excep:
+                retry_wait = self.get_retry_wait(api_method, request, excep, attempt, retry_in_progress)
+                if retry_wait is None:
+                    raise
+                attempt += 1
+                sleep(retry_wait)
+                continue
+            self.record_success(api_method, request)
+            return response
+
+    def record_call(self, api_method, throttle_wait=0.0, retry_wait=0.0, is_retry=False, is_throttled=False, is_page=False):
+        """
+        This method records the call counters of the supplied API method,
+        every attempt counts as a call and the retried ones as retries,
+        pages fetched through a paginator are counted as pages
+        """
+        with self.stats_lock:
+            stats = self.api_stats.setdefault(api_method, {
+                                                                "calls": 0,
+                                                                "pages": 0,
+                                                                "retries": 0,
+                                                                "throttled": 0,
+                                                                "throttle_wait_seconds": 0.0,
+                                                                "retry_wait_seconds": 0.0
+                                                            })
+            if is_page:
+                stats["pages"] += 1
+            elif is_retry:
+                stats["retries"] += 1
+                stats["throttled"] += int(is_throttled)
+            else:
+                stats["calls"] += 1
+            stats["throttle_wait_seconds"] += throttle_wait
+            stats["retry_wait_seconds"] += retry_wait
+
+    def get_stats(self):
+        """
+        This method returns the call counters per API method
+        """
+        with self.stats_lock:
+            return {api_method: dict(stats) for api_method, stats in self.api_stats.items()}
+
+    def log_stats(self):
+        """
+        This method logs the call counters of all the called API methods
+        """
+        for api_method, stats in sorted(self.get_stats().items()):
+            LOGGER.info(f"API stats for {api_method} - Calls: {stats['calls']} - Pages: {stats['pages']} - Retries: {stats['retries']} "
+                        f"- Throttled: {stats['throttled']} - Throttle wait: {stats['throttle_wait_seconds']:.1f}s "
+                        f"- Retry wait: {stats['retry_wait_seconds']:.1f}s")
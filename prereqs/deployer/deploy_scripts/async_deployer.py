@@ -0,0 +1,166 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+async_deployer.py is the asyncio engine of the stack set deployer.
+
+AsyncDeployer runs the deployment flow of a stackset_deployer.Deployer, the
+same steps the thread engine runs, but the waits are asyncio sleeps, so one
+process can drive hundreds of stack set deployments on a single event loop.
+The CloudFormation API calls go through one shared AsyncStackSetApi: the raw
+boto3 client of the rate limited client of the run, with a sized connection
+pool, called from a thread pool within the same token buckets and with the
+same retries as the thread engine, the waits being asyncio sleeps.
+"""
+
+import asyncio
+import logging
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from stackset_deployer import Deployer, STOPPED_DEPLOYMENT_ERROR
+from deployment_flow import ApiCall, Call, Wait, Gather
+from api_rate_limiter import get_client_error
+
+LOGGER = logging.getLogger()
+
+DEFAULT_ASYNC_MAX_POOL_CONNECTIONS = 50
+
+
+class AsyncStackSetApi:
+    def __init__(self, rate_limited_client, max_pool_connections=DEFAULT_ASYNC_MAX_POOL_CONNECTIONS):
+        # the token buckets, retry policy and stats are those of the rate
+        # limited client of the run, only the waits are asyncio sleeps
+        self.rate_limited_client = rate_limited_client
+        self.cf_client = rate_limited_client.client
+        self.executor = ThreadPoolExecutor(max_workers=max_pool_connections)
+
+    @classmethod
+    def from_config(cls, rate_limited_client, deployment_config):
+        """
+        This method creates the API from the async settings
+        of the deployment config, missing settings use the defaults.
+        """
+        try:
+            return cls(rate_limited_client,
+                       max_pool_connections=deployment_config.get_value('async_max_pool_connections', DEFAULT_ASYNC_MAX_POOL_CONNECTIONS))
+        except Exception as excep:
+            error_msg = f"Error while reading the async settings from deployment config: {str(excep)}"
+            raise Exception(error_msg)
+
+    async def run_blocking(self, func, *args, **kwargs):
+        """
+        This method runs the supplied blocking function in the thread pool
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def call(self, api_method, is_page=False, retry_in_progress=True, **request):
+        """
+        This method calls the supplied CloudFormation API method within the
+        token budgets of the rate limited client, retrying the retryable errors
+        as RateLimitedClient.call does
+        """
+        attempt = 0
+        while True:
+            throttle_wait = self.rate_limited_client.reserve(api_method)
+            if throttle_wait:
+                await asyncio.sleep(throttle_wait)
+            self.rate_limited_client.record_call(api_method, throttle_wait=throttle_wait)
+            try:
+                response = await self.run_blocking(getattr(self.cf_client, api_method), **request)
+            except get_client_error() as excep:
+                retry_wait = self.rate_limited_client.get_retry_wait(api_method, request, excep, attempt, retry_in_progress)
+                if retry_wait is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(retry_wait)
+                continue
+            self.rate_limited_client.record_success(api_method, request)
+            if is_page:
+                self.rate_limited_client.record_call(api_method, is_page=True)
+            return response
+
+    def close(self):
+        """
+        This method shuts down the thread pool
+        """
+        self.executor.shutdown(wait=False)
+
+
+async def run_flow_async(flow, api):
+    """
+    This function runs the supplied deployment flow on the running event loop,
+    see deployment_flow. The API calls go through the supplied AsyncStackSetApi,
+    the blocking calls run in its thread pool and the concurrent flows run concurrently.
+    """
+    result, error = None, None
+    while True:
+        try:
+            effect = flow.send(result) if error is None else flow.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        result, error = None, None
+        try:
+            if isinstance(effect, ApiCall):
+                result = await api.call(effect.api_method, effect.is_page, effect.retry_in_progress, **effect.request)
+            elif isinstance(effect, Call):
+                result = await api.run_blocking(effect.func, *effect.args, **effect.kwargs)
+            elif isinstance(effect, Wait):
+                result = await effect.waiter.wait_async(effect.operation_name, lambda: run_flow_async(effect.check(), api))
+            elif isinstance(effect, Gather):
+                result = list(await asyncio.gather(*(run_flow_async(sub_flow, api) for sub_flow in effect.flows)))
+            else:
+                error_msg = f"Unknown deployment flow effect {type(effect).__name__}"
+                raise Exception(error_msg)
+        except Exception as excep:
+            error = excep
+
+
+class AsyncDeployer:
+    def __init__(self, env, aws_region, api, inventory=None, deployment_manifest=None, operation_history=None, stackset_queue=None,
+                 operation_journal=None, metrics=None, org_resolver=None, cf_client=None):
+        # the deployment steps are those of the Deployer, only run on the event loop.
+        # The blocking calls of the inventory, journal and history use the rate limited cf_client
+        self.deployer = Deployer(env, aws_region, inventory, deployment_manifest, operation_history, cf_client, stackset_queue,
+                                 operation_journal, metrics, org_resolver)
+        self.api = api
+
+    @property
+    def environment(self):
+        """
+        This method returns the deployment environment of the deployer
+        """
+        return self.deployer.environment
+
+    async def processor(self, cft_file, cft_parameters_file, deployment_config, template_name=None, content_hash=None):
+        """
+        This method processes the stack set deployment request on the
+        running event loop, see Deployer.processor_flow
+        """
+        await run_flow_async(self.deployer.processor_flow(cft_file, cft_parameters_file, deployment_config, template_name, content_hash),
+                             self.api)
+
+
+async def run_deployments(deployments, max_parallel_deployments, stop_event=None):
+    """
+    This function runs the processor of the supplied (AsyncDeployer, processor
+    arguments, deployment name) deployments on the running event loop, at most
+    max_parallel_deployments at a time, and returns the errors per deployment name.
+    Deployments not yet started are skipped once the stop event is set by a failure.
+    """
+    semaphore = asyncio.Semaphore(max_parallel_deployments)
+
+    async def run_deployment(ss_deployer, processor_args):
+        async with semaphore:
+            if stop_event and stop_event.is_set():
+                raise Exception(STOPPED_DEPLOYMENT_ERROR)
+            try:
+                await ss_deployer.processor(*processor_args)
+            except Exception:
+                if stop_event:
+                    stop_event.set()
+                raise
+
+    results = await asyncio.gather(*(run_deployment(ss_deployer, processor_args) for ss_deployer, processor_args, _ in deployments),
+                                   return_exceptions=True)
+    return {deployment_name: str(result)
+            for (_, _, deployment_name), result in zip(deployments, results)
+            if isinstance(result, Exception)}
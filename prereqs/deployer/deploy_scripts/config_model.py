@@ -0,0 +1,377 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+config_model.py loads the deployment config file into a DeploymentConfig,
+parsed and validated once and shared by all the templates and environments
+of a run.
+
+The values of the known keys are checked against their type when the file
+is loaded, the "True"/"False" strings are converted once, the values of the
+choice keys are lower-cased once, integers must be whole numbers and unknown
+keys are reported as likely typos. The deployers read the typed values with
+get_value and is_enabled, never parsing the raw values again. The stack set settings and the deployment
+targets of the deployed environments are validated before any template is
+staged. The deployment targets of an environment can extend those of
+another environment with "extends", e.g. prod extends test and only sets
+its own org_units, and can override the operation preferences. The
+deployment targets and operation preferences of an environment are
+compiled once, so the deployers read them without parsing the config again.
+
+A DeploymentConfig is a dict of the values of the file, so the settings
+read with .get() and the deployment content hashes are unchanged.
+"""
+
+import json
+import logging
+import threading
+
+LOGGER = logging.getLogger()
+
+ENV_KEYS = ['dev', 'test', 'prod']
+DEPLOYMENT_ACTIONS = ['deploy', 'delete']
+REGION_CONCURRENCY_TYPES = ['SEQUENTIAL', 'PARALLEL']
+CONCURRENCY_MODES = ['STRICT_FAILURE_TOLERANCE', 'SOFT_FAILURE_TOLERANCE']
+ACCOUNT_FILTER_TYPES = ['NONE', 'INTERSECTION', 'DIFFERENCE', 'UNION']
+
+# type of the value of each known key of the deployment config
+CONFIG_SCHEMA = {
+    'deployment_action': str,
+    'stack_set_name': str,
+    'stack_set_desciption': str,
+    'deployment_targets': dict,
+    'cft_capabilities': list,
+    'auto_deployement': bool,
+    'retain_stacks_on_account_removal': bool,
+    'region_deployment_concurrency': str,
+    'max_concurrent_percentage': int,
+    'failure_tolerance_percentage': int,
+    'concurrency_mode': str,
+    'managed_execution': bool,
+    'account_level_diff': bool,
+    'adaptive_operation_preferences': bool,
+    'adaptive_clean_operations': int,
+    'adaptive_max_concurrent_percentage': int,
+    'adaptive_min_concurrent_count': int,
+    'max_parallel_deployments': int,
+    'template_stack_sets': bool,
+    'teardown_max_concurrent_percentage': int,
+    'teardown_failure_tolerance_percentage': int,
+    'max_parallel_teardowns': int,
+    'max_parallel_drift_detections': int,
+    'drift_max_concurrent_percentage': int,
+    'drift_failure_tolerance_percentage': int,
+    'health_report_file': str,
+    'health_report_max_instances': int,
+    'environment_fanout': str,
+    'stop_on_failure': bool,
+    'deployment_engine': str,
+    'async_max_pool_connections': int,
+    'api_rate_limit': float,
+    'api_burst_limit': float,
+    'api_rate_limits': dict,
+    'api_max_retries': int,
+    'api_retry_base_delay': float,
+    'api_retry_max_delay': float,
+    'api_in_progress_max_retries': int,
+    'stackset_lock_backend': str,
+    'stackset_lock_dir': str,
+    'stackset_lock_ttl': float,
+    'stackset_lock_timeout': float,
+    'resumable_deployments': bool,
+    'metrics_report_file': str,
+    'plan_report_file': str,
+    'plan_batch_seconds': float,
+    'metrics_emf': bool,
+    'metrics_namespace': str,
+    'waiter_initial_delay': float,
+    'waiter_max_delay': float,
+    'waiter_backoff_rate': float,
+    'waiter_jitter': float,
+    'waiter_timeout': float,
+    'progress_poll_interval': float,
+    'progress_report_interval': float,
+    'progress_log_format': str,
+    'inventory_cache_ttl': float,
+    'skip_unchanged_deployments': bool,
+    'template_index_file': str,
+    'template_base_ref': str,
+    's3_max_concurrency': int,
+    's3_multipart_threshold_mb': float
+}
+# keys whose string values are matched case-insensitively
+CHOICE_KEYS = ['deployment_action', 'environment_fanout', 'deployment_engine', 'stackset_lock_backend', 'progress_log_format']
+# keys every stack set deployment reads
+STACK_SET_REQUIRED_KEYS = ['deployment_action', 'stack_set_name', 'stack_set_desciption', 'deployment_targets',
+                           'cft_capabilities', 'auto_deployement', 'retain_stacks_on_account_removal',
+                           'region_deployment_concurrency', 'max_concurrent_percentage', 'failure_tolerance_percentage']
+# values of the boolean keys when they are not set
+BOOLEAN_DEFAULTS = {
+    'managed_execution': False,
+    'account_level_diff': False,
+    'adaptive_operation_preferences': False,
+    'stop_on_failure': False,
+    'template_stack_sets': False,
+    'resumable_deployments': False,
+    'metrics_emf': False,
+    'skip_unchanged_deployments': True
+}
+# operation preferences an environment can override
+ENV_PREFERENCE_KEYS = ['region_deployment_concurrency', 'max_concurrent_percentage', 'failure_tolerance_percentage', 'concurrency_mode']
+# type of the value of each key of the deployment targets of an environment
+TARGET_SCHEMA = dict({
+    'org_units': list,
+    'regions': list,
+    'filter_accounts': list,
+    'filter_type': str,
+    'extends': str
+}, **{key: CONFIG_SCHEMA[key] for key in ENV_PREFERENCE_KEYS})
+TYPE_NAMES = {str: 'a string', list: 'a list', dict: 'an object', int: 'an integer', float: 'a number', bool: '"True" or "False"'}
+
+
+def get_env_key(environment):
+    """
+    This function returns the deployment config key
+    of the supplied environment name
+    """
+    if environment.lower() in ['dev', 'development']:
+        return 'dev'
+    elif environment.lower() in ['qa', 'test']:
+        return 'test'
+    elif environment.lower() in ['prod', 'production']:
+        return 'prod'
+    else:
+        error_msg = f"Invalid value for env arguement, valid values are dev, development, qa, test, prod or production"
+        raise Exception(error_msg)
+
+
+def convert_value(value, value_type):
+    """
+    This function returns the supplied config value converted to the supplied
+    type, "True"/"False" strings to booleans and numeric strings to numbers.
+    A value with a fractional part is not an integer and is rejected.
+    """
+    if value_type is bool:
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.lower() in ['true', 'false']:
+            return value.lower() == 'true'
+    elif value_type in [int, float]:
+        if not isinstance(value, bool):
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                number = None
+            if number is not None and value_type is float:
+                return number
+            if number is not None and number.is_integer():
+                return int(number)
+    elif isinstance(value, value_type):
+        return value
+    raise ValueError(f"expected {TYPE_NAMES[value_type]}, got {json.dumps(value)}")
+
+
+def convert_values(values, schema, label):
+    """
+    This function returns the values of the supplied keys of the schema converted
+    to their type and the errors of the values which do not convert
+    """
+    converted_values = {}
+    errors = []
+    for key, value in values.items():
+        if key not in schema:
+            continue
+        try:
+            converted_values[key] = convert_value(value, schema[key])
+        except ValueError as excep:
+            errors.append(f"{label}{key} {str(excep)}")
+    return converted_values, errors
+
+
+def get_preference_errors(preferences, label):
+    """
+    This function returns the errors of the supplied operation preference values
+    """
+    errors = []
+    if 'region_deployment_concurrency' in preferences and preferences['region_deployment_concurrency'] not in REGION_CONCURRENCY_TYPES:
+        errors.append(f"{label}region_deployment_concurrency must be one of {', '.join(REGION_CONCURRENCY_TYPES)}")
+    if preferences.get('concurrency_mode') and preferences['concurrency_mode'] not in CONCURRENCY_MODES:
+        errors.append(f"{label}concurrency_mode must be one of {', '.join(CONCURRENCY_MODES)}")
+    for key in ['max_concurrent_percentage', 'failure_tolerance_percentage']:
+        if key in preferences and not 0 <= preferences[key] <= 100:
+            errors.append(f"{label}{key} must be between 0 and 100")
+    return errors
+
+
+class EnvironmentConfig:
+    def __init__(self, env_key, targets, operation_preferences):
+        self.env_key = env_key
+        # deployment targets of the environment, merged with those of the extended environments
+        self.targets = targets
+        self.org_units = targets.get('org_units', [])
+        self.regions = targets.get('regions', [])
+        self.filter_accounts = targets.get('filter_accounts', [])
+        self.filter_type = targets.get('filter_type', "")
+        # OperationPreferences of the stack set operations of the environment
+        self.operation_preferences = operation_preferences
+
+
+class DeploymentConfig(dict):
+    def __init__(self, values, config_file=None):
+        super().__init__(values)
+        self.config_file = config_file
+        # typed values of the known keys
+        self.typed_values = {}
+        self.deployment_action = None
+        self.auto_deployment = None
+        self.managed_execution = None
+        self.environments = {}
+        self.environments_lock = threading.Lock()
+
+    def raise_errors(self, errors):
+        """
+        This method raises an error listing all the supplied validation errors
+        """
+        error_msg = f"Invalid deployment config {self.config_file or ''}: {'; '.join(errors)}"
+        raise Exception(error_msg)
+
+    def validate(self):
+        """
+        This method checks the values of the known keys against their type,
+        reports the unknown keys and returns the config
+        """
+        self.typed_values, errors = convert_values(self, CONFIG_SCHEMA, '')
+        for key in CHOICE_KEYS:
+            if key in self.typed_values:
+                self.typed_values[key] = self.typed_values[key].lower()
+        if errors:
+            self.raise_errors(errors)
+        unknown_keys = sorted(key for key in self if key not in CONFIG_SCHEMA)
+        if unknown_keys:
+            LOGGER.warning(f"Unknown key(s) {', '.join(unknown_keys)} in the deployment config {self.config_file or ''}, check for typos")
+        return self
+
+    def validate_stack_set(self):
+        """
+        This method checks the settings every stack set deployment reads
+        and compiles the stack set level payloads, and returns the config
+        """
+        errors = [f"{key} is missing" for key in STACK_SET_REQUIRED_KEYS if key not in self]
+        if 'deployment_action' in self.typed_values and self.typed_values['deployment_action'] not in DEPLOYMENT_ACTIONS:
+            errors.append(f"deployment_action must be one of {', '.join(DEPLOYMENT_ACTIONS)}")
+        if 'stack_set_name' in self.typed_values and not self.typed_values['stack_set_name']:
+            errors.append("stack_set_name must not be empty")
+        errors.extend(get_preference_errors(self.typed_values, ''))
+        if errors:
+            self.raise_errors(errors)
+        self.deployment_action = self.typed_values['deployment_action']
+        self.auto_deployment = {
+                                 "Enabled": self.typed_values['auto_deployement'],
+                                 "RetainStacksOnAccountRemoval": self.typed_values['retain_stacks_on_account_removal']
+                               }
+        self.managed_execution = {
+                                   "Active": self.is_enabled('managed_execution')
+                                 }
+        return self
+
+    def get_value(self, key, default=None):
+        """
+        This method returns the typed value of the supplied key,
+        the supplied default when the key is not set
+        """
+        return self.typed_values.get(key, default)
+
+    def is_enabled(self, key):
+        """
+        This method returns the value of the supplied boolean key,
+        its default when the key is not set
+        """
+        return self.typed_values.get(key, BOOLEAN_DEFAULTS.get(key, False))
+
+    def get_targets(self, env_key, extending_keys=()):
+        """
+        This method returns the deployment targets of the supplied environment
+        merged over the deployment targets of the environment it extends
+        """
+        if env_key in extending_keys:
+            self.raise_errors([f"deployment_targets extends cycle {' -> '.join(extending_keys + (env_key,))}"])
+        all_targets = self.typed_values.get('deployment_targets', {})
+        if env_key not in all_targets:
+            self.raise_errors([f"deployment_targets.{env_key} is missing"])
+        if not isinstance(all_targets[env_key], dict):
+            self.raise_errors([f"deployment_targets.{env_key} expected an object"])
+        env_targets, errors = convert_values(all_targets[env_key], TARGET_SCHEMA, f"deployment_targets.{env_key}.")
+        unknown_keys = sorted(key for key in all_targets[env_key] if key not in TARGET_SCHEMA)
+        errors.extend(f"deployment_targets.{env_key}.{key} is not a valid key" for key in unknown_keys)
+        if errors:
+            self.raise_errors(errors)
+        if 'extends' not in env_targets:
+            return env_targets
+        try:
+            extended_key = get_env_key(env_targets['extends'])
+        except Exception:
+            self.raise_errors([f"deployment_targets.{env_key}.extends must be one of {', '.join(ENV_KEYS)}"])
+        targets = dict(self.get_targets(extended_key, extending_keys + (env_key,)))
+        targets.update((key, value) for key, value in env_targets.items() if key != 'extends')
+        return targets
+
+    def compile_environment(self, env_key):
+        """
+        This method validates the deployment targets of the supplied environment
+        and compiles its operation preferences
+        """
+        targets = self.get_targets(env_key)
+        errors = get_preference_errors(targets, f"deployment_targets.{env_key}.")
+        if not targets.get('org_units'):
+            errors.append("Organization Units is mandatory parameter supplied for deployment targets, please check deployment configuration file.")
+        if targets.get('filter_type') and targets['filter_type'] not in ACCOUNT_FILTER_TYPES:
+            errors.append(f"deployment_targets.{env_key}.filter_type must be one of {', '.join(ACCOUNT_FILTER_TYPES)}")
+        if errors:
+            self.raise_errors(errors)
+
+        preferences = {key: targets.get(key, self.typed_values.get(key)) for key in ENV_PREFERENCE_KEYS}
+        operation_preferences = {
+                                    "RegionConcurrencyType": preferences['region_deployment_concurrency'],
+                                    "MaxConcurrentPercentage": preferences['max_concurrent_percentage'],
+                                    "FailureTolerancePercentage": preferences['failure_tolerance_percentage']
+                                }
+        if preferences['concurrency_mode']:
+            operation_preferences["ConcurrencyMode"] = preferences['concurrency_mode']
+        return EnvironmentConfig(env_key, targets, operation_preferences)
+
+    def get_environment(self, environment):
+        """
+        This method returns the compiled config of the supplied environment,
+        compiled on first use and shared by the deployers of the environment
+        """
+        env_key = get_env_key(environment)
+        with self.environments_lock:
+            if env_key not in self.environments:
+                self.environments[env_key] = self.compile_environment(env_key)
+            return self.environments[env_key]
+
+    def get_env_targets(self, env_key):
+        """
+        This method returns the deployment targets of the supplied environment
+        included in its deployment content hash, with the extended targets merged
+        in when the environment extends another one
+        """
+        env_targets = self.get('deployment_targets', {}).get(env_key)
+        if isinstance(env_targets, dict) and 'extends' in env_targets:
+            return self.get_environment(env_key).targets
+        return env_targets
+
+
+def load_deployment_config(config_file):
+    """
+    This function reads and validates the deployment config file
+    """
+    try:
+        with open(config_file) as file:
+            values = json.load(file)
+    except Exception as excep:
+        error_msg = f"Error while parsing the deployment config file {config_file}: {str(excep)}"
+        raise Exception(error_msg)
+    if not isinstance(values, dict):
+        error_msg = f"Error while parsing the deployment config file {config_file}: expected a JSON object"
+        raise Exception(error_msg)
+    return DeploymentConfig(values, config_file).validate()
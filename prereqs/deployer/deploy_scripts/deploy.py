@@ -15,12 +15,30 @@ This python module takes below inputs
 """
 
 import os
+import re
 import sys
+import json
 import argparse
 import stackset_deployer
+import config_model
+import stackset_inventory
+import template_cache
+import template_stager
+import template_index
+import operation_history
+import operation_journal
+import run_metrics
+import target_diff
+import async_deployer
+import api_rate_limiter
+import stackset_lock
+import deployment_plan
+import tempfile
+import asyncio
 import logging
-import boto3
-from botocore.exceptions import ClientError
+import threading
+from time import monotonic
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 FORMAT = '%(asctime)s %(levelname)s %(message)s'
 logging.basicConfig(format=FORMAT,
@@ -30,16 +48,59 @@ logging.basicConfig(format=FORMAT,
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
+DEFAULT_MAX_PARALLEL_DEPLOYMENTS = 4
+# characters of a template path not allowed in a stack set name, [a-zA-Z][-a-zA-Z0-9]*
+STACK_SET_NAME_INVALID_CHARS = re.compile(r'[^-a-zA-Z0-9]+')
+DEPLOYMENT_ENGINES = ['threads', 'async']
+ENVIRONMENT_FANOUTS = ['wave', 'concurrent']
+
 class AutoDeployer:
-    def __init__(self, env, region, s3_bucket, app_name):
+    def __init__(self, env, region, s3_bucket, app_name, session=None, base_ref=None, is_plan=False):
         self.env = env
+        # a comma separated list of environments is deployed in a single run
+        self.environments = [environment.strip() for environment in env.split(',') if environment.strip()]
         self.aws_region = region
         self.artifact_bucket = s3_bucket
         self.app_name = app_name
         self.template_path = f"{os.getcwd()}/templates/"
         self.template_parameters_path = f"{os.getcwd()}/parameters/"
+        self.artifacts_path = f"{os.getcwd()}/artifacts/"
+        # hash of the local artifacts, computed once per run
+        self.artifacts_hash = None
         self.deployment_config_file = f"{os.getcwd()}/deploy_configs/deployment_config.json"
-        self.s3_resource = boto3.resource('s3', self.aws_region)
+        # validated once and shared by all the stack set deployers of the run
+        self.deployment_config = None
+        self.base_ref = base_ref
+        # plan runs only read the deployed state and report the planned operations
+        self.is_plan = is_plan
+        # clients are created from the supplied boto3 session when one is supplied,
+        # the benchmarks supply a session backed by a simulated StackSets service.
+        # boto3 is only imported and the S3 resource only created once the inputs
+        # are validated, so an invalid run fails before loading the AWS SDK
+        self._session = session
+        self._s3_resource = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """
+        This method returns the supplied boto3 session, the
+        boto3 module default session when none is supplied
+        """
+        if self._session is None:
+            import boto3
+            self._session = boto3
+        return self._session
+
+    @property
+    def s3_resource(self):
+        """
+        This method returns the S3 resource, created on first use
+        """
+        with self._client_lock:
+            if self._s3_resource is None:
+                self._s3_resource = self.session.resource('s3', self.aws_region)
+            return self._s3_resource
 
     def check_config_exists(self):
         """
@@ -51,72 +112,510 @@ class AutoDeployer:
             error_msg = f"Deployment config file not found in {self.deployment_config_file}"
             raise Exception(error_msg)
 
-    def get_templates(self):
+    def get_templates(self, deployment_config, env):
         """
         This method finds the list of valid CloudFormation Templates and its 
-        Parameter files provided in their respective default directories.
+        Parameter files of the environment provided in their respective
+        default directories, including their sub directories, through the
+        template index.
         """
         try:
             LOGGER.info("Checking for valid CloudFormation Templates and its parameter files")
-            app_templates = os.listdir(self.template_path)
-            app_template_parameters = os.listdir(self.template_parameters_path)
-            templates = list()
-            parameter_identifier = f"-parameter-{self.env}.json"
-
-            default_templates = ['template.yml', 
-                                'template.yaml']
-            default_template_parameters = ['template-parameter-dev.json', 
-                                        'template-parameter-test.json', 
-                                        'template-parameter-prod.json']
-
-            if default_templates in app_templates:
-                raise Exception("Change the Name of CloudFormaiton Template as <application name>.yml, default template.yml or template.yaml are not allowed")
-
-            if default_template_parameters in app_template_parameters:
-                raise Exception("Change the Name of Template Parameter file as <application name>-parameter-<evn>.json with, default names are not allowed")
-
-            valid_templates = [ filename for filename in app_templates if filename.endswith(".yaml") or filename.endswith(".yml")]
-            valid_template_parameters = [ filename for filename in app_template_parameters if filename.endswith(".json")]
-
-            for template in valid_templates:
-                template_name = os.path.splitext(template)[0]
-                for parameter_file in valid_template_parameters:
-                    if template_name == parameter_file.replace(parameter_identifier,''):
-                        deployer_input = (template, parameter_file)
-                        templates.append(deployer_input)
-                
-            if templates:
-                return templates
-            else:
-                raise Exception(f"No valid CloudFormation Template and its Parameter File found for {self.env} environment")
+            index_file = deployment_config.get_value('template_index_file', '')
+            index = template_index.TemplateIndex(self.template_path.rstrip('/'),
+                                                 self.template_parameters_path.rstrip('/'),
+                                                 env,
+                                                 os.path.join(os.getcwd(), f"{index_file}.{env}") if index_file else None).build()
+            templates = index.get_templates()
+            if not templates:
+                raise Exception(f"No valid CloudFormation Template and its Parameter File found for {env} environment")
+            return index, templates
 
         except Exception as excep:
             error_msg = f"Error while trying to get the templates, {str(excep)}"
             raise Exception(error_msg)
 
-    def stage_cloudformation_template(self, app_name, template_file):
+    def get_changed_templates(self, deployment_config, index, templates):
         """
-        This method uploads the CloudFormation Template file to 
-        Artifacts S3 bucket and returns HTTPS URL for the file.
+        This method returns the templates changed since the base git commit
+        (--base_ref or template_base_ref of the deployment config), all the
+        templates when no base commit is supplied, for delete deployments,
+        when the deployment config or artifacts changed or when the changes
+        cannot be computed.
         """
+        base_ref = self.base_ref or deployment_config.get_value('template_base_ref', '')
+        if not base_ref or deployment_config.get_value('deployment_action') != 'deploy':
+            return templates
         try:
-            s3_key = f"template/{app_name}/{template_file}"
-            source_file = f"{self.template_path}{template_file}"
-            _ = self.s3_resource.meta.client.upload_file(Bucket=self.artifact_bucket,
-                                                        Key=s3_key,
-                                                        Filename=source_file)
-            template_https_url = f"https://{self.artifact_bucket}.s3.amazonaws.com/{s3_key}"
-            return template_https_url
+            changed_files = template_index.get_changed_files(base_ref, os.getcwd(), ['templates', 'parameters', 'artifacts', 'deploy_configs'])
         except Exception as excep:
-            error_msg = f"Error while trying to upload the template {template_file} to S3 bucket {self.artifact_bucket}, {str(excep)}"
+            LOGGER.warning(f"Deploying all the templates, the changed templates are not available: {str(excep)}")
+            return templates
+        changed_stems = index.get_changed_stems(changed_files)
+        if changed_stems is None:
+            LOGGER.info(f"Deployment config or artifacts changed since {base_ref}, deploying all the templates")
+            return templates
+        changed_templates = index.get_templates(changed_stems)
+        LOGGER.info(f"{len(changed_templates)} of {len(templates)} template(s) changed since {base_ref}")
+        return changed_templates
+
+    def get_template_name(self, template_file):
+        """
+        This method returns the name of the template included in its stack set name,
+        the directories of a template in a sub directory are joined with '-' and
+        any character not allowed in a stack set name is replaced with '-'
+        """
+        template_name = STACK_SET_NAME_INVALID_CHARS.sub('-', os.path.splitext(template_file)[0]).strip('-')
+        if not template_name:
+            error_msg = f"Template {template_file} has no character allowed in a stack set name"
+            raise Exception(error_msg)
+        return template_name
+
+    def get_stack_set_template_name(self, deployment_config, template, all_templates):
+        """
+        This method returns the template name included in the stack set name of
+        the template, None when the template is deployed to the (stack set name)-(env)
+        stack set: single template apps, and multi template apps unless
+        template_stack_sets gives each template its own stack set
+        """
+        if len(all_templates) > 1 and deployment_config.is_enabled('template_stack_sets'):
+            return self.get_template_name(template[0])
+        return None
+
+    def check_template_names(self, templates):
+        """
+        This method checks that the templates of an environment
+        do not map to the same stack set name once sanitized
+        """
+        template_files = {}
+        for template in templates:
+            template_files.setdefault(self.get_template_name(template[0]), []).append(template[0])
+        duplicates = [', '.join(files) for files in template_files.values() if len(files) > 1]
+        if duplicates:
+            error_msg = f"Templates deployed to the same stack set name: {'; '.join(duplicates)}, rename them"
             raise Exception(error_msg)
 
+    def warn_legacy_stack_sets(self, deployment_config, env_templates, inventory):
+        """
+        This method warns about the stack set of a multi template environment
+        named without a template name. Before each template got its own
+        stack set all the templates were deployed to this stack set, which
+        is no longer updated and is left to be torn down once migrated.
+        """
+        if not deployment_config.is_enabled('template_stack_sets'):
+            return
+        for environment, (all_templates, _) in env_templates.items():
+            if len(all_templates) < 2:
+                continue
+            legacy_stack_set_name = f"{deployment_config['stack_set_name']}-{environment}"
+            if inventory.exists(legacy_stack_set_name):
+                LOGGER.warning(f"Stack Set {legacy_stack_set_name} is no longer updated, each template of {environment} is deployed "
+                               f"to its own {deployment_config['stack_set_name']}-<template>-{environment} stack set. "
+                               f"Tear it down with stackset_teardown.py --stack_sets {legacy_stack_set_name} --yes once the templates are migrated")
+
+    def get_template_s3_key(self, app_name, template_file):
+        """
+        This method returns the S3 key of the staged template file
+        """
+        return f"template/{app_name}/{template_file}"
+
+    def get_artifacts(self):
+        """
+        This method returns the local artifact files (relative paths) kept
+        in the artifacts directory to be staged along with the templates,
+        the artifacts directory is optional.
+        """
+        artifacts = []
+        if not os.path.isdir(self.artifacts_path):
+            return artifacts
+        for root, _, files in os.walk(self.artifacts_path):
+            for filename in files:
+                artifacts.append(os.path.relpath(os.path.join(root, filename), self.artifacts_path).replace(os.sep, '/'))
+        return sorted(artifacts)
+
+    def get_artifacts_hash(self):
+        """
+        This method returns the hash of the local artifacts, included in
+        the content hash of every deployment as the templates reference them.
+        Empty without artifacts, so the content hashes are left as they were
+        """
+        if self.artifacts_hash is None:
+            artifacts = self.get_artifacts()
+            self.artifacts_hash = template_cache.get_artifacts_hash([(artifact, f"{self.artifacts_path}{artifact}")
+                                                                     for artifact in artifacts]) if artifacts else ''
+        return self.artifacts_hash
+
+    def stage_cloudformation_templates(self, app_name, template_files, stager):
+        """
+        This method uploads the CloudFormation Template files and the local
+        artifacts to Artifacts S3 bucket in parallel and returns the map of
+        template file to HTTPS URL. The artifacts are staged under
+        template/<app name>/artifacts/ to be referenced by the templates.
+        """
+        try:
+            files = [(self.get_template_s3_key(app_name, template_file), f"{self.template_path}{template_file}")
+                     for template_file in template_files]
+            files += [(self.get_template_s3_key(app_name, f"artifacts/{artifact}"), f"{self.artifacts_path}{artifact}")
+                      for artifact in self.get_artifacts()]
+            staged_urls = stager.stage(files)
+            return {template_file: staged_urls[self.get_template_s3_key(app_name, template_file)]
+                    for template_file in template_files}
+        except Exception as excep:
+            error_msg = f"Error while trying to upload the templates to S3 bucket {self.artifact_bucket}, {str(excep)}"
+            raise Exception(error_msg)
+
+    def get_deployment_config(self):
+        """
+        This method reads the deployment config file once and returns
+        the validated DeploymentConfig shared by all the deployers.
+        """
+        return config_model.load_deployment_config(self.deployment_config_file).validate_stack_set()
+
+    def get_max_parallel_deployments(self, deployment_config):
+        """
+        This method returns the maximum number of stack sets deployed
+        in parallel, read from the deployment config file.
+        """
+        try:
+            max_parallel_deployments = deployment_config.get_value('max_parallel_deployments', DEFAULT_MAX_PARALLEL_DEPLOYMENTS)
+            if max_parallel_deployments < 1:
+                raise Exception("max_parallel_deployments must be greater than zero")
+            return max_parallel_deployments
+        except Exception as excep:
+            error_msg = f"Error while reading max_parallel_deployments from {self.deployment_config_file}: {str(excep)}"
+            raise Exception(error_msg)
+
+    def get_deployment_engine(self, deployment_config):
+        """
+        This method returns the deployment engine read from the deployment
+        config file, 'threads' runs each stack set deployment in a worker
+        thread and 'async' runs all of them on a single asyncio event loop.
+        """
+        deployment_engine = deployment_config.get_value('deployment_engine', 'threads')
+        if deployment_engine not in DEPLOYMENT_ENGINES:
+            error_msg = f"Invalid deployment_engine {deployment_engine} in {self.deployment_config_file}. Valid options are {', '.join(DEPLOYMENT_ENGINES)}."
+            raise Exception(error_msg)
+        return deployment_engine
+
+    def get_environments(self, deployment_config):
+        """
+        This method returns the environments deployed by this run,
+        validating each of them and rejecting duplicates. The deployment
+        targets of the environments are compiled before any template is staged.
+        """
+        env_keys = [config_model.get_env_key(environment) for environment in self.environments]
+        if not env_keys:
+            raise Exception("At least one environment must be supplied with --env")
+        if len(set(env_keys)) != len(env_keys):
+            error_msg = f"Each environment can be deployed once per run, got {', '.join(self.environments)}"
+            raise Exception(error_msg)
+        for environment in self.environments:
+            deployment_config.get_environment(environment)
+        return self.environments
+
+    def get_environment_fanout(self, deployment_config):
+        """
+        This method returns how multiple environments are deployed, 'wave'
+        deploys them one after the other in the supplied order and 'concurrent'
+        deploys all of them at once, read from the deployment config file.
+        """
+        environment_fanout = deployment_config.get_value('environment_fanout', 'wave')
+        if environment_fanout not in ENVIRONMENT_FANOUTS:
+            error_msg = f"Invalid environment_fanout {environment_fanout} in {self.deployment_config_file}. Valid options are {', '.join(ENVIRONMENT_FANOUTS)}."
+            raise Exception(error_msg)
+        return environment_fanout
+
+    def get_cf_client(self, deployment_config, deployment_engine):
+        """
+        This method returns the rate limited CloudFormation client
+        shared by all the stack set deployers of this run.
+        """
+        try:
+            if deployment_engine == 'async':
+                max_pool_connections = deployment_config.get_value('async_max_pool_connections', async_deployer.DEFAULT_ASYNC_MAX_POOL_CONNECTIONS)
+                from botocore.config import Config
+                cf_client = self.session.client('cloudformation', self.aws_region, config=Config(max_pool_connections=max_pool_connections))
+            else:
+                cf_client = self.session.client('cloudformation', self.aws_region)
+            return api_rate_limiter.RateLimitedClient.from_config(cf_client, deployment_config)
+        except Exception as excep:
+            error_msg = f"Error while creating the CloudFormation client: {str(excep)}"
+            raise Exception(error_msg)
+
+    def get_stackset_inventory(self, deployment_config, cf_client):
+        """
+        This method returns the stack set inventory shared by all
+        the stack set deployers of this run.
+        """
+        try:
+            inventory_ttl = deployment_config.get_value('inventory_cache_ttl', stackset_inventory.DEFAULT_INVENTORY_CACHE_TTL)
+            return stackset_inventory.StackSetInventory(cf_client, inventory_ttl)
+        except Exception as excep:
+            error_msg = f"Error while creating the stack set inventory: {str(excep)}"
+            raise Exception(error_msg)
+
+    def get_deployment_manifest(self, deployment_config, env):
+        """
+        This method returns the deployment manifest of the content hashes
+        of the deployed stack sets of the environment, None when skip_unchanged_deployments
+        is disabled in the deployment config.
+        """
+        if not deployment_config.is_enabled('skip_unchanged_deployments'):
+            return None
+        manifest_key = f"template/{self.app_name}/deploy_manifest-{config_model.get_env_key(env)}.json"
+        return template_cache.DeploymentManifest(self.s3_resource.meta.client,
+                                                 self.artifact_bucket,
+                                                 manifest_key).load()
+
+    def get_operation_history(self, deployment_config, env):
+        """
+        This method returns the stack set operation history of the environment
+        kept in the Artifacts S3 bucket, None when adaptive_operation_preferences
+        is disabled in the deployment config.
+        """
+        if not deployment_config.is_enabled('adaptive_operation_preferences'):
+            return None
+        history_key = f"template/{self.app_name}/operation_history-{config_model.get_env_key(env)}.json"
+        history_store = operation_history.S3HistoryStore(self.s3_resource.meta.client, self.artifact_bucket, history_key)
+        return operation_history.OperationHistory(history_store).load()
+
+    def get_operation_journal(self, deployment_config, env):
+        """
+        This method returns the journal of the submitted stack set operations
+        of the environment kept in the Artifacts S3 bucket, one object per
+        stack set, None when
+        resumable_deployments is disabled in the deployment config.
+        """
+        if not deployment_config.is_enabled('resumable_deployments'):
+            return None
+        journal_prefix = f"template/{self.app_name}/operation_journal-{config_model.get_env_key(env)}"
+        s3_client = self.s3_resource.meta.client
+        return operation_journal.OperationJournal(lambda stackset_name: operation_history.S3HistoryStore(s3_client,
+                                                                                                          self.artifact_bucket,
+                                                                                                          f"{journal_prefix}/{stackset_name}.json"))
+
+    def get_stackset_queue(self, deployment_config):
+        """
+        This method returns the queue serializing the deployments of a stack set
+        across runs, None when stackset_lock_backend is 'none' in the deployment config.
+        """
+        lock_backend = deployment_config.get_value('stackset_lock_backend', 'none')
+        if lock_backend not in stackset_lock.LOCK_BACKENDS:
+            error_msg = f"Invalid stackset_lock_backend {lock_backend} in {self.deployment_config_file}. Valid options are {', '.join(stackset_lock.LOCK_BACKENDS)}."
+            raise Exception(error_msg)
+        if lock_backend == 'none':
+            return None
+        if lock_backend == 'file':
+            lock_dir = deployment_config.get_value('stackset_lock_dir', os.path.join(tempfile.gettempdir(), 'stackset_locks'))
+            backend = stackset_lock.FileLockBackend(lock_dir)
+        else:
+            backend = stackset_lock.S3LockBackend(self.s3_resource.meta.client, self.artifact_bucket, 'stackset_locks/')
+        return stackset_lock.StackSetQueue.from_config(backend, deployment_config)
+
+    def get_deployment_label(self, ss_deployer, template):
+        """
+        This method returns the label of the deployment of the template
+        in reports, prefixed with its environment when the run deploys
+        multiple environments.
+        """
+        if len(self.environments) > 1:
+            return f"{ss_deployer.environment}/{template[0]}"
+        return template[0]
+
+    def deploy_template(self, ss_deployer, template, template_url, template_name, content_hash, stop_event=None):
+        """
+        This method triggers the stack set deployment of a single staged
+        CloudFormation Template with its own Deployer, the deployment is
+        skipped once the stop event is set by a failed deployment.
+        """
+        if stop_event and stop_event.is_set():
+            raise Exception(stackset_deployer.STOPPED_DEPLOYMENT_ERROR)
+        parameter_file = f"{self.template_parameters_path}{template[1]}"
+        try:
+            ss_deployer.processor(template_url, parameter_file, self.deployment_config, template_name, content_hash)
+        except Exception:
+            if stop_event:
+                stop_event.set()
+            raise
+
+    def get_deployment_rounds(self, deployments):
+        """
+        This method splits the supplied deployments into rounds run one after the
+        other, the templates deployed to the same stack set are deployed in
+        template order, one per round, and the other deployments in the first round
+        """
+        stack_set_deployments = {}
+        for deployment in deployments:
+            # deployments of an environment without a template name share its stack set
+            stack_set_deployments.setdefault((deployment[0].environment, deployment[3]), []).append(deployment)
+        round_count = max([len(same_stack_set) for same_stack_set in stack_set_deployments.values()], default=0)
+        return [[same_stack_set[round_index] for same_stack_set in stack_set_deployments.values() if round_index < len(same_stack_set)]
+                for round_index in range(round_count)]
+
+    def run_threaded_deployments(self, deployments, max_parallel_deployments, stop_event=None):
+        """
+        This method runs the supplied deployments in a thread pool
+        and returns the errors of the failed deployments per template.
+        """
+        failed_templates = {}
+        with ThreadPoolExecutor(max_workers=max_parallel_deployments) as executor:
+            futures = {executor.submit(self.deploy_template, *deployment, stop_event): self.get_deployment_label(deployment[0], deployment[1])
+                       for deployment in deployments}
+            for future in as_completed(futures):
+                template_file = futures[future]
+                try:
+                    future.result()
+                    LOGGER.info(f"Deployment of template {template_file} completed")
+                except Exception as excep:
+                    failed_templates[template_file] = str(excep)
+                    LOGGER.error(f"Deployment of template {template_file} failed: {str(excep)}")
+        return failed_templates
+
+    def run_async_deployments(self, deployments, max_parallel_deployments, stop_event=None):
+        """
+        This method runs the supplied deployments on an asyncio event loop
+        and returns the errors of the failed deployments per template.
+        """
+        async_deployments = []
+        for ss_deployer, template, template_url, template_name, content_hash in deployments:
+            processor_args = (template_url,
+                              f"{self.template_parameters_path}{template[1]}",
+                              self.deployment_config,
+                              template_name,
+                              content_hash)
+            async_deployments.append((ss_deployer, processor_args, self.get_deployment_label(ss_deployer, template)))
+        failed_templates = asyncio.run(async_deployer.run_deployments(async_deployments, max_parallel_deployments, stop_event))
+        for template_file, error in sorted(failed_templates.items()):
+            LOGGER.error(f"Deployment of template {template_file} failed: {error}")
+        return failed_templates
+
+    def get_content_hash(self, template, deployment_config, env, template_name, all_templates):
+        """
+        This method returns the content hash of the deployment of the template
+        in the environment, see template_cache.get_deployment_hash. None when the
+        templates share the stack set, so they are never skipped as unchanged
+        """
+        if template_name is None and len(all_templates) > 1:
+            return None
+        return template_cache.get_deployment_hash(f"{self.template_path}{template[0]}",
+                                                  f"{self.template_parameters_path}{template[1]}",
+                                                  deployment_config,
+                                                  config_model.get_env_key(env),
+                                                  self.get_artifacts_hash())
+
+    def get_plan_totals(self, plans):
+        """
+        This method returns the number of stack instances to create, update
+        and delete per region across the supplied stack set plans
+        """
+        totals = {action: {} for action in deployment_plan.PLAN_INSTANCE_ACTIONS}
+        for stack_set_plan in plans:
+            for action, region_counts in stack_set_plan["instances"].items():
+                for region, count in (region_counts or {}).items():
+                    totals[action][region] = totals[action].get(region, 0) + count
+        return totals
+
+    def plan_deployments(self, deployment_config, environments, env_templates, env_states, cf_client, inventory, org_resolver, metrics):
+        """
+        This method plans the deployments of the run with the read APIs only
+        and writes the plan report: the stack instances to create, update and
+        delete per region of every stack set and the estimated duration of
+        the run, with the deployments scheduled as the run would schedule them.
+        """
+        max_parallel_deployments = self.get_max_parallel_deployments(deployment_config)
+        environment_fanout = self.get_environment_fanout(deployment_config)
+        deployments = []
+        for environment in environments:
+            all_templates, templates = env_templates[environment]
+            deployment_manifest, history, _ = env_states[environment]
+            for template in templates:
+                ss_deployer = stackset_deployer.Deployer(environment, self.aws_region, inventory, deployment_manifest, history, cf_client,
+                                                         metrics=metrics, org_resolver=org_resolver)
+                template_name = self.get_stack_set_template_name(deployment_config, template, all_templates)
+                deployments.append((ss_deployer, template, template_name, self.get_content_hash(template, deployment_config, environment,
+                                                                                             template_name, all_templates)))
+        if len(deployments) > 1:
+            # a single stack set listing answers the existence checks of all the stack sets
+            inventory.list_stack_sets()
+
+        plans = {}
+        failed_templates = {}
+        with ThreadPoolExecutor(max_workers=max_parallel_deployments) as executor:
+            futures = {executor.submit(ss_deployer.plan, deployment_config, template_name, content_hash):
+                       (ss_deployer.environment, template, self.get_deployment_label(ss_deployer, template))
+                       for ss_deployer, template, template_name, content_hash in deployments}
+            for future in as_completed(futures):
+                environment, template, label = futures[future]
+                try:
+                    plans[label] = dict(future.result(), environment=environment, template=template[0])
+                except Exception as excep:
+                    failed_templates[label] = str(excep)
+                    LOGGER.error(f"Planning of template {label} failed: {str(excep)}")
+
+        for label, stack_set_plan in sorted(plans.items()):
+            deployment_plan.log_stack_set_plan(label, stack_set_plan)
+        waves = [environments] if environment_fanout == 'concurrent' else [[environment] for environment in environments]
+        estimated_seconds = sum(deployment_plan.estimate_run_seconds([stack_set_plan["estimated_seconds"] for stack_set_plan in plans.values()
+                                                                      if stack_set_plan["environment"] in wave],
+                                                                     max_parallel_deployments)
+                                for wave in waves)
+        totals = self.get_plan_totals(plans.values())
+        for action in deployment_plan.PLAN_INSTANCE_ACTIONS:
+            LOGGER.info(f"Stack instances to {action}: {deployment_plan.format_counts(totals[action])}")
+        LOGGER.info(f"Planned {len(plans)} stack set deployment(s) with up to {max_parallel_deployments} parallel deployment(s), "
+                    f"estimated duration {deployment_plan.format_seconds(estimated_seconds)}")
+
+        plan_file = deployment_config.get_value('plan_report_file', f"{os.getcwd()}/deploy_plan.json")
+        try:
+            with open(plan_file, 'w') as file:
+                json.dump({
+                            "app_name": self.app_name,
+                            "environments": environments,
+                            "environment_fanout": environment_fanout,
+                            "max_parallel_deployments": max_parallel_deployments,
+                            "estimated_seconds": round(estimated_seconds, 1),
+                            "instances": totals,
+                            "deployments": [dict(stack_set_plan, label=label) for label, stack_set_plan in sorted(plans.items())],
+                            "failed_deployments": failed_templates
+                          }, file, indent=4)
+            LOGGER.info(f"Deployment plan written to {plan_file}")
+        except Exception as excep:
+            error_msg = f"Error while writing the deployment plan {plan_file}: {str(excep)}"
+            raise Exception(error_msg)
+
+        if failed_templates:
+            failures = "; ".join(f"{template_file}: {error}" for template_file, error in sorted(failed_templates.items()))
+            error_msg = f"{len(failed_templates)} of {len(deployments)} template plan(s) failed - {failures}"
+            raise Exception(error_msg)
+
+    def report_run_metrics(self, metrics, deployment_config, cf_client):
+        """
+        This method writes the run report of the phase timings and API calls,
+        and prints it in CloudWatch Embedded Metric Format when metrics_emf
+        is enabled in the deployment config.
+        """
+        api_stats = cf_client.get_stats() if cf_client else {}
+        report_file = deployment_config.get_value('metrics_report_file', f"{os.getcwd()}/deploy_run_report.json")
+        report = metrics.write_report(report_file, api_stats)
+        if deployment_config.is_enabled('metrics_emf'):
+            metrics.emit_emf(report, deployment_config.get_value('metrics_namespace', run_metrics.DEFAULT_METRICS_NAMESPACE))
+
     def deploy(self):
         """
         This method gets all the valid CloudFormation Templates and its 
         Parameter files provided and triggers the stack set deployment
-        for each template.
+        for each template, running up to max_parallel_deployments of them
+        in parallel. Multiple environments are deployed in one run with the
+        templates staged once, either one wave per environment or all at once.
+        A wave with a failed deployment stops the next waves. Within a wave,
+        with stop_on_failure no deployment starts after a failure, otherwise
+        failures are collected per template and reported once all the
+        deployments of the wave are finished.
         """
+        metrics = run_metrics.RunMetrics(stackset_lock.get_run_id(), self.app_name, ','.join(self.environments))
+        run_started = monotonic()
+        deployment_config = config_model.DeploymentConfig({})
+        cf_client = None
         try:
             LOGGER.info("Auto Deployment Starts")
             LOGGER.info(f"CloudFormaiton Templates are excepted in {self.template_path}")
@@ -124,19 +623,138 @@ class AutoDeployer:
             LOGGER.info(f"Deployment Configuration file used for this deployment {self.deployment_config_file}")
 
             self.check_config_exists()
-            templates = self.get_templates()
-            ss_deployer = stackset_deployer.Deployer(self.env, self.aws_region)
+            with metrics.phase('config_load'):
+                deployment_config = self.get_deployment_config()
+            self.deployment_config = deployment_config
+            environments = self.get_environments(deployment_config)
+            environment_fanout = self.get_environment_fanout(deployment_config)
+            is_stop_on_failure = deployment_config.is_enabled('stop_on_failure')
+            # environment -> (all the templates, templates to deploy)
+            env_templates = {}
+            with metrics.phase('template_discovery'):
+                for environment in environments:
+                    index, all_templates = self.get_templates(deployment_config, environment)
+                    if len(all_templates) > 1 and deployment_config.is_enabled('template_stack_sets'):
+                        self.check_template_names(all_templates)
+                    env_templates[environment] = (all_templates, self.get_changed_templates(deployment_config, index, all_templates))
+            environments = [environment for environment in environments if env_templates[environment][1]]
+            if not environments:
+                LOGGER.info("No template changed, nothing to deploy")
+                return
+            max_parallel_deployments = self.get_max_parallel_deployments(deployment_config)
+            deployment_engine = self.get_deployment_engine(deployment_config)
+            # the CloudFormation client, the stack set inventory, the stack set queue
+            # and the Org Unit accounts are shared by all the templates and environments
+            cf_client = self.get_cf_client(deployment_config, deployment_engine)
+            inventory = self.get_stackset_inventory(deployment_config, cf_client)
+            stackset_queue = self.get_stackset_queue(deployment_config)
+            # the accounts of the Org Units are only resolved by the account level diff
+            org_resolver = None
+            if deployment_config.is_enabled('account_level_diff'):
+                org_resolver = target_diff.OrganizationResolver(self.session.client('organizations', self.aws_region))
+            self.warn_legacy_stack_sets(deployment_config, env_templates, inventory)
+            # environment -> (deployment manifest, operation history, operation journal)
+            env_states = {}
+            with metrics.phase('state_load'):
+                for environment in environments:
+                    env_states[environment] = (self.get_deployment_manifest(deployment_config, environment),
+                                               self.get_operation_history(deployment_config, environment),
+                                               self.get_operation_journal(deployment_config, environment))
 
-            for template in templates:
-                template_url = self.stage_cloudformation_template(self.app_name, template[0])
-                parameter_file = f"{self.template_parameters_path}{template[1]}"
-                ss_deployer.processor(template_url, parameter_file, self.deployment_config_file)
+            if self.is_plan:
+                LOGGER.info("Plan mode, only the read APIs are called and nothing is deployed")
+                with metrics.phase('plan'):
+                    self.plan_deployments(deployment_config, environments, env_templates, env_states, cf_client, inventory, org_resolver, metrics)
+                cf_client.log_stats()
+                return
 
-            LOGGER.info("Auto Deployment Starts")
+            # all the templates are staged once before any stack set operation starts
+            stager = template_stager.TemplateStager.from_config(self.s3_resource.meta.client, self.artifact_bucket, deployment_config)
+            template_files = sorted({template[0] for environment in environments for template in env_templates[environment][1]})
+            with metrics.phase('s3_staging'):
+                template_urls = self.stage_cloudformation_templates(self.app_name, template_files, stager)
+
+            # boto3 client creation is not thread safe, so every Deployer
+            # is created here before the worker threads or event loop start
+            async_api = None
+            if deployment_engine == 'async':
+                # the async API calls the raw client within the token buckets and
+                # with the retries of the rate limited client
+                async_api = async_deployer.AsyncStackSetApi.from_config(cf_client, deployment_config)
+            env_deployments = {}
+            for environment in environments:
+                all_templates, templates = env_templates[environment]
+                deployment_manifest, history, journal = env_states[environment]
+                # stack set name is suffixed with the template name only when the templates
+                # have their own stack sets. All the templates are counted so the names
+                # do not depend on the changes
+                deployments = []
+                for template in templates:
+                    template_name = self.get_stack_set_template_name(deployment_config, template, all_templates)
+                    if template_name is None and deployments and deployment_config.get_value('deployment_action') == 'delete':
+                        # the templates sharing the stack set delete it once
+                        continue
+                    if async_api:
+                        ss_deployer = async_deployer.AsyncDeployer(environment, self.aws_region, async_api, inventory, deployment_manifest, history,
+                                                                   stackset_queue, journal, metrics, org_resolver, cf_client)
+                    else:
+                        ss_deployer = stackset_deployer.Deployer(environment, self.aws_region, inventory, deployment_manifest, history,
+                                                                 cf_client, stackset_queue, journal, metrics, org_resolver)
+                    content_hash = self.get_content_hash(template, deployment_config, environment, template_name, all_templates)
+                    deployments.append((ss_deployer, template, template_urls[template[0]], template_name, content_hash))
+                env_deployments[environment] = deployments
+
+            if environment_fanout == 'concurrent':
+                waves = [environments]
+            else:
+                waves = [[environment] for environment in environments]
+            deployment_count = sum(len(deployments) for deployments in env_deployments.values())
+            failed_templates = {}
+            with metrics.phase('deployments'):
+                try:
+                    for wave in waves:
+                        # a failed wave always gates the next waves
+                        if failed_templates:
+                            LOGGER.error(f"Skipping the deployment of {', '.join(wave)} after an earlier deployment failed")
+                            failed_templates.update({self.get_deployment_label(deployment[0], deployment[1]): stackset_deployer.STOPPED_DEPLOYMENT_ERROR
+                                                     for environment in wave for deployment in env_deployments[environment]})
+                            continue
+                        deployments = [deployment for environment in wave for deployment in env_deployments[environment]]
+                        # stop_on_failure only stops the deployments of the wave not started yet
+                        stop_event = threading.Event() if is_stop_on_failure else None
+                        LOGGER.info(f"Deploying {len(deployments)} template(s) of {', '.join(wave)} with up to {max_parallel_deployments} "
+                                    f"parallel deployment(s) using the {deployment_engine} engine")
+                        for deployment_round in self.get_deployment_rounds(deployments):
+                            if async_api:
+                                failed_templates.update(self.run_async_deployments(deployment_round, max_parallel_deployments, stop_event))
+                            else:
+                                failed_templates.update(self.run_threaded_deployments(deployment_round, max_parallel_deployments, stop_event))
+
+                        for environment in wave:
+                            deployment_manifest, history, _ = env_states[environment]
+                            if deployment_manifest:
+                                # successful deployments are recorded even when other templates failed
+                                deployment_manifest.save()
+                            if history:
+                                history.save()
+                finally:
+                    if async_api:
+                        async_api.close()
+
+            cf_client.log_stats()
+            if failed_templates:
+                failures = "; ".join(f"{template_file}: {error}" for template_file, error in sorted(failed_templates.items()))
+                error_msg = f"{len(failed_templates)} of {deployment_count} template deployment(s) failed - {failures}"
+                raise Exception(error_msg)
+
+            LOGGER.info("Auto Deployment Completed")
         except Exception as excep:
             error_msg = f"Auto Deployment Process Failed: {str(excep)}"
             LOGGER.error(error_msg)
             raise
+        finally:
+            metrics.record_phase(run_metrics.RUN_PHASE, monotonic() - run_started)
+            self.report_run_metrics(metrics, deployment_config, cf_client)
 
 
 def main(args):
@@ -148,19 +766,20 @@ def main(args):
     s3_bucket = args.s3_bucket
     app_name = args.app_name
 
-    auto_deployer = AutoDeployer(environment, region, s3_bucket, app_name)
+    auto_deployer = AutoDeployer(environment, region, s3_bucket, app_name, base_ref=args.base_ref, is_plan=args.plan)
     auto_deployer.deploy()
 
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(prog='deploy.py',
-                                     usage='%(prog)s --env <environment> --region <aws region> --s3_bucket <artifact s3 bucket> --app_name <repository/app name>',
+                                     usage='%(prog)s --env <environment> --region <aws region> --s3_bucket <artifact s3 bucket> --app_name <repository/app name> [--base_ref <git commit>] [--plan]',
                                      description="Delegated Admin Service Managed Stack Set Automated Deployer")
     parser.add_argument('--env',
                         action='store',
                         type=str,
-                        required=True)
+                        required=True,
+                        help="environment, or comma separated environments deployed in one run e.g. dev,test,prod")
     parser.add_argument('--region',
                         action='store',
                         type=str,
@@ -173,6 +792,14 @@ if __name__ == "__main__":
                         action='store',
                         type=str,
                         required=True)
+    parser.add_argument('--base_ref',
+                        action='store',
+                        type=str,
+                        required=False,
+                        help="git commit the templates are compared with, only the changed templates are deployed")
+    parser.add_argument('--plan',
+                        action='store_true',
+                        help="report the planned stack instance changes and the estimated duration without deploying")
     arguments = parser.parse_args()
     sys.path.append(os.path.dirname(__file__))
     main(arguments)
@@ -0,0 +1,94 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+deployment_flow.py lets the stack set deployment steps be written once
+and run by both the thread and the async deployment engines.
+
+A flow is a generator which yields the effects it needs run, an API call,
+a blocking call, a wait or concurrent flows, and is sent back their result,
+or has their error raised where it yielded. run_flow runs a flow on the
+calling thread with the rate limited CloudFormation client, and
+async_deployer.run_flow_async runs the same flow on an event loop.
+"""
+
+
+class ApiCall:
+    def __init__(self, api_method, is_page=False, retry_in_progress=True, **request):
+        self.api_method = api_method
+        self.is_page = is_page
+        # False raises OperationInProgressException to the flow instead of retrying the call
+        self.retry_in_progress = retry_in_progress
+        self.request = request
+
+
+class Call:
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+
+class Wait:
+    def __init__(self, waiter, operation_name, check):
+        # check returns a flow whose result is (is_completed, result)
+        self.waiter = waiter
+        self.operation_name = operation_name
+        self.check = check
+
+
+class Gather:
+    def __init__(self, flows):
+        self.flows = list(flows)
+
+
+def call_flow(func, *args, **kwargs):
+    """
+    This function returns a flow of the single blocking call of the
+    supplied function, for the waits checked with a blocking call
+    """
+    return (yield Call(func, *args, **kwargs))
+
+
+def drive_flow(flow, run_effect):
+    """
+    This function runs the supplied flow, running every yielded effect with
+    the supplied run_effect, and returns the result of the flow
+    """
+    result, error = None, None
+    while True:
+        try:
+            effect = flow.send(result) if error is None else flow.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        result, error = None, None
+        try:
+            result = run_effect(effect)
+        except Exception as excep:
+            error = excep
+
+
+def run_flow(flow, cf_client):
+    """
+    This function runs the supplied flow on the calling thread, the API calls
+    go through the supplied rate limited client and the concurrent
+    flows run one after the other
+    """
+    def run_effect(effect):
+        if isinstance(effect, ApiCall):
+            if hasattr(cf_client, 'call'):
+                response = cf_client.call(effect.api_method, retry_in_progress=effect.retry_in_progress, **effect.request)
+            else:
+                response = getattr(cf_client, effect.api_method)(**effect.request)
+            if effect.is_page and hasattr(cf_client, 'record_call'):
+                cf_client.record_call(effect.api_method, is_page=True)
+            return response
+        if isinstance(effect, Call):
+            return effect.func(*effect.args, **effect.kwargs)
+        if isinstance(effect, Wait):
+            return effect.waiter.wait(effect.operation_name, lambda: run_flow(effect.check(), cf_client))
+        if isinstance(effect, Gather):
+            return [run_flow(flow, cf_client) for flow in effect.flows]
+        error_msg = f"Unknown deployment flow effect {type(effect).__name__}"
+        raise Exception(error_msg)
+
+    return drive_flow(flow, run_effect)
@@ -0,0 +1,135 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+deployment_plan.py estimates the wall clock time of the stack set
+operations planned by a dry run of the deployer.
+
+An operation deploys the stack instances of a region in batches of
+MaxConcurrentCount accounts, or MaxConcurrentPercentage of the accounts of
+the region, and its regions one after the other unless the region
+concurrency is PARALLEL. The duration of a batch is learned from the
+recorded operations of the stack set when an operation history is kept,
+and defaults to plan_batch_seconds otherwise. The stack set deployments
+of a run are scheduled on max_parallel_deployments workers.
+"""
+
+import math
+import heapq
+import logging
+from statistics import median
+
+LOGGER = logging.getLogger()
+
+DEFAULT_PLAN_BATCH_SECONDS = 60
+PLAN_INSTANCE_ACTIONS = ['create', 'update', 'delete']
+
+
+def get_batch_count(instance_count, preferences):
+    """
+    This function returns the number of batches the supplied number
+    of stack instances of a region are deployed in
+    """
+    if not instance_count:
+        return 1
+    if preferences.get('MaxConcurrentCount'):
+        concurrent_count = int(preferences['MaxConcurrentCount'])
+    else:
+        concurrent_count = math.floor(instance_count * float(preferences.get('MaxConcurrentPercentage', 100)) / 100)
+    return math.ceil(instance_count / max(1, concurrent_count))
+
+
+def get_operation_batches(region_counts, preferences):
+    """
+    This function returns the number of batches an operation runs one after
+    the other for the supplied stack instance counts per region
+    """
+    region_batches = [get_batch_count(instance_count, preferences) for instance_count in region_counts.values()] or [1]
+    if preferences.get('RegionConcurrencyType') == 'PARALLEL':
+        return max(region_batches)
+    return sum(region_batches)
+
+
+def get_batch_seconds(recorded_operations, default_batch_seconds=DEFAULT_PLAN_BATCH_SECONDS):
+    """
+    This function returns the median duration of a batch of the supplied
+    recorded operations, the default when none of them has a duration
+    """
+    batch_seconds = []
+    for operation in recorded_operations:
+        if not operation.get('duration_seconds'):
+            continue
+        region_counts = {region: counts["instances"] for region, counts in operation.get('regions', {}).items()}
+        batch_seconds.append(operation['duration_seconds'] / get_operation_batches(region_counts, operation.get('operation_preferences', {})))
+    return median(batch_seconds) if batch_seconds else default_batch_seconds
+
+
+def estimate_stack_set_seconds(operations, is_pipelined):
+    """
+    This function returns the estimated duration of the planned operations of
+    a stack set. Pipelined operations never overlap except for the stack set
+    update, which waits for the others, otherwise they run one after the other.
+    """
+    instance_seconds = [operation["estimated_seconds"] for operation in operations if operation["type"] != 'update_stack_set']
+    update_seconds = sum(operation["estimated_seconds"] for operation in operations if operation["type"] == 'update_stack_set')
+    if is_pipelined:
+        return max(instance_seconds, default=0) + update_seconds
+    return sum(instance_seconds) + update_seconds
+
+
+def estimate_run_seconds(deployment_seconds, max_parallel_deployments):
+    """
+    This function returns the estimated duration of the supplied stack set
+    deployments run on max_parallel_deployments workers, the longest first
+    """
+    workers = [0.0] * max(1, min(max_parallel_deployments, len(deployment_seconds)))
+    for seconds in sorted(deployment_seconds, reverse=True):
+        heapq.heapreplace(workers, workers[0] + seconds)
+    return max(workers, default=0.0)
+
+
+def count_instances_by_region(instance_keys):
+    """
+    This function returns the number of the supplied (OU, Account, Region)
+    stack instance keys per region
+    """
+    region_counts = {}
+    for instance_key in instance_keys:
+        region_counts[instance_key[2]] = region_counts.get(instance_key[2], 0) + 1
+    return dict(sorted(region_counts.items()))
+
+
+def format_seconds(seconds):
+    """
+    This function formats a duration in seconds as hours, minutes and seconds
+    """
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m{seconds:02d}s"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
+
+
+def format_counts(region_counts):
+    """
+    This function formats stack instance counts per region
+    """
+    if region_counts is None:
+        return "unknown"
+    return ", ".join(f"{region}={count}" for region, count in sorted(region_counts.items())) or "none"
+
+
+def log_stack_set_plan(label, stack_set_plan):
+    """
+    This function logs the plan of a stack set deployment
+    """
+    LOGGER.info(f"Plan of {label} - stack set {stack_set_plan['stack_set']}: {stack_set_plan['action']}, "
+                f"estimated {format_seconds(stack_set_plan['estimated_seconds'])}")
+    for action in PLAN_INSTANCE_ACTIONS:
+        region_counts = stack_set_plan["instances"].get(action)
+        if region_counts != {}:
+            LOGGER.info(f"  stack instances to {action}: {format_counts(region_counts)}")
+    for operation in stack_set_plan["operations"]:
+        LOGGER.info(f"  {operation['type']} - Org Units: {len(operation['org_units'])} - Regions: {', '.join(operation['regions']) or 'all'} - "
+                    f"batches: {operation['batches']} - estimated {format_seconds(operation['estimated_seconds'])}")
@@ -0,0 +1,237 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+operation_history.py keeps the history of the stack set operations and
+tunes the operation preferences of the next operations from it.
+
+For every completed operation the duration and the instance and failure
+counts per region are recorded in a JSON history, stored locally or in S3.
+The tuner raises the concurrency of stack sets that deploy cleanly and
+switches to count based concurrency for small deployments, where a
+percentage rounds down to one account at a time.
+"""
+
+import os
+import json
+import math
+import logging
+import threading
+from datetime import datetime, timezone
+from api_rate_limiter import get_client_error
+
+LOGGER = logging.getLogger()
+
+DEFAULT_HISTORY_SIZE = 20
+DEFAULT_ADAPTIVE_CLEAN_OPERATIONS = 3
+DEFAULT_ADAPTIVE_MAX_CONCURRENT_PERCENTAGE = 100
+DEFAULT_ADAPTIVE_MIN_CONCURRENT_COUNT = 2
+
+
+class LocalHistoryStore:
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def load(self):
+        """
+        This method loads the history from the local JSON file
+        """
+        if not os.path.exists(self.file_path):
+            return {}
+        with open(self.file_path) as file:
+            return json.load(file)
+
+    def save(self, history):
+        """
+        This method saves the history to the local JSON file
+        """
+        with open(self.file_path, 'w') as file:
+            json.dump(history, file, indent=4, sort_keys=True)
+
+
+class S3HistoryStore:
+    def __init__(self, s3_client, bucket, key):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+
+    def load(self):
+        """
+        This method loads the history from the JSON object in S3
+        """
+        try:
+            history = self.s3_client.get_object(Bucket=self.bucket, Key=self.key)
+            return json.loads(history['Body'].read())
+        except get_client_error() as excep:
+            if excep.response['Error']['Code'] in ['NoSuchKey', '404']:
+                return {}
+            raise
+
+    def save(self, history):
+        """
+        This method saves the history as JSON object in S3
+        """
+        self.s3_client.put_object(Bucket=self.bucket,
+                                  Key=self.key,
+                                  Body=json.dumps(history, indent=4, sort_keys=True).encode(),
+                                  ContentType='application/json')
+
+
+class OperationHistory:
+    def __init__(self, store, history_size=DEFAULT_HISTORY_SIZE):
+        self.store = store
+        self.history_size = history_size
+        # stack set name -> operation records, oldest first
+        self.operations = {}
+        self.is_modified = False
+        self.history_lock = threading.Lock()
+
+    def load(self):
+        """
+        This method loads the operation history from its store
+        """
+        try:
+            self.operations = self.store.load()
+            return self
+        except Exception as excep:
+            error_msg = f"Error while loading the operation history: {str(excep)}"
+            raise Exception(error_msg)
+
+    def save(self):
+        """
+        This method saves the operation history to its store when modified
+        """
+        with self.history_lock:
+            if not self.is_modified:
+                return
+            try:
+                self.store.save(self.operations)
+                self.is_modified = False
+            except Exception as excep:
+                error_msg = f"Error while saving the operation history: {str(excep)}"
+                raise Exception(error_msg)
+
+    def get_operations(self, stack_set_name):
+        """
+        This method returns the recorded operations of the supplied stack set
+        """
+        with self.history_lock:
+            return list(self.operations.get(stack_set_name, []))
+
+    def record_operation(self, cf_client, stack_set_name, operation_id):
+        """
+        This method records the duration and the instance and failure
+        counts per region of the supplied completed operation.
+        """
+        try:
+            operation = cf_client.describe_stack_set_operation(StackSetName=stack_set_name,
+                                                               OperationId=operation_id,
+                                                               CallAs='DELEGATED_ADMIN')['StackSetOperation']
+            regions = {}
+            results_paginator = cf_client.get_paginator('list_stack_set_operation_results')
+            for results_page in results_paginator.paginate(StackSetName=stack_set_name,
+                                                           OperationId=operation_id,
+                                                           CallAs='DELEGATED_ADMIN'):
+                for result in results_page['Summaries']:
+                    region_counts = regions.setdefault(result['Region'], {"instances": 0, "failed": 0})
+                    region_counts["instances"] += 1
+                    if result['Status'] in ['FAILED', 'CANCELLED']:
+                        region_counts["failed"] += 1
+
+            started = operation.get('CreationTimestamp')
+            ended = operation.get('EndTimestamp')
+            operation_record = {
+                                    "operation_id": operation_id,
+                                    "action": operation['Action'],
+                                    "status": operation['Status'],
+                                    "recorded_at": datetime.now(timezone.utc).isoformat(),
+                                    "duration_seconds": (ended - started).total_seconds() if started and ended else None,
+                                    "instance_count": sum(counts["instances"] for counts in regions.values()),
+                                    "failed_count": sum(counts["failed"] for counts in regions.values()),
+                                    "regions": regions,
+                                    "operation_preferences": operation.get('OperationPreferences', {})
+                               }
+        except Exception as excep:
+            # history is best effort, it must not fail the deployment
+            LOGGER.warning(f"Unable to record the operation {operation_id} of the stack set {stack_set_name}: {str(excep)}")
+            return None
+
+        with self.history_lock:
+            operations = self.operations.setdefault(stack_set_name, [])
+            operations.append(operation_record)
+            del operations[:-self.history_size]
+            self.is_modified = True
+        return operation_record
+
+
+class PreferencesTuner:
+    def __init__(self, history, clean_operations=DEFAULT_ADAPTIVE_CLEAN_OPERATIONS,
+                 max_concurrent_percentage=DEFAULT_ADAPTIVE_MAX_CONCURRENT_PERCENTAGE,
+                 min_concurrent_count=DEFAULT_ADAPTIVE_MIN_CONCURRENT_COUNT):
+        self.history = history
+        self.clean_operations = clean_operations
+        self.max_concurrent_percentage = max_concurrent_percentage
+        self.min_concurrent_count = min_concurrent_count
+
+    @classmethod
+    def from_config(cls, history, deployment_configs):
+        """
+        This method creates the tuner from the adaptive settings
+        of the deployment config, missing settings use the defaults.
+        """
+        return cls(history,
+                   clean_operations=deployment_configs.get_value('adaptive_clean_operations', DEFAULT_ADAPTIVE_CLEAN_OPERATIONS),
+                   max_concurrent_percentage=deployment_configs.get_value('adaptive_max_concurrent_percentage', DEFAULT_ADAPTIVE_MAX_CONCURRENT_PERCENTAGE),
+                   min_concurrent_count=deployment_configs.get_value('adaptive_min_concurrent_count', DEFAULT_ADAPTIVE_MIN_CONCURRENT_COUNT))
+
+    def get_clean_streak(self, operations):
+        """
+        This method returns the number of most recent operations
+        completed without any failed stack instance
+        """
+        clean_streak = 0
+        for operation in reversed(operations):
+            if operation['status'] != 'SUCCEEDED' or operation['failed_count']:
+                break
+            clean_streak += 1
+        return clean_streak
+
+    def get_instances_per_region(self, operations):
+        """
+        This method returns the largest number of stack instances per region
+        touched by the recent operations, None when there is no history
+        """
+        region_counts = [counts["instances"] for operation in operations for counts in operation['regions'].values()]
+        return max(region_counts) if region_counts else None
+
+    def tune(self, stack_set_name, base_prefs):
+        """
+        This method returns the operation preferences for the next operation of the
+        supplied stack set. The base preferences are used as is until the stack set
+        has clean_operations successful operations without failures, then the
+        concurrency doubles for each further clean operation up to the maximum.
+        Small deployments switch to MaxConcurrentCount/FailureToleranceCount.
+        """
+        operations = self.history.get_operations(stack_set_name)
+        clean_streak = self.get_clean_streak(operations)
+        if clean_streak < self.clean_operations or 'MaxConcurrentPercentage' not in base_prefs:
+            return dict(base_prefs)
+
+        base_percentage = base_prefs['MaxConcurrentPercentage']
+        tuned_percentage = min(self.max_concurrent_percentage,
+                               base_percentage * 2 ** (clean_streak - self.clean_operations + 1))
+        tuned_prefs = dict(base_prefs, MaxConcurrentPercentage=int(tuned_percentage))
+
+        instances_per_region = self.get_instances_per_region(operations[-clean_streak:])
+        if instances_per_region and instances_per_region * tuned_percentage / 100 < self.min_concurrent_count:
+            # the percentage would round down to a single account at a time
+            failure_tolerance_percentage = base_prefs.get('FailureTolerancePercentage', 0)
+            tuned_prefs.pop('MaxConcurrentPercentage')
+            tuned_prefs.pop('FailureTolerancePercentage', None)
+            tuned_prefs['MaxConcurrentCount'] = min(instances_per_region, self.min_concurrent_count)
+            tuned_prefs['FailureToleranceCount'] = int(math.floor(instances_per_region * failure_tolerance_percentage / 100))
+            # count based concurrency above the failure tolerance needs the soft mode
+            tuned_prefs['ConcurrencyMode'] = 'SOFT_FAILURE_TOLERANCE'
+
+        LOGGER.info(f"Stack set {stack_set_name} completed {clean_streak} operation(s) without failures, "
+                    f"tuned operation preferences {tuned_prefs}")
+        return tuned_prefs
@@ -0,0 +1,152 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+operation_journal.py keeps the journal of the stack set operations
+submitted by the running deployment, so a restarted run can resume.
+
+The journal of a stack set records the run id and content hash of the
+deployment and every submitted operation with its phase. It is saved after
+every change, one JSON document per stack set. A restarted run reattaches
+to the operations still in flight instead of submitting them again, and a
+run restarted for the same content hash adopts the run id of the journal so
+the idempotency tokens derived from it match the tokens already submitted.
+A step whose token is journaled as SUCCEEDED is skipped.
+"""
+
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone
+
+LOGGER = logging.getLogger()
+
+SUBMITTED_PHASE = 'submitted'
+COMPLETED_PHASE = 'completed'
+RUNNING_PHASE = 'running'
+
+
+def get_operation_token(run_id, content_hash, stackset_name, step):
+    """
+    This function returns the idempotency token (OperationId or
+    ClientRequestToken) of a deployment step of the stack set
+    """
+    token_source = f"{run_id}:{content_hash}:{stackset_name}:{step}"
+    return hashlib.sha256(token_source.encode()).hexdigest()[:64]
+
+
+class OperationJournal:
+    def __init__(self, store_factory):
+        # stack set name -> store of the journal of the stack set
+        self.store_factory = store_factory
+        self.entries = {}
+        self.journal_lock = threading.Lock()
+
+    def get_entry(self, stackset_name):
+        """
+        This method returns the journal entry of the stack set,
+        loading it from its store on first use
+        """
+        if stackset_name not in self.entries:
+            try:
+                self.entries[stackset_name] = self.store_factory(stackset_name).load()
+            except Exception as excep:
+                error_msg = f"Error while loading the operation journal of the stack set {stackset_name}: {str(excep)}"
+                raise Exception(error_msg)
+        return self.entries[stackset_name]
+
+    def save_entry(self, stackset_name, entry):
+        """
+        This method saves the journal entry of the stack set to its store
+        """
+        entry["updated_at"] = datetime.now(timezone.utc).isoformat()
+        self.entries[stackset_name] = entry
+        try:
+            self.store_factory(stackset_name).save(entry)
+        except Exception as excep:
+            error_msg = f"Error while saving the operation journal of the stack set {stackset_name}: {str(excep)}"
+            raise Exception(error_msg)
+
+    def get_pending_operations(self, stackset_name):
+        """
+        This method returns the (operation id, operation type) of the
+        journaled operations not yet seen completed
+        """
+        with self.journal_lock:
+            entry = self.get_entry(stackset_name)
+            return [(operation["operation_id"], operation["operation_type"])
+                    for operation in entry.get("operations", [])
+                    if operation["phase"] == SUBMITTED_PHASE]
+
+    def get_operation_status(self, stackset_name, operation_id):
+        """
+        This method returns the final status of the journaled operation
+        of the stack set, None when it is not seen completed
+        """
+        with self.journal_lock:
+            entry = self.get_entry(stackset_name)
+            for operation in entry.get("operations", []):
+                if operation["operation_id"] == operation_id and operation["phase"] == COMPLETED_PHASE:
+                    return operation["status"]
+            return None
+
+    def start(self, stackset_name, run_id, content_hash):
+        """
+        This method starts the journal of a deployment of the stack set and
+        returns the run id to derive the tokens from, the run id of the journal
+        when it records an unfinished deployment of the same content hash
+        """
+        with self.journal_lock:
+            entry = self.get_entry(stackset_name)
+            if entry.get("phase") == RUNNING_PHASE and entry.get("content_hash") == content_hash:
+                LOGGER.info(f"Resuming the deployment of the stack set {stackset_name} started by run {entry['run_id']}")
+                return entry["run_id"]
+            self.save_entry(stackset_name, {
+                                                "stack_set_name": stackset_name,
+                                                "run_id": run_id,
+                                                "content_hash": content_hash,
+                                                "phase": RUNNING_PHASE,
+                                                "started_at": datetime.now(timezone.utc).isoformat(),
+                                                "operations": []
+                                            })
+            return run_id
+
+    def record_submitted(self, stackset_name, operation_id, operation_type):
+        """
+        This method records the submitted operation of the stack set
+        """
+        with self.journal_lock:
+            entry = self.get_entry(stackset_name)
+            operations = entry.setdefault("operations", [])
+            if any(operation["operation_id"] == operation_id for operation in operations):
+                return
+            operations.append({
+                                    "operation_id": operation_id,
+                                    "operation_type": operation_type,
+                                    "phase": SUBMITTED_PHASE,
+                                    "status": None,
+                                    "submitted_at": datetime.now(timezone.utc).isoformat()
+                              })
+            self.save_entry(stackset_name, entry)
+
+    def record_completed(self, stackset_name, operation_id, operation_status):
+        """
+        This method records the final status of the operation of the stack set
+        """
+        with self.journal_lock:
+            entry = self.get_entry(stackset_name)
+            for operation in entry.get("operations", []):
+                if operation["operation_id"] == operation_id:
+                    operation["phase"] = COMPLETED_PHASE
+                    operation["status"] = operation_status
+                    self.save_entry(stackset_name, entry)
+                    return
+
+    def complete(self, stackset_name):
+        """
+        This method marks the deployment of the stack set as completed
+        """
+        with self.journal_lock:
+            entry = self.get_entry(stackset_name)
+            if entry:
+                entry["phase"] = COMPLETED_PHASE
+                self.save_entry(stackset_name, entry)
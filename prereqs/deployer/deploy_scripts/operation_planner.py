@@ -0,0 +1,51 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+operation_planner.py turns the difference between the deployment targets
+and the currently deployed stack instances into the stack instance
+operations to submit.
+
+The planned operations never cover the same stack instances twice, so they
+can be submitted back to back when the stack set has managed execution
+active and CloudFormation runs or queues them.
+"""
+
+from collections import namedtuple
+
+# action is either 'create' or 'delete', accounts narrows the Org Units
+# to the supplied accounts (INTERSECTION account filter) when set
+PlannedOperation = namedtuple('PlannedOperation', ['action', 'org_units', 'regions', 'accounts'], defaults=(None,))
+
+
+def plan_operations(tgt_ou_ids, tgt_regions, current_ou_ids, current_regions):
+    """
+    This function returns the minimal list of non-overlapping stack instance
+    operations that bring the current Org Units and Regions to the targets,
+    the delete operations come first.
+    """
+    tgt_ou_ids = set(tgt_ou_ids)
+    tgt_regions = set(tgt_regions)
+    current_ou_ids = set(current_ou_ids)
+    current_regions = set(current_regions)
+
+    new_ou_ids = tgt_ou_ids - current_ou_ids
+    kept_ou_ids = tgt_ou_ids & current_ou_ids
+    removed_ou_ids = current_ou_ids - tgt_ou_ids
+    new_regions = tgt_regions - current_regions
+    removed_regions = current_regions - tgt_regions
+
+    planned_operations = []
+    if removed_ou_ids and current_regions:
+        # removed OUs are deleted from every region they are deployed to
+        planned_operations.append(PlannedOperation('delete', sorted(removed_ou_ids), sorted(current_regions)))
+    if kept_ou_ids and removed_regions:
+        # removed regions are deleted from the remaining OUs only
+        planned_operations.append(PlannedOperation('delete', sorted(kept_ou_ids), sorted(removed_regions)))
+    if new_ou_ids and tgt_regions:
+        # new OUs are deployed to every target region
+        planned_operations.append(PlannedOperation('create', sorted(new_ou_ids), sorted(tgt_regions)))
+    if kept_ou_ids and new_regions:
+        # new regions are deployed to the existing OUs only
+        planned_operations.append(PlannedOperation('create', sorted(kept_ou_ids), sorted(new_regions)))
+
+    return planned_operations
@@ -0,0 +1,157 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+run_metrics.py collects the performance metrics of a deployment run.
+
+The duration of every phase of the run (config load, template discovery,
+S3 staging, inventory lookups, diff, operation submits and waits) is
+recorded per stack set. At the end of the run the phase timings, the API
+call and page counts of the CloudFormation client and the waiter stats are
+written as a JSON run report and optionally printed to stdout in CloudWatch
+Embedded Metric Format, so CloudWatch Logs turns them into metrics.
+"""
+
+import json
+import logging
+import threading
+from time import time, monotonic
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+LOGGER = logging.getLogger()
+
+DEFAULT_METRICS_NAMESPACE = 'StackSetDeployer'
+RUN_PHASE = 'run'
+
+
+class RunMetrics:
+    def __init__(self, run_id=None, app_name=None, environment=None):
+        self.run_id = run_id
+        self.app_name = app_name
+        self.environment = environment
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        # (phase name, stack set name) -> phase stats
+        self.phase_stats = {}
+        # stack set name -> waiter latency stats
+        self.waiter_stats = {}
+        self.metrics_lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, phase_name, stackset_name=None):
+        """
+        This method times the with block as the supplied phase,
+        the phase is recorded whether the block fails or not
+        """
+        started = monotonic()
+        try:
+            yield
+        finally:
+            self.record_phase(phase_name, monotonic() - started, stackset_name)
+
+    def record_phase(self, phase_name, elapsed, stackset_name=None):
+        """
+        This method records the duration of the supplied phase
+        """
+        with self.metrics_lock:
+            stats = self.phase_stats.setdefault((phase_name, stackset_name), {
+                                                                                    "count": 0,
+                                                                                    "total_seconds": 0.0,
+                                                                                    "max_seconds": 0.0
+                                                                                })
+            stats["count"] += 1
+            stats["total_seconds"] += elapsed
+            stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+
+    def record_waiter_stats(self, stackset_name, latency_stats):
+        """
+        This method records the waiter latency stats of the stack set
+        """
+        with self.metrics_lock:
+            self.waiter_stats[stackset_name] = latency_stats
+
+    def get_phase_totals(self):
+        """
+        This method returns the total duration of every phase across the stack sets
+        """
+        phase_totals = {}
+        with self.metrics_lock:
+            for (phase_name, _), stats in self.phase_stats.items():
+                phase_totals[phase_name] = phase_totals.get(phase_name, 0.0) + stats["total_seconds"]
+        return phase_totals
+
+    def get_report(self, api_stats=None):
+        """
+        This method returns the run report with the phase timings per stack set,
+        the API call counters and the waiter stats
+        """
+        with self.metrics_lock:
+            run_phases = {}
+            stack_set_phases = {}
+            for (phase_name, stackset_name), stats in sorted(self.phase_stats.items(), key=lambda item: (item[0][1] or '', item[0][0])):
+                if stackset_name:
+                    stack_set_phases.setdefault(stackset_name, {})[phase_name] = dict(stats)
+                else:
+                    run_phases[phase_name] = dict(stats)
+            waiter_stats = dict(self.waiter_stats)
+
+        api_stats = api_stats or {}
+        return {
+                    "run_id": self.run_id,
+                    "app_name": self.app_name,
+                    "environment": self.environment,
+                    "started_at": self.started_at,
+                    "completed_at": datetime.now(timezone.utc).isoformat(),
+                    "phases": run_phases,
+                    "stack_sets": {stackset_name: {"phases": phases, "waiters": waiter_stats.get(stackset_name, {})}
+                                   for stackset_name, phases in stack_set_phases.items()},
+                    "api_calls": api_stats,
+                    "api_call_count": sum(stats.get("calls", 0) for stats in api_stats.values()),
+                    "api_page_count": sum(stats.get("pages", 0) for stats in api_stats.values())
+               }
+
+    def write_report(self, report_file, api_stats=None):
+        """
+        This method writes the run report to the supplied JSON file and returns the report
+        """
+        report = self.get_report(api_stats)
+        try:
+            with open(report_file, 'w') as file:
+                json.dump(report, file, indent=4, sort_keys=True)
+            LOGGER.info(f"Run report written to {report_file}")
+        except Exception as excep:
+            # the report must not fail the deployment
+            LOGGER.warning(f"Unable to write the run report to {report_file}: {str(excep)}")
+        return report
+
+    def get_emf_record(self, report, namespace=DEFAULT_METRICS_NAMESPACE):
+        """
+        This method returns the run level metrics of the report
+        as a CloudWatch Embedded Metric Format record
+        """
+        metric_values = {f"{phase_name}_seconds": seconds for phase_name, seconds in self.get_phase_totals().items()}
+        metric_values["api_call_count"] = report["api_call_count"]
+        metric_values["api_page_count"] = report["api_page_count"]
+        metric_values["api_retry_count"] = sum(stats.get("retries", 0) for stats in report["api_calls"].values())
+        metric_values["stack_set_count"] = len(report["stack_sets"])
+
+        metric_definitions = [{"Name": metric_name, "Unit": "Seconds" if metric_name.endswith('_seconds') else "Count"}
+                              for metric_name in sorted(metric_values)]
+        return dict({
+                        "_aws": {
+                                    "Timestamp": int(time() * 1000),
+                                    "CloudWatchMetrics": [{
+                                                            "Namespace": namespace,
+                                                            "Dimensions": [["App", "Environment"]],
+                                                            "Metrics": metric_definitions
+                                                         }]
+                                },
+                        "App": self.app_name,
+                        "Environment": self.environment,
+                        "RunId": self.run_id
+                    }, **metric_values)
+
+    def emit_emf(self, report, namespace=DEFAULT_METRICS_NAMESPACE):
+        """
+        This method prints the EMF record of the report to stdout
+        """
+        print(json.dumps(self.get_emf_record(report, namespace)), flush=True)
@@ -10,14 +10,23 @@ This moudle evaluates the deployment target inputs provided in the deployment co
 file and performs the stack set deployment.
 """
 
-import os
 import sys
 import json
-import argparse
-from time import sleep
 import logging
-import boto3
-from botocore.exceptions import ClientError
+from stackset_waiter import OperationWaiter
+from stackset_progress import InstanceProgressTracker, ProgressReporter, DEFAULT_PROGRESS_POLL_INTERVAL, PROGRESS_FIELDS
+from stackset_inventory import StackSetInventory
+import operation_planner
+import target_diff
+import deployment_plan
+import deployment_flow
+from deployment_flow import ApiCall, Call, Wait, Gather
+from operation_history import PreferencesTuner
+from api_rate_limiter import RateLimitedClient, get_client_error
+from stackset_lock import get_run_id
+from operation_journal import get_operation_token
+from run_metrics import RunMetrics
+from config_model import DeploymentConfig, load_deployment_config
 
 FORMAT = '%(asctime)s %(levelname)s %(message)s'
 logging.basicConfig(format=FORMAT,
@@ -27,12 +36,48 @@ logging.basicConfig(format=FORMAT,
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
+# stack instance field name -> getter on the list_stack_instances summary
+STACK_INSTANCE_FIELDS = {
+                            'StackSetId': lambda summary: summary['StackSetId'],
+                            'StackId': lambda summary: summary.get('StackId', None),
+                            'DeployedRegion': lambda summary: summary['Region'],
+                            'DeployedOUId': lambda summary: summary['OrganizationalUnitId'],
+                            'DeployedAccount': lambda summary: summary['Account'],
+                            'InstanceSyncStatus': lambda summary: summary['Status'],
+                            'StackInstanceStatus': lambda summary: summary['StackInstanceStatus']['DetailedStatus'],
+                            'DriftStatus': lambda summary: summary.get('DriftStatus', 'NOT_CHECKED')
+                        }
+
+STOPPED_DEPLOYMENT_ERROR = "Deployment not started, stopped after an earlier deployment failed"
+DEFAULT_TEARDOWN_MAX_CONCURRENT_PERCENTAGE = 100
+DEFAULT_TEARDOWN_FAILURE_TOLERANCE_PERCENTAGE = 0
+# errors of delete_stack_set while the last stack instances are being deleted
+STACK_SET_NOT_EMPTY_ERROR_CODES = ['StackSetNotEmptyException', 'OperationInProgressException']
+
 
 class Deployer:
-    def __init__(self, env, aws_region):
+    def __init__(self, env, aws_region, inventory=None, deployment_manifest=None, operation_history=None, cf_client=None, stackset_queue=None, operation_journal=None,
+                 metrics=None, org_resolver=None):
         self.environment = env
-        self.cf_client = boto3.client('cloudformation', aws_region)
+        if cf_client is None:
+            # boto3 is imported on first use, so a run failing its input validation never loads it
+            import boto3
+            cf_client = RateLimitedClient(boto3.client('cloudformation', aws_region))
+        self.cf_client = cf_client
+        self.inventory = inventory if inventory else StackSetInventory(self.cf_client)
+        self.deployment_manifest = deployment_manifest
+        self.aws_region = aws_region
+        self.org_resolver = org_resolver
+        self.operation_history = operation_history
+        self.stackset_queue = stackset_queue
+        self.operation_journal = operation_journal
+        self.metrics = metrics if metrics else RunMetrics()
+        self.run_id = stackset_queue.run_id if stackset_queue else get_run_id()
+        self.content_hash = None
+        self.preferences_tuner = None
         self.deployment_configs = None
+        self.stack_set_name = None
+        self.waiter = OperationWaiter()
 
     def get_boto_api_paginator(self, client, method, op_parameters):
         """
@@ -45,125 +90,190 @@ class Deployer:
     def get_current_stacksets(self):
         """
         This method returns the list of current stack sets
+        from the stack set inventory
         """
         try:
-            current_stack_sets = []
-            stackset_filter = {
-                                "Status": "ACTIVE",
-                                "CallAs": "DELEGATED_ADMIN"
-                            }
-            stackset_paginator = self.get_boto_api_paginator(self.cf_client,
-                                                            'list_stack_sets',
-                                                            stackset_filter)
-            for stackset_page in stackset_paginator:
-                current_stack_sets = current_stack_sets + [stackset['StackSetName'] for stackset in stackset_page['Summaries']]
-
-            return current_stack_sets          
+            return list(self.inventory.list_stack_sets())
         except Exception as excep:
             error_msg = f"Error while getting current list of stack sets: {str(excep)}"
             raise Exception(error_msg)
 
-    def check_stackset_exists(self, stackset_name):
+    def run_flow(self, flow):
+        """
+        This method runs the supplied flow of the deployer
+        on the calling thread, see deployment_flow
+        """
+        return deployment_flow.run_flow(flow, self.cf_client)
+
+    def check_stackset_exists_flow(self, stackset_name, refresh=False):
         """
-        This method check the supplied stack set exists or not
+        This method is the flow checking the supplied stack set exists or not,
+        refresh skips the cached inventory entry of the stack set.
         """
         LOGGER.info(f"Checking the existence of {stackset_name} stack set")
-        return stackset_name in self.get_current_stacksets()
+        with self.metrics.phase('inventory_lookup', stackset_name):
+            return (yield Call(self.inventory.exists, stackset_name, refresh))
 
-    def get_stack_instances(self, stackset_name):
+    def check_stackset_exists(self, stackset_name, refresh=False):
         """
-        This method returns the listo f stack instances of the supplied
-        stack set
+        This method check the supplied stack set exists or not,
+        refresh skips the cached inventory entry of the stack set.
         """
-        try: 
-            current_stack_instances = []
-            stack_instances_filter = {
-                                        "StackSetName": stackset_name,
-                                        "CallAs": "DELEGATED_ADMIN"
-                                    }
+        return self.run_flow(self.check_stackset_exists_flow(stackset_name, refresh))
+
+    def get_stack_instances_query(self, stackset_name, account=None, region=None, detailed_status=None, operation_id=None):
+        """
+        This method returns the list_stack_instances parameters for the
+        supplied stack set, narrowing the query on the API side to the
+        supplied account, region, detailed status and last operation id.
+        """
+        stack_instances_filter = {
+                                    "StackSetName": stackset_name,
+                                    "CallAs": "DELEGATED_ADMIN"
+                                }
+        if account:
+            stack_instances_filter["StackInstanceAccount"] = account
+        if region:
+            stack_instances_filter["StackInstanceRegion"] = region
+
+        api_filters = []
+        if detailed_status:
+            api_filters.append({"Name": "DETAILED_STATUS", "Values": detailed_status})
+        if operation_id:
+            api_filters.append({"Name": "LAST_OPERATION_ID", "Values": operation_id})
+        if api_filters:
+            stack_instances_filter["Filters"] = api_filters
+
+        return stack_instances_filter
+
+    def iter_stack_instances(self, stackset_name, fields=None, **query):
+        """
+        This method streams the stack instances of the supplied stack set
+        page by page. Each stack instance is yielded as a dict of all the
+        fields, or as a tuple of only the supplied fields in the same order.
+        The query (account, region, detailed_status, operation_id) is applied
+        by the list_stack_instances API.
+        """
+        try:
+            stack_instances_filter = self.get_stack_instances_query(stackset_name, **query)
+            field_names = fields if fields else list(STACK_INSTANCE_FIELDS)
+            getters = [STACK_INSTANCE_FIELDS[field_name] for field_name in field_names]
             stack_instances_paginator = self.get_boto_api_paginator(self.cf_client,
                                                                     'list_stack_instances',
                                                                     stack_instances_filter)
             for stack_instances_page in stack_instances_paginator:
                 for stack_instance in stack_instances_page['Summaries']:
-                    current_stack_instance = {
-                                                'StackSetId': stack_instance['StackSetId'],
-                                                'StackId': stack_instance.get('StackId', None),
-                                                'DeployedRegion': stack_instance['Region'],
-                                                'DeployedOUId': stack_instance['OrganizationalUnitId'],
-                                                'DeployedAccount': stack_instance['Account'],
-                                                'InstanceSyncStatus': stack_instance['Status'],
-                                                'StackInstanceStatus': stack_instance['StackInstanceStatus']['DetailedStatus']
-                                            }
-                    current_stack_instances.append(current_stack_instance)
-            
-            return current_stack_instances
+                    if fields:
+                        yield tuple(getter(stack_instance) for getter in getters)
+                    else:
+                        yield {field_name: getter(stack_instance) for field_name, getter in zip(field_names, getters)}
         except Exception as excep:
             error_msg = f"Error while getting current list of stack instances for the stack set {stackset_name}: {str(excep)}"
             raise Exception(error_msg)
 
-    def get_stack_instances_current_regions(self, stack_instances):
+    def paginate_flow(self, api_method, request, consume_page):
         """
-        This method returns the list of stack instances in current region
+        This method is the flow fetching the pages of the supplied API method
+        and passing each page to consume_page, the pagination stops early
+        once consume_page returns True.
         """
-        stack_instances_current_regions = [stack_instance["DeployedRegion"] for stack_instance in stack_instances]
-        return list(set(stack_instances_current_regions))
+        while True:
+            page = yield ApiCall(api_method, is_page=True, **request)
+            if consume_page(page) or not page.get('NextToken'):
+                return
+            request = dict(request, NextToken=page['NextToken'])
 
-    def get_stack_instances_current_ous(self, stack_instances):
+    def for_each_stack_instance_flow(self, stackset_name, fields, consume, **query):
         """
-        This method returns the currently deployed Organization Units of 
-        supplied stack instances
+        This method is the flow passing the stack instances of the supplied
+        stack set to consume page by page, each stack instance as a tuple
+        of the supplied fields. The query is applied by the list_stack_instances
+        API as in iter_stack_instances.
         """
-        stack_instances_current_ous = [stack_instance["DeployedOUId"] for stack_instance in stack_instances]
-        return list(set(stack_instances_current_ous))
-    
-    def get_stack_instances_status(self, stack_instances):
+        getters = [STACK_INSTANCE_FIELDS[field_name] for field_name in fields]
+
+        def consume_page(stack_instances_page):
+            for stack_instance in stack_instances_page['Summaries']:
+                consume(tuple(getter(stack_instance) for getter in getters))
+
+        try:
+            yield from self.paginate_flow('list_stack_instances', self.get_stack_instances_query(stackset_name, **query), consume_page)
+        except Exception as excep:
+            error_msg = f"Error while getting current list of stack instances for the stack set {stackset_name}: {str(excep)}"
+            raise Exception(error_msg)
+
+    def get_stack_instance_columns_flow(self, stackset_name, fields, **query):
         """
-        This method returns the status of supplied stack instances
+        This method is the flow returning the distinct values of each supplied
+        field across the stack instances of the stack set, computed in a single
+        pass without keeping the stack instances in memory.
         """
-        stack_instances_status = [stack_instance["StackInstanceStatus"] for stack_instance in stack_instances]
-        return list(set(stack_instances_status))
-    
-    def check_stack_instances_progress(self, stackset_name):
+        columns = tuple(set() for _ in fields)
+
+        def add_stack_instance(stack_instance):
+            for column, value in zip(columns, stack_instance):
+                column.add(value)
+
+        yield from self.for_each_stack_instance_flow(stackset_name, fields, add_stack_instance, **query)
+        return columns
+
+    def get_stack_instances(self, stackset_name, **query):
         """
-        This method checks the current progress status of 
-        stack instances of supplied stack set
+        This method returns the listo f stack instances of the supplied
+        stack set, optionally narrowed by the query
+        (account, region, detailed_status, operation_id)
+        """
+        return list(self.iter_stack_instances(stackset_name, **query))
+
+    def check_stack_instances_progress_flow(self, stackset_name, operation_id=None):
+        """
+        This method is the flow checking the current progress status of
+        stack instances of supplied stack set, polling at most once per
+        progress_poll_interval. The stack instance counters per region and
+        Org Unit are reported once per progress_report_interval and a stack
+        instance is reported on its own only when it reaches a terminal status.
+        When the operation id is supplied only the stack instances
+        of that operation are fetched.
         """
         try: 
-            check_status = True
-            progress_status = ['PENDING', 'RUNNING']
-            while check_status:
-                stack_instances = self.get_stack_instances(stackset_name)
-                stack_instances_status = self.get_stack_instances_status(stack_instances)
-                check_status = any(status in progress_status for status in stack_instances_status)
-                for stack_instance in stack_instances:
-                    LOGGER.info(f"StackId: {stack_instance['StackId']} - OU: {stack_instance['DeployedOUId']} \
-                                    - Region: {stack_instance['DeployedRegion']} - Status: {stack_instance['StackInstanceStatus']}")
-
-            return stack_instances
+            progress_tracker = InstanceProgressTracker(stackset_name, ProgressReporter.from_config(stackset_name, self.deployment_configs))
+            poll_interval = self.deployment_configs.get_value('progress_poll_interval', DEFAULT_PROGRESS_POLL_INTERVAL)
+            progress_waiter = OperationWaiter(initial_delay=poll_interval,
+                                              max_delay=poll_interval,
+                                              backoff_rate=1,
+                                              jitter=0,
+                                              timeout=self.waiter.timeout)
+
+            def check_progress():
+                progress_tracker.start_poll()
+                yield from self.for_each_stack_instance_flow(stackset_name, PROGRESS_FIELDS, progress_tracker.add, operation_id=operation_id)
+                return not progress_tracker.finish_poll(), progress_tracker.get_counters()
+
+            return (yield Wait(progress_waiter, 'stack_instances_progress', check_progress))
         except Exception as excep:
             error_msg = f"Error while checking stack instance progress for the stack set {stackset_name}: {str(excep)}"
             raise Exception(error_msg)
 
-    def check_stack_instances_opeartion_status(self, operation_id, stackset_name):
+    def check_stack_instances_opeartion_status_flow(self, operation_id, stackset_name, operation_type="stack_set_operation"):
         """
-        This method checks the opeartion status of supplied stack set and operation id
+        This method is the flow checking the opeartion status of supplied stack set
+        and operation id, waiting with backoff until the operation is no longer in progress.
         """
         try: 
-            current_op_status = "RUNNING"
-            pending_op_status = ['RUNNING', 'STOPPING']
+            pending_op_status = ['QUEUED', 'RUNNING', 'STOPPING']
 
-            while current_op_status in pending_op_status:
-                operation = self.cf_client.describe_stack_set_operation(StackSetName=stackset_name,
-                                                                        OperationId=operation_id,
-                                                                        CallAs='DELEGATED_ADMIN')
+            def check_operation():
+                operation = yield ApiCall('describe_stack_set_operation',
+                                          StackSetName=stackset_name,
+                                          OperationId=operation_id,
+                                          CallAs='DELEGATED_ADMIN')
                 current_op_status = operation['StackSetOperation']['Status']
                 current_op_action = operation['StackSetOperation']['Action']
 
                 LOGGER.info(f"Checking {current_op_action} opeartion ({operation_id}) status of the stack set {stackset_name} - {current_op_status}")
-                sleep(15)
+                return current_op_status not in pending_op_status, current_op_status
 
-            return current_op_status
+            return (yield Wait(self.waiter, operation_type, check_operation))
         except Exception as excep:
             error_msg = f"Error while checking operation status for the stack set {stackset_name} and operation ID {operation_id}: {str(excep)}"
             raise Exception(error_msg)
@@ -181,71 +291,290 @@ class Deployer:
                ]
         return tags
 
-    def deploy_stack_set(self, is_exists, cft_url, cft_parameters):
+    def get_operation_preferences(self):
+        """
+        This method returns the stack set operation preferences
+        from the deployment config, tuned from the operation history
+        when adaptive operation preferences are enabled.
+        """
+        operational_prefs = dict(self.get_environment_config().operation_preferences)
+        if self.preferences_tuner:
+            return self.preferences_tuner.tune(self.stack_set_name, operational_prefs)
+        return operational_prefs
+
+    def get_auto_deployment(self):
+        """
+        This method returns the auto deployment settings of the stack set
+        from the deployment config
+        """
+        return self.deployment_configs.auto_deployment
+
+    def get_managed_execution(self):
+        """
+        This method returns the managed execution settings of the stack set
+        from the deployment config. With managed execution CloudFormation runs
+        non-conflicting operations concurrently and queues conflicting ones.
+        """
+        return self.deployment_configs.managed_execution
+
+    def is_managed_execution_active_flow(self, stackset_name):
+        """
+        This method is the flow checking whether the deployed stack set has managed
+        execution active, so that its operations can be submitted back to back.
+        """
+        stack_set = yield Call(self.inventory.describe_stack_set, stackset_name)
+        return bool(stack_set and stack_set.get('ManagedExecution', {}).get('Active'))
+
+    def record_completed_flow(self, operation_id, operation_status):
+        """
+        This method is the flow recording the completed operation of the
+        stack set in the operation journal and the operation history
+        """
+        if self.operation_journal:
+            yield Call(self.operation_journal.record_completed, self.stack_set_name, operation_id, operation_status)
+        if self.operation_history:
+            yield Call(self.operation_history.record_operation, self.cf_client, self.stack_set_name, operation_id)
+
+    def wait_for_operation_flow(self, operation_id, operation_type):
         """
-        This method depoys the stack set; evaluates the supplied parameters
-        and calls right API to create/update stack set.
+        This method is the flow waiting for the supplied stack set operation
+        to complete and returns the status of the operation
+        """
+        with self.metrics.phase(f"wait_{operation_type}", self.stack_set_name):
+            if operation_type == 'create_stack_instances':
+                yield from self.check_stack_instances_progress_flow(self.stack_set_name, operation_id)
+            operation_status = yield from self.check_stack_instances_opeartion_status_flow(operation_id, self.stack_set_name, operation_type)
+        yield from self.record_completed_flow(operation_id, operation_status)
+        return operation_status
+
+    def wait_for_operations_flow(self, operations):
+        """
+        This method is the flow waiting for the supplied (operation id, operation type)
+        stack set operations to complete, concurrently on the async engine, and
+        raises an error listing the failed or stopped operations. The skipped
+        steps, without operation id, are not waited for.
+        """
+        operations = [operation for operation in operations if operation[0] is not None]
+        operation_statuses = yield Gather(self.wait_for_operation_flow(operation_id, operation_type)
+                                          for operation_id, operation_type in operations)
+        failed_operations = [f"{operation_type} {operation_id} is {operation_status}"
+                             for (operation_id, operation_type), operation_status in zip(operations, operation_statuses)
+                             if operation_status in ['FAILED', 'STOPPED']]
+        if failed_operations:
+            error_message = f"{self.stack_set_name} Stack Set Operation(s) {', '.join(failed_operations)}"
+            raise Exception(error_message)
+
+    def add_operation_token(self, api_request, token_name, step):
+        """
+        This method adds the idempotency token of the supplied step to the API
+        parameters when the operation journal is enabled. The token is derived
+        from the run id, the content hash and the targets of the request, so a
+        resumed run submits the same step with the same token.
+        """
+        if self.operation_journal:
+            step_targets = json.dumps([api_request.get("DeploymentTargets"), api_request.get("Regions")], sort_keys=True)
+            api_request[token_name] = get_operation_token(self.run_id, self.content_hash, self.stack_set_name, f"{step}:{step_targets}")
+        return api_request
+
+    def submit_operation_flow(self, api_method, api_request, operation_type):
+        """
+        This method is the flow submitting the stack set operation, records it
+        in the operation journal and returns the operation id. An operation id
+        already submitted by the resumed run is reattached to, unless
+        that operation failed, then the operation is submitted again.
+        A step whose operation already succeeded is skipped and None is
+        returned, so no describe or wait is issued for it.
+        """
+        if self.operation_journal and api_request.get('OperationId'):
+            operation_status = yield Call(self.operation_journal.get_operation_status, self.stack_set_name, api_request['OperationId'])
+            if operation_status == 'SUCCEEDED':
+                LOGGER.info(f"Operation {api_request['OperationId']} of the stack set {self.stack_set_name} already succeeded, skipping it")
+                return None
+        try:
+            with self.metrics.phase(f"submit_{operation_type}", self.stack_set_name):
+                operation_id = (yield ApiCall(api_method, **api_request))['OperationId']
+        except get_client_error() as excep:
+            if excep.response['Error']['Code'] != 'OperationIdAlreadyExistsException':
+                raise
+            operation_id = api_request['OperationId']
+            operation = (yield ApiCall('describe_stack_set_operation',
+                                       StackSetName=self.stack_set_name,
+                                       OperationId=operation_id,
+                                       CallAs='DELEGATED_ADMIN'))['StackSetOperation']
+            if operation['Status'] in ['FAILED', 'STOPPED']:
+                LOGGER.info(f"Operation {operation_id} of the stack set {self.stack_set_name} is {operation['Status']}, submitting it again")
+                api_request = {name: value for name, value in api_request.items() if name != 'OperationId'}
+                operation_id = (yield ApiCall(api_method, **api_request))['OperationId']
+            elif operation['Status'] == 'SUCCEEDED':
+                LOGGER.info(f"Operation {operation_id} of the stack set {self.stack_set_name} already succeeded, skipping it")
+                yield from self.record_completed_flow(operation_id, operation['Status'])
+                return None
+            else:
+                LOGGER.info(f"Operation {operation_id} of the stack set {self.stack_set_name} was already submitted, reattaching")
+
+        if self.operation_journal:
+            yield Call(self.operation_journal.record_submitted, self.stack_set_name, operation_id, operation_type)
+        return operation_id
+
+    def resume_operations_flow(self):
+        """
+        This method is the flow waiting for the operations of the stack set left
+        in flight by a previous run and starting the operation journal of this deployment
+        """
+        if not self.operation_journal:
+            return
+        pending_operations = yield Call(self.operation_journal.get_pending_operations, self.stack_set_name)
+        if pending_operations:
+            LOGGER.info(f"Reattaching to {len(pending_operations)} operation(s) of the stack set {self.stack_set_name} submitted by a previous run")
+            try:
+                yield from self.wait_for_operations_flow(pending_operations)
+            except Exception as excep:
+                # the deployment targets are evaluated again after the previous operations
+                LOGGER.warning(f"Previous operation(s) of the stack set {self.stack_set_name} did not succeed: {str(excep)}")
+        self.run_id = yield Call(self.operation_journal.start, self.stack_set_name, self.run_id, self.content_hash)
+
+    def get_stack_set_request(self, cft_url, cft_parameters, is_update):
+        """
+        This method returns the create_stack_set/update_stack_set
+        API parameters of the stack set
+        """
+        stack_set_request = {
+                                "StackSetName": self.stack_set_name,
+                                "Description": self.deployment_configs['stack_set_desciption'],
+                                "TemplateURL": cft_url,
+                                "Parameters": cft_parameters,
+                                "Capabilities": self.deployment_configs['cft_capabilities'],
+                                "Tags": self.get_tags(),
+                                "PermissionModel": 'SERVICE_MANAGED',
+                                "AutoDeployment": self.get_auto_deployment(),
+                                "ManagedExecution": self.get_managed_execution(),
+                                "CallAs": 'DELEGATED_ADMIN'
+                            }
+        if is_update:
+            stack_set_request["OperationPreferences"] = self.get_operation_preferences()
+            self.add_operation_token(stack_set_request, "OperationId", "update_stack_set")
+        else:
+            stack_set_request["ClientRequestToken"] = self.stack_set_name
+            self.add_operation_token(stack_set_request, "ClientRequestToken", "create_stack_set")
+        return stack_set_request
+
+    def get_stack_instances_request(self, target_ou_ids, target_regions, filter_accounts, filter_type):
+        """
+        This method returns the create_stack_instances API parameters
+        for the supplied target organization units and regions
+        """
+        deployment_targets = {
+                                "OrganizationalUnitIds": target_ou_ids
+                             }
+
+        if filter_accounts and filter_type:
+            deployment_targets["Accounts"] = filter_accounts
+            deployment_targets["AccountFilterType"] = filter_type                                       
+
+        stack_instances_request = {
+                                      "StackSetName": self.stack_set_name,
+                                      "DeploymentTargets": deployment_targets,
+                                      "Regions": target_regions,
+                                      "OperationPreferences": self.get_operation_preferences(),
+                                      "CallAs": 'DELEGATED_ADMIN'
+                                  }
+        return self.add_operation_token(stack_instances_request, "OperationId", "create_stack_instances")
+
+    def get_remove_stack_instances_request(self, target_ou_ids, target_regions, target_accounts=None):
+        """
+        This method returns the delete_stack_instances API parameters for the
+        supplied target organization units and regions, narrowed to the
+        target accounts when supplied
+        """
+        deployment_targets = {
+                                "OrganizationalUnitIds": target_ou_ids
+                             }
+        if target_accounts:
+            deployment_targets["Accounts"] = target_accounts
+            deployment_targets["AccountFilterType"] = "INTERSECTION"
+
+        remove_instances_request = {
+                                       "StackSetName": self.stack_set_name,
+                                       "DeploymentTargets": deployment_targets,
+                                       "Regions": target_regions,
+                                       "OperationPreferences": self.get_operation_preferences(),
+                                       "RetainStacks": False,
+                                       "CallAs": 'DELEGATED_ADMIN'
+                                   }
+        return self.add_operation_token(remove_instances_request, "OperationId", "delete_stack_instances")
+
+    def get_planned_operation_request(self, planned_operation, tgt_filter_accounts, tgt_filter_type):
+        """
+        This method logs the supplied planned operation and returns its
+        API method, API parameters and operation type
+        """
+        accounts_message = f" of {len(planned_operation.accounts)} account(s)" if planned_operation.accounts else ""
+        if planned_operation.action == 'delete':
+            LOGGER.info(f"Deleting Stack Instance for the OUs {planned_operation.org_units} and regions {planned_operation.regions}{accounts_message}")
+            return 'delete_stack_instances', \
+                self.get_remove_stack_instances_request(planned_operation.org_units,
+                                                        planned_operation.regions,
+                                                        planned_operation.accounts), \
+                'delete_stack_instances'
+
+        LOGGER.info(f"Stack instances will be created in Org Units, {planned_operation.org_units} and Regions, {planned_operation.regions}{accounts_message}")
+        # account level operations target exactly the accounts to add
+        return 'create_stack_instances', \
+            self.get_stack_instances_request(planned_operation.org_units,
+                                             planned_operation.regions,
+                                             planned_operation.accounts or tgt_filter_accounts,
+                                             'INTERSECTION' if planned_operation.accounts else tgt_filter_type), \
+            'create_stack_instances'
+
+    def submit_stack_set_update_flow(self, cft_url, cft_parameters):
+        """
+        This method is the flow submitting the update of the existing
+        stack set and returns the operation id.
+        """
+        try:
+            LOGGER.info(f"Updating existing stack set {self.stack_set_name}")
+            return (yield from self.submit_operation_flow('update_stack_set',
+                                                          self.get_stack_set_request(cft_url, cft_parameters, True),
+                                                          'update_stack_set'))
+        except Exception as excep:
+            error_msg = f"Error while updating stack set {self.stack_set_name}: {str(excep)}"
+            raise Exception(error_msg)
+
+    def deploy_stack_set_flow(self, is_exists, cft_url, cft_parameters):
+        """
+        This method is the flow depoying the stack set; evaluates the supplied
+        parameters and calls right API to create/update stack set.
         """
         try:
-            auto_deployment = {
-                                "Enabled": True if self.deployment_configs['auto_deployement'].lower() == "true" else False,
-                                "RetainStacksOnAccountRemoval": True if self.deployment_configs['retain_stacks_on_account_removal'].lower() == "true" else False
-                              }
             wait_message = ""
             completed_message = ""
             operation_id = None
 
             if is_exists:
                 # update stack set
-                LOGGER.info(f"Updating existing stack set {self.stack_set_name}")
-                operational_prefs = {
-                        "RegionConcurrencyType": self.deployment_configs['region_deployment_concurrency'],
-                        "MaxConcurrentPercentage":self.deployment_configs['max_concurrent_percentage'],
-                        "FailureTolerancePercentage":self.deployment_configs['failure_tolerance_percentage'] # ideally should be set as MaxConcurrentPercentage-1
-                    }
-                stack_set = self.cf_client.update_stack_set(StackSetName=self.stack_set_name,
-                                                            Description=self.deployment_configs['stack_set_desciption'],
-                                                            TemplateURL=cft_url,
-                                                            Parameters=cft_parameters,
-                                                            Capabilities=self.deployment_configs['cft_capabilities'],
-                                                            Tags=self.get_tags(),
-                                                            PermissionModel='SERVICE_MANAGED',
-                                                            AutoDeployment=auto_deployment,
-                                                            OperationPreferences=operational_prefs,
-                                                            CallAs='DELEGATED_ADMIN'
-                                                            )
-                
                 wait_message = "Waiting for stack set be updated.."
                 completed_message = f"Stack set {self.stack_set_name} updated sucessfully"
 
-                operation_id = stack_set['OperationId']                                                            
-
-                operation_status = self.check_stack_instances_opeartion_status(operation_id, self.stack_set_name)
-
-                if operation_status in ['FAILED', 'STOPPED']:
-                    error_message = f"{self.stack_set_name} Stack Set Operation {operation_id} is {operation_status}"
-                    raise Exception(error_message)
+                operation_id = yield from self.submit_stack_set_update_flow(cft_url, cft_parameters)
+                yield from self.wait_for_operations_flow([(operation_id, 'update_stack_set')])
             else:
                 # create stack set
                 LOGGER.info(f"Creating new stack set {self.stack_set_name}")
-                new_stack_set = self.cf_client.create_stack_set(StackSetName=self.stack_set_name,
-                                                                Description=self.deployment_configs['stack_set_desciption'],
-                                                                TemplateURL=cft_url,
-                                                                Parameters=cft_parameters,
-                                                                Capabilities=self.deployment_configs['cft_capabilities'],
-                                                                Tags=self.get_tags(),
-                                                                PermissionModel='SERVICE_MANAGED',
-                                                                AutoDeployment=auto_deployment,
-                                                                CallAs='DELEGATED_ADMIN',
-                                                                ClientRequestToken=self.stack_set_name
-                                                                )
+                with self.metrics.phase('submit_create_stack_set', self.stack_set_name):
+                    new_stack_set = yield ApiCall('create_stack_set', **self.get_stack_set_request(cft_url, cft_parameters, False))
+                self.inventory.invalidate(self.stack_set_name)
 
                 wait_message = "Waiting for stack set be created.."
                 completed_message = f"New stack set {self.stack_set_name} created, Stack Set ID: {new_stack_set['StackSetId']}"
 
-            while not self.check_stackset_exists(self.stack_set_name):
-                LOGGER.info(wait_message)
-                sleep(30)    
+            def check_stack_set():
+                # a newly created stack set is looked up directly, not from the cache
+                is_created = yield from self.check_stackset_exists_flow(self.stack_set_name, refresh=not is_exists)
+                if not is_created:
+                    LOGGER.info(wait_message)
+                return is_created, is_created
+
+            yield Wait(self.waiter, 'stack_set_exists', check_stack_set)
             
             LOGGER.info(completed_message)
             
@@ -255,110 +584,166 @@ class Deployer:
             error_msg = f"Error while deploying stack set {self.stack_set_name}: {str(excep)}"
             raise Exception(error_msg)
 
-    def deploy_stack_instances(self, operation, target_ou_ids, target_regions, filter_accounts, filter_type):
+    def deploy_stack_instances_flow(self, target_ou_ids, target_regions, filter_accounts, filter_type):
         """
-        This method create/updates the stack instances into supplied
-        target organization unit and regions.
+        This method is the flow creating the stack instances of the new stack
+        set into supplied target organization unit and regions.
         """
         try:
-            deployment_targets = {
-                                    "OrganizationalUnitIds": target_ou_ids
-                                 }
-
-            if filter_accounts and filter_type:
-                deployment_targets["Accounts"] = filter_accounts
-                deployment_targets["AccountFilterType"] = filter_type                                       
-           
-            operational_prefs = {
-                                    "RegionConcurrencyType": self.deployment_configs['region_deployment_concurrency'],
-                                    "MaxConcurrentPercentage":self.deployment_configs['max_concurrent_percentage'],
-                                    "FailureTolerancePercentage":self.deployment_configs['failure_tolerance_percentage'] # ideally should be set as MaxConcurrentPercentage-1
-                                }
-            operation_id = None
-
-            if operation.lower() == 'create':
-                # create stack instance
-                LOGGER.info(f"Creating new stack instances for the stack set {self.stack_set_name}")
-                new_stack_instances = self.cf_client.create_stack_instances(StackSetName=self.stack_set_name,
-                                                                            DeploymentTargets=deployment_targets,
-                                                                            Regions=target_regions,
-                                                                            OperationPreferences=operational_prefs,
-                                                                            CallAs='DELEGATED_ADMIN')
-                operation_id = new_stack_instances['OperationId']
-            elif operation.lower() == 'update':
-                LOGGER.info(f"Updating stack instances for the stack set {self.stack_set_name}")
-                new_stack_instances = self.cf_client.create_stack_instances(StackSetName=self.stack_set_name,
-                                                                            DeploymentTargets=deployment_targets,
-                                                                            Regions=target_regions,
-                                                                            OperationPreferences=operational_prefs,
-                                                                            CallAs='DELEGATED_ADMIN')
-                operation_id = new_stack_instances['OperationId']
-            else:
-                error_message = f"Invalid operation {operation} request"
-                raise Exception(error_message)
-
-            self.check_stack_instances_progress(self.stack_set_name)
-            operation_status = self.check_stack_instances_opeartion_status(operation_id, self.stack_set_name)
-            if operation_status in ['FAILED', 'STOPPED']:
-                error_message = f"{self.stack_set_name} Stack Set Operation {operation_id} is {operation_status}"
-                raise Exception(error_message)
+            LOGGER.info(f"Creating new stack instances for the stack set {self.stack_set_name}")
+            stack_instances_request = self.get_stack_instances_request(target_ou_ids, target_regions, filter_accounts, filter_type)
+            operation_id = yield from self.submit_operation_flow('create_stack_instances', stack_instances_request, 'create_stack_instances')
+            yield from self.wait_for_operations_flow([(operation_id, 'create_stack_instances')])
 
             LOGGER.info(f"New stack instances for the stack set {self.stack_set_name} created")
                 
         except Exception as excep:
             error_msg = f"Error while deploying stack instance for the stack set {self.stack_set_name}: {str(excep)}"
             raise Exception(error_msg)        
+    def get_teardown_operation_preferences(self):
+        """
+        This method returns the operation preferences of the stack instance
+        deletes of a stackset_teardown.py teardown, all the regions of an operation
+        run in parallel and the concurrency within a region is not capped by the
+        failure tolerance
+        """
+        return {
+                    "RegionConcurrencyType": "PARALLEL",
+                    "MaxConcurrentPercentage": self.deployment_configs.get_value('teardown_max_concurrent_percentage', DEFAULT_TEARDOWN_MAX_CONCURRENT_PERCENTAGE),
+                    "FailureTolerancePercentage": self.deployment_configs.get_value('teardown_failure_tolerance_percentage', DEFAULT_TEARDOWN_FAILURE_TOLERANCE_PERCENTAGE),
+                    "ConcurrencyMode": "SOFT_FAILURE_TOLERANCE"
+               }
 
-    def remove_stack_set(self):
+    def plan_teardown_operations(self, stack_instances, is_sharded):
         """
-        This method deletes the stack set supplied
+        This method groups the supplied (Org Unit, Region) of the stack instances
+        into (Org Units, Regions) delete operations, one per region when sharded
+        as managed execution runs the operations of different regions concurrently,
+        otherwise a single operation as the operations of the stack set run one at a time
         """
-        try:
-            _ = self.cf_client.delete_stack_set(StackSetName=self.stack_set_name,
-                                                CallAs='DELEGATED_ADMIN'
-                                               )
-            LOGGER.info(f"Stack Set {self.stack_set_name} has been deleted successfully!")
-        
-        except Exception as excep:
-            error_msg = f"Error while deleting the stack set {self.stack_set_name}: {str(excep)}"
-            raise Exception(error_msg)  
+        region_ous = {}
+        for ou_id, region in stack_instances:
+            region_ous.setdefault(region, set()).add(ou_id)
+        if not region_ous:
+            return []
+        if is_sharded:
+            return [(sorted(ou_ids), [region]) for region, ou_ids in sorted(region_ous.items())]
+        return [(sorted(set().union(*region_ous.values())), sorted(region_ous))]
 
-    def remove_stack_instances(self, target_ou_ids, target_regions):
+    def get_teardown_request(self, target_ou_ids, target_regions, operation_preferences):
         """
-        This method delets the stack instances of the supplied stack set from
-        supplied Org Unit and Region.
+        This method returns the delete_stack_instances API parameters
+        of a teardown operation of the supplied Org Units and regions
         """
-        try:
-            deployment_targets = {
-                                    "OrganizationalUnitIds": target_ou_ids
-                                 }
-            operational_prefs = {
-                                    "RegionConcurrencyType": self.deployment_configs['region_deployment_concurrency'],
-                                    "MaxConcurrentPercentage":self.deployment_configs['max_concurrent_percentage'],
-                                    "FailureTolerancePercentage":self.deployment_configs['failure_tolerance_percentage'] # ideally should be set as MaxConcurrentPercentage-1
-                                }
-            operation_id = None        
-            
-            remove_instances_response = self.cf_client.delete_stack_instances(StackSetName=self.stack_set_name,
-                                                                              DeploymentTargets=deployment_targets,
-                                                                              Regions=target_regions,
-                                                                              OperationPreferences=operational_prefs,
-                                                                              RetainStacks=False,
-                                                                              CallAs='DELEGATED_ADMIN'
-                                                                             )
-            operation_id = remove_instances_response['OperationId']                                                            
+        teardown_request = {
+                                "StackSetName": self.stack_set_name,
+                                "DeploymentTargets": {"OrganizationalUnitIds": target_ou_ids},
+                                "Regions": target_regions,
+                                "OperationPreferences": operation_preferences,
+                                "RetainStacks": False,
+                                "CallAs": 'DELEGATED_ADMIN'
+                           }
+        return self.add_operation_token(teardown_request, "OperationId", f"teardown_stack_instances:{','.join(target_regions)}")
+
+    def get_operation_statuses_flow(self, operation_ids):
+        """
+        This method is the flow returning the status of the supplied operations of
+        the stack set, listed newest first with list_stack_set_operations, so the
+        operations of all the regions of a teardown are checked with a single call
+        """
+        operation_statuses = {}
 
-            operation_status = self.check_stack_instances_opeartion_status(operation_id, self.stack_set_name)
+        def consume_page(operations_page):
+            for operation in operations_page['Summaries']:
+                if operation['OperationId'] in operation_ids:
+                    operation_statuses[operation['OperationId']] = operation['Status']
+            return len(operation_statuses) == len(operation_ids)
 
+        operations_request = {"StackSetName": self.stack_set_name, "CallAs": 'DELEGATED_ADMIN'}
+        yield from self.paginate_flow('list_stack_set_operations', operations_request, consume_page)
+        return operation_statuses
+
+    def check_teardown_flow(self, pending_operations, failed_operations):
+        """
+        This method is the flow checking the pending teardown operations once and
+        deleting the stack set as soon as none is pending, returns True once the
+        stack set is deleted or an operation failed
+        """
+        operation_statuses = (yield from self.get_operation_statuses_flow(pending_operations)) if pending_operations else {}
+        for operation_id in list(pending_operations):
+            # an operation not listed yet is still queued
+            operation_status = operation_statuses.get(operation_id, 'QUEUED')
+            if operation_status in ['QUEUED', 'RUNNING', 'STOPPING']:
+                continue
+            pending_operations.remove(operation_id)
+            yield from self.record_completed_flow(operation_id, operation_status)
             if operation_status in ['FAILED', 'STOPPED']:
-                error_message = f"{self.stack_set_name} Stack Set Operation {operation_id} is {operation_status}"
-                raise Exception(error_message)
+                failed_operations.append(f"delete_stack_instances {operation_id} is {operation_status}")
+        if failed_operations:
+            return True
+        if pending_operations:
+            LOGGER.info(f"Waiting for {len(pending_operations)} delete operation(s) of the stack set {self.stack_set_name}")
+            return False
+        try:
+            # the deletion is retried by the teardown wait, not by the client
+            yield ApiCall('delete_stack_set', retry_in_progress=False, StackSetName=self.stack_set_name, CallAs='DELEGATED_ADMIN')
+            return True
+        except get_client_error() as excep:
+            if excep.response['Error']['Code'] in STACK_SET_NOT_EMPTY_ERROR_CODES:
+                LOGGER.info(f"Stack set {self.stack_set_name} is not empty yet, retrying the deletion")
+                return False
+            raise
 
-            LOGGER.info(f"Stack instances of the stack set {self.stack_set_name} are deleted")
+    def teardown_stack_set_flow(self, is_fast=False):
+        """
+        This method is the flow deleting the stack instances of the stack set with
+        a single delete operation using the operation preferences of the environment,
+        and deleting the stack set as soon as the last stack instance is gone.
+        The fast teardown of stackset_teardown.py deletes them with one delete
+        operation per region, submitted back to back when managed execution is
+        active, using the teardown operation preferences instead.
+        """
+        try:
+            stack_instances = set()
+            yield from self.for_each_stack_instance_flow(self.stack_set_name, ('DeployedOUId', 'DeployedRegion'), stack_instances.add)
+            if is_fast:
+                operation_preferences = self.get_teardown_operation_preferences()
+                is_sharded = yield from self.is_managed_execution_active_flow(self.stack_set_name)
+            else:
+                operation_preferences = self.get_operation_preferences()
+                is_sharded = False
+            shards = self.plan_teardown_operations(stack_instances, is_sharded)
+            LOGGER.info(f"Deleting {len(stack_instances)} Org Unit and region target(s) of the stack set {self.stack_set_name} "
+                        f"with {len(shards)} delete operation(s)")
+            pending_operations = []
+            for ou_ids, regions in shards:
+                operation_id = yield from self.submit_operation_flow('delete_stack_instances',
+                                                                     self.get_teardown_request(ou_ids, regions, operation_preferences),
+                                                                     'delete_stack_instances')
+                if operation_id is not None:
+                    pending_operations.append(operation_id)
+            failed_operations = []
 
+            def check_teardown():
+                return (yield from self.check_teardown_flow(pending_operations, failed_operations)), None
+
+            with self.metrics.phase('wait_teardown', self.stack_set_name):
+                yield Wait(self.waiter, 'teardown', check_teardown)
+            if failed_operations:
+                error_message = f"{self.stack_set_name} Stack Set Operation(s) {', '.join(failed_operations)}"
+                raise Exception(error_message)
+            self.inventory.invalidate(self.stack_set_name)
+            LOGGER.info(f"Stack Set {self.stack_set_name} has been deleted successfully!")
         except Exception as excep:
-            error_msg = f"Error while deleting stack instances for the stack set {self.stack_set_name}: {str(excep)}"
-            raise Exception(error_msg)      
+            error_msg = f"Error while tearing down the stack set {self.stack_set_name}: {str(excep)}"
+            raise Exception(error_msg)
+
+    def teardown_stack_set(self):
+        """
+        This method deletes the stack instances and then the stack set
+        on the calling thread with the fast teardown, see teardown_stack_set_flow
+        """
+        self.run_flow(self.teardown_stack_set_flow(is_fast=True))
 
     def get_cf_paramaters(self, input_file):
         """
@@ -380,156 +765,165 @@ class Deployer:
             error_msg = f"Error while parsing the cloudformation parameter file {input_file}: {str(excep)}"
             raise Exception(error_msg) 
 
-    def get_deployment_configs(self, input_file):
+    def get_deployment_configs(self, deployment_config):
         """
-        This method reads the deployment config file and returns the values
-        as python dict.
+        This method returns the validated deployment config, the supplied
+        DeploymentConfig shared by the deployers of a run as is, or
+        read from the supplied deployment config file.
         """
-        try: 
-            deployment_config = {}
-            with open(input_file) as file:
-                deployment_config = json.load(file)
+        if isinstance(deployment_config, DeploymentConfig):
             return deployment_config
-        except Exception as excep:
-            error_msg = f"Error while parsing the deployment config file {input_file}: {str(excep)}"
-            raise Exception(error_msg) 
+        return load_deployment_config(deployment_config).validate_stack_set()
+
+    def get_environment_config(self):
+        """
+        This method returns the compiled deployment targets and
+        operation preferences of the deployment environment
+        """
+        return self.deployment_configs.get_environment(self.environment)
 
     def get_deployment_targets(self):
         """
         This method returns the deployment target details
         from deployment config based on the deployment environment.
         """
-        env_key = None
-        if self.environment.lower() in ['dev', 'development']:
-            env_key = 'dev'
-        elif self.environment.lower() in ['qa', 'test']:
-            env_key = 'test'
-        elif self.environment.lower() in ['prod', 'production']:
-            env_key = 'prod'
-        else:
-            error_msg = f"Invalid value for env arguement, valid values are dev, development, qa, test, prod or production" 
-            raise Exception(error_msg)
-
-        deployment_targets = self.deployment_configs["deployment_targets"][env_key]
-        tgt_deployment_ou_ids = deployment_targets.get('org_units', [])
-        tgt_deployment_regions = deployment_targets.get('regions', [])
-        tgt_filter_accounts = deployment_targets.get('filter_accounts', [])
-        tgt_account_filter_type = deployment_targets.get('filter_type', "")
+        environment_config = self.get_environment_config()
+        return environment_config.org_units, environment_config.regions, environment_config.filter_accounts, environment_config.filter_type
 
-        if not (tgt_deployment_ou_ids):
-            error_msg = "Organization Units is mandatory parameter supplied for deployment targets, please check deployment configuration file."
-            raise Exception(error_msg) 
-
-        return tgt_deployment_ou_ids, tgt_deployment_regions, tgt_filter_accounts, tgt_account_filter_type       
-
-    def evaluate_deployment_targets(self, tgt_deployment_ou_ids, tgt_deployment_regions, current_ou_ids, current_regions):
+    def get_org_resolver(self):
         """
-        This method evaluates the deployment targets for create/update/delete operations
+        This method returns the resolver of the accounts of Org Units,
+        the Organizations client is created on first use
         """
-        try: 
+        if self.org_resolver is None:
+            import boto3
+            self.org_resolver = target_diff.OrganizationResolver(boto3.client('organizations', self.aws_region))
+        return self.org_resolver
 
-            new_tgt_deployment_ou_ids = set(tgt_deployment_ou_ids).difference(current_ou_ids)
-            new_tgt_deployment_regions = set(tgt_deployment_regions).difference(current_regions)
+    def plan_deployment_operations_flow(self, tgt_deployment_ou_ids, tgt_deployment_regions, tgt_filter_accounts, tgt_account_filter_type):
+        """
+        This method is the flow planning the stack instance operations of the existing
+        stack set. With account_level_diff enabled the current and target stack instances
+        are compared per (Org Unit, Account, Region), otherwise per Org Unit and Region.
+        The Org Unit level diff is used as fallback when the accounts of the
+        target Org Units cannot be resolved.
+        """
+        if self.deployment_configs.is_enabled('account_level_diff'):
+            try:
+                current_index = target_diff.InstanceIndex()
+                yield from self.for_each_stack_instance_flow(self.stack_set_name,
+                                                             ('DeployedOUId', 'DeployedAccount', 'DeployedRegion'),
+                                                             current_index.add)
+                target_index = yield Call(target_diff.get_target_index,
+                                          self.get_org_resolver(),
+                                          tgt_deployment_ou_ids,
+                                          tgt_deployment_regions,
+                                          tgt_filter_accounts,
+                                          tgt_account_filter_type)
+                return target_diff.plan_account_operations(current_index, target_index)
+            except Exception as excep:
+                LOGGER.warning(f"Account level diff is not available for the stack set {self.stack_set_name}, using Org Unit level diff: {str(excep)}")
 
-            undeploy_ou_ids = set(current_ou_ids).difference(tgt_deployment_ou_ids)
-            undeploy_regions = set(current_regions).difference(tgt_deployment_regions)
+        current_ous, current_regions = yield from self.get_stack_instance_columns_flow(self.stack_set_name,
+                                                                                      ('DeployedOUId', 'DeployedRegion'))
+        return operation_planner.plan_operations(tgt_deployment_ou_ids,
+                                                 tgt_deployment_regions,
+                                                 current_ous,
+                                                 current_regions)
 
-            return list(new_tgt_deployment_ou_ids), \
-                list(new_tgt_deployment_regions), \
-                list(undeploy_ou_ids), \
-                list(undeploy_regions)
-        except Exception as excep:
-            error_msg = f"Error while evaluating the deployment target configurations: {str(excep)}"
-            raise Exception(error_msg) 
+    def plan_deployment_operations(self, tgt_deployment_ou_ids, tgt_deployment_regions, tgt_filter_accounts, tgt_account_filter_type):
+        """
+        This method plans the stack instance operations of the existing stack
+        set on the calling thread, see plan_deployment_operations_flow
+        """
+        return self.run_flow(self.plan_deployment_operations_flow(tgt_deployment_ou_ids,
+                                                                  tgt_deployment_regions,
+                                                                  tgt_filter_accounts,
+                                                                  tgt_account_filter_type))
 
-    def deploy(self, cft_file, cft_parameters_file):
+    def deploy_flow(self, cft_file, cft_parameters_file, content_hash=None):
         """
-        This method performs the stack set deployment
+        This method is the flow performing the stack set deployment, an existing
+        stack set last deployed with the same content hash is left unchanged.
         """
         try:
             LOGGER.info(f"Stack Set Deployment Process Initiated")
             cft_parameters = self.get_cf_paramaters(cft_parameters_file)
-            is_stackset_exists = self.check_stackset_exists(self.stack_set_name)
+            is_stackset_exists = yield from self.check_stackset_exists_flow(self.stack_set_name)
 
+            if is_stackset_exists and self.deployment_manifest and self.deployment_manifest.is_unchanged(self.stack_set_name, content_hash):
+                LOGGER.info(f"Template, parameters and deployment targets of the stack set {self.stack_set_name} are unchanged, skipping the deployment")
+                return
+
+            self.content_hash = content_hash
+            yield from self.resume_operations_flow()
             tgt_deployment_ou_ids, tgt_deployment_regions, tgt_filter_accounts, tgt_account_filter_type = self.get_deployment_targets()
             if is_stackset_exists:
                 # updates existing stack instances and stack set
                 LOGGER.info(f"Stack Set {self.stack_set_name} exists, checking for deployment target changes to apply.")
-                stack_instances = self.get_stack_instances(self.stack_set_name)
-                current_ous = self.get_stack_instances_current_ous(stack_instances)
-                current_regions = self.get_stack_instances_current_regions(stack_instances)
-
-                new_ous, new_regions, remove_ous, remove_regions = self.evaluate_deployment_targets(tgt_deployment_ou_ids, 
-                                                                                                    tgt_deployment_regions, 
-                                                                                                    current_ous, 
-                                                                                                    current_regions)
-                
-                if (new_ous or new_regions or remove_ous or remove_regions):
-                    LOGGER.info(f"Stack instances will be created/updated for Org Units, {tgt_deployment_ou_ids} and Regions, {tgt_deployment_regions}")
-
-                    if (new_ous or new_regions):
-                        LOGGER.info(f"New OUs/Regions added in deployment config.")
-                        LOGGER.info(f"Stack instances will be created in Org Units, {new_ous} and Regions, {new_regions}")
-                        self.deploy_stack_instances('create', 
-                                                    tgt_deployment_ou_ids,
-                                                    tgt_deployment_regions,
-                                                    tgt_filter_accounts,
-                                                    tgt_account_filter_type)
-                        
-                    if (remove_ous or remove_regions): 
-                        LOGGER.info(f"OUs/Regions are removed in deployment config.")
-                        LOGGER.info(f"Stack instances will be deleted for Org Units, {remove_ous} and regions {remove_regions}")
-                        delete_orgs = []
-                        delete_regions = []
-                        if remove_ous:
-                            delete_orgs = remove_ous
-                            # delete from the requested OU from all regions
-                            delete_regions = tgt_deployment_regions + remove_regions
-                            LOGGER.info(f"Deleting Stack Instance for the OUs {remove_ous} and regions {delete_regions}")
-                            self.remove_stack_instances(delete_orgs, delete_regions)
-
-                        if remove_regions:
-                            # delete from the requested regions from all org units
-                            delete_orgs = tgt_deployment_ou_ids + delete_orgs
-                            delete_regions = remove_regions
-                            LOGGER.info(f"Deleting Stack Instance for the regions {remove_regions} of OUs {delete_orgs}")
-                            self.remove_stack_instances(delete_orgs, delete_regions)
+                with self.metrics.phase('diff', self.stack_set_name):
+                    planned_operations = yield from self.plan_deployment_operations_flow(tgt_deployment_ou_ids,
+                                                                                         tgt_deployment_regions,
+                                                                                         tgt_filter_accounts,
+                                                                                         tgt_account_filter_type)
+                # with managed execution CloudFormation runs or queues the operations,
+                # so they are all submitted before waiting for any of them
+                is_pipelined = yield from self.is_managed_execution_active_flow(self.stack_set_name)
+                if is_pipelined:
+                    LOGGER.info(f"Managed execution is active for the stack set {self.stack_set_name}, operations will be submitted back to back")
+
+                submitted_operations = []
+                for planned_operation in planned_operations:
+                    api_method, api_request, operation_type = self.get_planned_operation_request(planned_operation,
+                                                                                                  tgt_filter_accounts,
+                                                                                                  tgt_account_filter_type)
+                    operation = ((yield from self.submit_operation_flow(api_method, api_request, operation_type)), operation_type)
+                    if is_pipelined:
+                        submitted_operations.append(operation)
+                    else:
+                        yield from self.wait_for_operations_flow([operation])
 
                 LOGGER.info("Updating the stack set to deploy the CFT Changes")
-                self.deploy_stack_set(is_stackset_exists, cft_file, cft_parameters)
+                if is_pipelined:
+                    submitted_operations.append(((yield from self.submit_stack_set_update_flow(cft_file, cft_parameters)), 'update_stack_set'))
+                    yield from self.wait_for_operations_flow(submitted_operations)
+                else:
+                    yield from self.deploy_stack_set_flow(is_stackset_exists, cft_file, cft_parameters)
 
             else:
                 # create stack set and stack instance
                 LOGGER.info(f"Stack set {self.stack_set_name} doesn't exists")
-                self.deploy_stack_set(is_stackset_exists, cft_file, cft_parameters)
-                self.deploy_stack_instances('create', 
-                                            tgt_deployment_ou_ids,
-                                            tgt_deployment_regions,
-                                            tgt_filter_accounts,
-                                            tgt_account_filter_type)
+                yield from self.deploy_stack_set_flow(is_stackset_exists, cft_file, cft_parameters)
+                yield from self.deploy_stack_instances_flow(tgt_deployment_ou_ids,
+                                                            tgt_deployment_regions,
+                                                            tgt_filter_accounts,
+                                                            tgt_account_filter_type)
+
+            if self.operation_journal:
+                yield Call(self.operation_journal.complete, self.stack_set_name)
+            if self.deployment_manifest:
+                self.deployment_manifest.record(self.stack_set_name, content_hash)
             LOGGER.info(f"Stack Set Deployment Process Completed!")
         except Exception as excep:
             error_msg = f"Error while deploying stack set {self.stack_set_name}: {str(excep)}"
             raise Exception(error_msg)        
 
-    def undeploy(self):
+    def undeploy_flow(self):
         """
-        This method deletes the existing stack set and instances
-        froma all Org units and Regions.
+        This method is the flow deleting the existing stack set
+        and instances froma all Org units and Regions.
         """
         try:
             LOGGER.info(f"Stack Set Deletion Process Initiated")
-            is_stackset_exists = self.check_stackset_exists(self.stack_set_name)
+            is_stackset_exists = yield from self.check_stackset_exists_flow(self.stack_set_name)
             if is_stackset_exists:
-                stack_instances = self.get_stack_instances(self.stack_set_name)
-                current_ous = self.get_stack_instances_current_ous(stack_instances)
-                current_regions = self.get_stack_instances_current_regions(stack_instances)
-                # delete stack instances
-                if current_ous and current_regions:
-                    self.remove_stack_instances(current_ous, current_regions)
-
-                # delete stack set
-                self.remove_stack_set()
+                yield from self.resume_operations_flow()
+                # delete stack instances and stack set
+                yield from self.teardown_stack_set_flow()
+                if self.operation_journal:
+                    yield Call(self.operation_journal.complete, self.stack_set_name)
+                if self.deployment_manifest:
+                    self.deployment_manifest.record(self.stack_set_name, None)
             else:
                 error_message = f"Stack Set {self.stack_set_name} does not exists!"
                 raise Exception(error_message)
@@ -538,28 +932,226 @@ class Deployer:
             error_msg = f"Error while deleting stack set {self.stack_set_name}: {str(excep)}"
             raise Exception(error_msg)  
 
-    def processor(self, cft_file, cft_parameters_file, deployment_config_file):
+    def get_planned_stack_set(self):
+        """
+        This method returns the summary of the stack set from the cached
+        stack set listing, or its description, None when it does not exist
+        """
+        if not self.check_stackset_exists(self.stack_set_name):
+            return None
+        return self.inventory.get_stack_set_summary(self.stack_set_name) or self.inventory.describe_stack_set(self.stack_set_name)
+
+    def get_plan_operation(self, operation_type, org_units, regions, region_counts, preferences, batch_seconds):
+        """
+        This method returns a planned operation with the number of its batches
+        and its estimated duration, the stack instance counts per region are
+        None when they are unknown
+        """
+        batches = deployment_plan.get_operation_batches(region_counts if region_counts is not None else {region: None for region in regions},
+                                                        preferences)
+        return {
+                    "type": operation_type,
+                    "org_units": sorted(org_units),
+                    "regions": sorted(regions),
+                    "instances": region_counts,
+                    "batches": batches,
+                    "estimated_seconds": batches * batch_seconds
+               }
+
+    def get_plan(self, action, operations, instances, is_pipelined):
+        """
+        This method returns the plan of the stack set
+        """
+        return {
+                    "stack_set": self.stack_set_name,
+                    "action": action,
+                    "is_pipelined": is_pipelined,
+                    "instances": dict({instance_action: {} for instance_action in deployment_plan.PLAN_INSTANCE_ACTIONS}, **instances),
+                    "operations": operations,
+                    "estimated_seconds": deployment_plan.estimate_stack_set_seconds(operations, is_pipelined)
+               }
+
+    def count_planned_instances(self, planned_operation, instance_keys):
+        """
+        This method returns the number of the supplied stack instance keys per
+        region targeted by the planned operation, None when the keys are unknown
+        """
+        if instance_keys is None:
+            return None
+        org_units = set(planned_operation.org_units)
+        regions = set(planned_operation.regions)
+        accounts = set(planned_operation.accounts) if planned_operation.accounts else None
+        return deployment_plan.count_instances_by_region(instance_key for instance_key in instance_keys
+                                                         if instance_key[0] in org_units and instance_key[2] in regions
+                                                         and (accounts is None or instance_key[1] in accounts))
+
+    def plan_teardown(self, stack_set, current_keys, batch_seconds):
+        """
+        This method returns the plan of the deletion of the stack set
+        """
+        if stack_set is None:
+            return self.get_plan('absent', [], {}, False)
+        # the deletions of the pipeline are planned, as undeploy_flow runs them
+        is_sharded = False
+        preferences = self.get_operation_preferences()
+        operations = []
+        for ou_ids, regions in self.plan_teardown_operations({(instance_key[0], instance_key[2]) for instance_key in current_keys}, is_sharded):
+            region_counts = deployment_plan.count_instances_by_region(instance_key for instance_key in current_keys if instance_key[2] in regions)
+            operations.append(self.get_plan_operation('delete_stack_instances', ou_ids, regions, region_counts, preferences, batch_seconds))
+        return self.get_plan('delete', operations, {"delete": deployment_plan.count_instances_by_region(current_keys)}, is_sharded)
+
+    def plan_deploy(self, stack_set, current_keys, batch_seconds):
+        """
+        This method returns the plan of the deployment of the stack set, the
+        operations are planned as the deployment plans them. The stack instances
+        to create are only counted with account_level_diff enabled, when the
+        accounts of the target Org Units resolve, otherwise the Org Unit level
+        diff is planned and the Organizations API is not called.
+        """
+        tgt_deployment_ou_ids, tgt_deployment_regions, tgt_filter_accounts, tgt_account_filter_type = self.get_deployment_targets()
+        preferences = self.get_operation_preferences()
+        current_index = target_diff.InstanceIndex(current_keys)
+        target_index = None
+        if self.deployment_configs.is_enabled('account_level_diff'):
+            try:
+                target_index = target_diff.get_target_index(self.get_org_resolver(),
+                                                            tgt_deployment_ou_ids,
+                                                            tgt_deployment_regions,
+                                                            tgt_filter_accounts,
+                                                            tgt_account_filter_type)
+                to_add, to_remove, unchanged = target_diff.diff_instances(current_index, target_index)
+            except Exception as excep:
+                LOGGER.warning(f"Accounts of the target Org Units of the stack set {self.stack_set_name} are not resolved, "
+                               f"stack instances to create are not counted: {str(excep)}")
+                target_index = None
+        if target_index is None:
+            to_add = None
+            to_remove = {instance_key for instance_key in current_keys
+                         if instance_key[0] not in tgt_deployment_ou_ids or instance_key[2] not in tgt_deployment_regions}
+            unchanged = set(current_keys) - to_remove
+
+        if stack_set is None:
+            planned_operations = [operation_planner.PlannedOperation('create', sorted(tgt_deployment_ou_ids), sorted(tgt_deployment_regions))]
+        elif target_index is not None:
+            planned_operations = target_diff.plan_account_operations(current_index, target_index)
+        else:
+            planned_operations = operation_planner.plan_operations(tgt_deployment_ou_ids,
+                                                                   tgt_deployment_regions,
+                                                                   {instance_key[0] for instance_key in current_keys},
+                                                                   {instance_key[2] for instance_key in current_keys})
+        operations = []
+        for planned_operation in planned_operations:
+            instance_keys = to_remove if planned_operation.action == 'delete' else to_add
+            operations.append(self.get_plan_operation(f"{planned_operation.action}_stack_instances",
+                                                      planned_operation.org_units,
+                                                      planned_operation.regions,
+                                                      self.count_planned_instances(planned_operation, instance_keys),
+                                                      preferences,
+                                                      batch_seconds))
+        if stack_set is None:
+            return self.get_plan('create', operations, {"create": deployment_plan.count_instances_by_region(to_add) if to_add is not None else None}, False)
+
+        # the stack set update runs on all the stack instances left by the other operations
+        update_keys = unchanged | to_add if to_add is not None else unchanged
+        operations.append(self.get_plan_operation('update_stack_set',
+                                                  {instance_key[0] for instance_key in update_keys},
+                                                  {instance_key[2] for instance_key in update_keys},
+                                                  deployment_plan.count_instances_by_region(update_keys),
+                                                  preferences,
+                                                  batch_seconds))
+        instances = {
+                        "create": deployment_plan.count_instances_by_region(to_add) if to_add is not None else None,
+                        "update": deployment_plan.count_instances_by_region(unchanged),
+                        "delete": deployment_plan.count_instances_by_region(to_remove)
+                    }
+        return self.get_plan('update', operations, instances, bool(stack_set.get('ManagedExecution', {}).get('Active')))
+
+    def plan(self, deployment_config, template_name=None, content_hash=None):
+        """
+        This method plans the deployment of the stack set without any change,
+        using only the read APIs, and returns the plan: the stack instances to
+        create, update and delete per region and the operations with their
+        estimated duration. The stack instances are listed once and the Org
+        Unit accounts and stack set listing are shared by the deployers.
+        """
+        try:
+            self.deployment_configs = self.get_deployment_configs(deployment_config)
+            if self.operation_history and self.deployment_configs.is_enabled('adaptive_operation_preferences'):
+                self.preferences_tuner = PreferencesTuner.from_config(self.operation_history, self.deployment_configs)
+            deployment_action = self.deployment_configs.deployment_action
+            self.stack_set_name = self.get_stack_set_name(template_name)
+            recorded_operations = self.operation_history.get_operations(self.stack_set_name) if self.operation_history else []
+            batch_seconds = deployment_plan.get_batch_seconds(recorded_operations,
+                                                              self.deployment_configs.get_value('plan_batch_seconds', deployment_plan.DEFAULT_PLAN_BATCH_SECONDS))
+            stack_set = self.get_planned_stack_set()
+            if deployment_action == 'deploy' and stack_set and self.deployment_manifest \
+                    and self.deployment_manifest.is_unchanged(self.stack_set_name, content_hash):
+                return self.get_plan('unchanged', [], {}, False)
+
+            current_keys = set(self.iter_stack_instances(self.stack_set_name, ('DeployedOUId', 'DeployedAccount', 'DeployedRegion'))) if stack_set else set()
+            if deployment_action == 'delete':
+                return self.plan_teardown(stack_set, current_keys, batch_seconds)
+            return self.plan_deploy(stack_set, current_keys, batch_seconds)
+        except Exception as excep:
+            error_msg = f"Error while planning the deployment of the stack set {self.stack_set_name}: {str(excep)}"
+            raise Exception(error_msg)
+
+    def get_stack_set_name(self, template_name=None):
+        """
+        This method returns the stack set name for the current environment,
+        the template name is included when supplied so that multiple templates
+        of an application are deployed as separate stack sets.
         """
-        This method processes the stack set deployment request
+        if template_name:
+            return f"{self.deployment_configs['stack_set_name']}-{template_name}-{self.environment}"
+        return f"{self.deployment_configs['stack_set_name']}-{self.environment}"
+
+    def run_deployment_action_flow(self, deployment_action, cft_file, cft_parameters_file, content_hash=None):
+        """
+        This method is the flow running the supplied deployment action on the stack set
+        """
+        if deployment_action == 'deploy':
+            yield from self.deploy_flow(cft_file, cft_parameters_file, content_hash)
+        else:
+            yield from self.undeploy_flow()
+
+    def processor_flow(self, cft_file, cft_parameters_file, deployment_config, template_name=None, content_hash=None):
+        """
+        This method is the flow processing the stack set deployment request
         based on the values provided in deployment config file
         """
         try:
             LOGGER.info("Initiating the deployment process..")
-            self.deployment_configs = self.get_deployment_configs(deployment_config_file)
-            deployment_action = self.deployment_configs['deployment_action'].lower()
-            self.stack_set_name = f"{self.deployment_configs['stack_set_name']}-{self.environment}"            
-            
-            if deployment_action == 'deploy':
-                self.deploy(cft_file, cft_parameters_file)
-            elif deployment_action == 'delete':
-                self.undeploy()
+            self.deployment_configs = self.get_deployment_configs(deployment_config)
+            self.waiter = OperationWaiter.from_config(self.deployment_configs)
+            if self.operation_history and self.deployment_configs.is_enabled('adaptive_operation_preferences'):
+                self.preferences_tuner = PreferencesTuner.from_config(self.operation_history, self.deployment_configs)
+            deployment_action = self.deployment_configs.deployment_action
+            self.stack_set_name = self.get_stack_set_name(template_name)
+
+            if self.stackset_queue:
+                # runs targeting the same stack set are serialized, queued runs coalesce to the newest
+                is_acquired = yield from self.stackset_queue.acquire_flow(self.stack_set_name)
+                if is_acquired:
+                    try:
+                        yield from self.run_deployment_action_flow(deployment_action, cft_file, cft_parameters_file, content_hash)
+                    finally:
+                        yield Call(self.stackset_queue.release, self.stack_set_name)
             else:
-                error_message = "Invalid deployment action provided in deployment config file. Valid options are 'deploy' and 'delete'."
-                raise Exception(error_message)
+                yield from self.run_deployment_action_flow(deployment_action, cft_file, cft_parameters_file, content_hash)
 
+            self.waiter.log_latency_stats()
+            self.metrics.record_waiter_stats(self.stack_set_name, self.waiter.get_latency_stats())
             LOGGER.info("Deployment Process Completed")
         except Exception as excep:
             error_msg = f"Error in processing {self.stack_set_name}: {str(excep)}"
             LOGGER.error(error_msg)
             raise Exception(error_msg)        
 
+    def processor(self, cft_file, cft_parameters_file, deployment_config, template_name=None, content_hash=None):
+        """
+        This method processes the stack set deployment request on the
+        calling thread, see processor_flow
+        """
+        self.run_flow(self.processor_flow(cft_file, cft_parameters_file, deployment_config, template_name, content_hash))
+
@@ -0,0 +1,382 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+stackset_health.py sweeps the health of a list of stack sets, or of all
+the stack sets whose name starts with a prefix, and writes a compact report.
+
+Drift detection is started on the stack sets concurrently, up to
+max_parallel_drift_detections of them, sharing one rate limited
+CloudFormation client, and each stack set is then listed once to index the
+drift and sync status of its stack instances by Org Unit, region and
+account. The report keeps the counters per stack set, Org Unit and region,
+the counters of the unhealthy accounts only and a capped list of the
+unhealthy stack instances.
+
+This python module takes below inputs
+
+1. Current AWS Region (region where the stack sets are administered)
+2. Stack Set names (comma separated) and/or a Stack Set name prefix
+3. Deployment Configuration file (drift detection, report and API settings)
+"""
+
+import os
+import sys
+import json
+import argparse
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import stackset_deployer
+import config_model
+import stackset_inventory
+import api_rate_limiter
+from stackset_waiter import OperationWaiter
+
+LOGGER = logging.getLogger()
+
+DEFAULT_MAX_PARALLEL_DRIFT_DETECTIONS = 20
+DEFAULT_DRIFT_MAX_CONCURRENT_PERCENTAGE = 100
+DEFAULT_DRIFT_FAILURE_TOLERANCE_PERCENTAGE = 100
+DEFAULT_HEALTH_REPORT_FILE = 'stackset_health.json'
+DEFAULT_HEALTH_REPORT_MAX_INSTANCES = 1000
+HEALTH_FIELDS = ('DeployedOUId', 'DeployedAccount', 'DeployedRegion', 'InstanceSyncStatus', 'StackInstanceStatus', 'DriftStatus')
+HEALTH_COUNTERS = ('instances', 'drifted', 'outdated', 'inoperable', 'failed', 'unchecked')
+UNHEALTHY_COUNTERS = ('drifted', 'outdated', 'inoperable', 'failed')
+FAILED_DETAILED_STATUSES = ['FAILED', 'FAILED_IMPORT', 'CANCELLED']
+UNCHECKED_DRIFT_STATUSES = ['UNKNOWN', 'NOT_CHECKED']
+PENDING_OPERATION_STATUSES = ['QUEUED', 'RUNNING', 'STOPPING']
+
+
+def get_health_counters(sync_status, detailed_status, drift_status):
+    """
+    This function returns the health counters
+    incremented by a stack instance of the supplied status
+    """
+    counters = ['instances']
+    if drift_status == 'DRIFTED':
+        counters.append('drifted')
+    elif drift_status in UNCHECKED_DRIFT_STATUSES:
+        counters.append('unchecked')
+    if sync_status == 'OUTDATED':
+        counters.append('outdated')
+    elif sync_status == 'INOPERABLE':
+        counters.append('inoperable')
+    if detailed_status in FAILED_DETAILED_STATUSES:
+        counters.append('failed')
+    return counters
+
+
+def add_counters(health_index, key, counters, increment=1):
+    """
+    This function adds the supplied counters to the entry of the key in the health index
+    """
+    entry = health_index.setdefault(key, dict.fromkeys(HEALTH_COUNTERS, 0))
+    for counter in counters:
+        entry[counter] += increment
+
+
+def is_unhealthy(counters):
+    """
+    This function checks whether the supplied counters
+    hold a drifted, outdated, inoperable or failed stack instance
+    """
+    return any(counters.get(counter) for counter in UNHEALTHY_COUNTERS)
+
+
+class HealthIndex:
+    def __init__(self, max_instances=DEFAULT_HEALTH_REPORT_MAX_INSTANCES):
+        self.max_instances = max_instances
+        # stack set name -> health counters and drift detection status
+        self.stack_sets = {}
+        # Org Unit / region / account -> health counters
+        self.org_units = {}
+        self.regions = {}
+        self.accounts = {}
+        # (stack set, OU, account, region, sync status, detailed status, drift status) of the unhealthy stack instances
+        self.unhealthy_instances = []
+        self.index_lock = threading.Lock()
+
+    def add_stack_set(self, stack_set_name, stack_instances, drift_detection=None):
+        """
+        This method indexes the supplied (OU, account, region, sync status,
+        detailed status, drift status) stack instances of a stack set.
+        The stack instances are counted locally and merged under the lock.
+        """
+        stack_set_counters = dict.fromkeys(HEALTH_COUNTERS, 0)
+        org_units, regions, accounts = {}, {}, {}
+        unhealthy_instances = []
+        for ou_id, account, region, sync_status, detailed_status, drift_status in stack_instances:
+            counters = get_health_counters(sync_status, detailed_status, drift_status)
+            for counter in counters:
+                stack_set_counters[counter] += 1
+            add_counters(org_units, ou_id, counters)
+            add_counters(regions, region, counters)
+            add_counters(accounts, account, counters)
+            if any(counter in UNHEALTHY_COUNTERS for counter in counters):
+                unhealthy_instances.append((stack_set_name, ou_id, account, region, sync_status, detailed_status, drift_status))
+
+        with self.index_lock:
+            self.stack_sets[stack_set_name] = dict(stack_set_counters,
+                                                   drift_status=self.get_drift_status(stack_set_counters),
+                                                   drift_detection=drift_detection)
+            for health_index, stack_set_index in [(self.org_units, org_units), (self.regions, regions), (self.accounts, accounts)]:
+                for key, counters in stack_set_index.items():
+                    for counter, count in counters.items():
+                        add_counters(health_index, key, [counter], count)
+            self.unhealthy_instances.extend(unhealthy_instances)
+
+    def add_error(self, stack_set_name, error):
+        """
+        This method records the error of a stack set whose sweep failed
+        """
+        with self.index_lock:
+            self.stack_sets[stack_set_name] = {"error": error}
+
+    def get_drift_status(self, counters):
+        """
+        This method returns the drift status of a stack set from the counters of its stack instances
+        """
+        if counters['drifted']:
+            return 'DRIFTED'
+        if counters['unchecked'] == counters['instances']:
+            return 'NOT_CHECKED'
+        return 'IN_SYNC'
+
+    def get_report(self):
+        """
+        This method returns the health report of the indexed stack sets,
+        the accounts are limited to the unhealthy ones and the unhealthy
+        stack instances to max_instances
+        """
+        with self.index_lock:
+            totals = dict.fromkeys(HEALTH_COUNTERS, 0)
+            for stack_set in self.stack_sets.values():
+                for counter in HEALTH_COUNTERS:
+                    totals[counter] += stack_set.get(counter, 0)
+            unhealthy_instances = sorted(self.unhealthy_instances)
+            return {
+                        "totals": dict(totals, stack_sets=len(self.stack_sets),
+                                       unhealthy_stack_sets=sum(1 for stack_set in self.stack_sets.values()
+                                                                if stack_set.get('error') or is_unhealthy(stack_set))),
+                        "stack_sets": dict(sorted(self.stack_sets.items())),
+                        "org_units": dict(sorted(self.org_units.items())),
+                        "regions": dict(sorted(self.regions.items())),
+                        "unhealthy_accounts": {account: counters for account, counters in sorted(self.accounts.items())
+                                               if is_unhealthy(counters)},
+                        "unhealthy_instance_fields": ['StackSetName'] + list(HEALTH_FIELDS),
+                        "unhealthy_instances": [list(stack_instance) for stack_instance in unhealthy_instances[:self.max_instances]],
+                        "unhealthy_instance_count": len(unhealthy_instances)
+                   }
+
+
+class StackSetHealthSweep:
+    def __init__(self, aws_region, deployment_configs, cf_client, inventory, waiter=None):
+        self.aws_region = aws_region
+        self.deployment_configs = deployment_configs
+        self.cf_client = cf_client
+        self.inventory = inventory
+        self.waiter = waiter if waiter else OperationWaiter.from_config(deployment_configs)
+
+    def get_max_parallel_drift_detections(self):
+        """
+        This method returns the maximum number of stack sets
+        swept in parallel, read from the deployment config.
+        """
+        try:
+            max_parallel_drift_detections = self.deployment_configs.get_value('max_parallel_drift_detections', DEFAULT_MAX_PARALLEL_DRIFT_DETECTIONS)
+            if max_parallel_drift_detections < 1:
+                raise Exception("max_parallel_drift_detections must be greater than zero")
+            return max_parallel_drift_detections
+        except Exception as excep:
+            error_msg = f"Error while reading max_parallel_drift_detections from deployment config: {str(excep)}"
+            raise Exception(error_msg)
+
+    def get_drift_operation_preferences(self):
+        """
+        This method returns the operation preferences of the drift detections,
+        every region in parallel as drift detection does not change the stack instances
+        """
+        return {
+                    "RegionConcurrencyType": "PARALLEL",
+                    "MaxConcurrentPercentage": self.deployment_configs.get_value('drift_max_concurrent_percentage', DEFAULT_DRIFT_MAX_CONCURRENT_PERCENTAGE),
+                    "FailureTolerancePercentage": self.deployment_configs.get_value('drift_failure_tolerance_percentage', DEFAULT_DRIFT_FAILURE_TOLERANCE_PERCENTAGE),
+                    "ConcurrencyMode": "SOFT_FAILURE_TOLERANCE"
+               }
+
+    def detect_drift(self, stack_set_name):
+        """
+        This method detects the drift of the supplied stack set and returns the
+        status of the drift detection operation. When another operation is in
+        progress on the stack set the last detected drift is reported instead.
+        """
+        try:
+            # a stack set with an operation in progress is skipped right away
+            response = self.cf_client.call('detect_stack_set_drift',
+                                           retry_in_progress=False,
+                                           StackSetName=stack_set_name,
+                                           OperationPreferences=self.get_drift_operation_preferences(),
+                                           CallAs='DELEGATED_ADMIN')
+        except api_rate_limiter.get_client_error() as excep:
+            if excep.response['Error']['Code'] == 'OperationInProgressException':
+                LOGGER.warning(f"An operation is in progress on the stack set {stack_set_name}, reporting its last detected drift")
+                return 'SKIPPED'
+            error_msg = f"Error while starting the drift detection of the stack set {stack_set_name}: {str(excep)}"
+            raise Exception(error_msg)
+        operation_id = response['OperationId']
+
+        def check_drift_detection():
+            operation = self.cf_client.describe_stack_set_operation(StackSetName=stack_set_name,
+                                                                    OperationId=operation_id,
+                                                                    CallAs='DELEGATED_ADMIN')['StackSetOperation']
+            return operation['Status'] not in PENDING_OPERATION_STATUSES, operation['Status']
+
+        status = self.waiter.wait('detect_stack_set_drift', check_drift_detection)
+        if status != 'SUCCEEDED':
+            LOGGER.warning(f"Drift detection of the stack set {stack_set_name} completed with status {status}")
+        return status
+
+    def get_deployer(self, stack_set_name):
+        """
+        This method returns the Deployer listing the stack instances of the supplied stack set
+        """
+        ss_deployer = stackset_deployer.Deployer(None, self.aws_region, self.inventory, cf_client=self.cf_client)
+        ss_deployer.deployment_configs = self.deployment_configs
+        ss_deployer.stack_set_name = stack_set_name
+        return ss_deployer
+
+    def sweep(self, stack_set_name, health_index, is_drift_detection=True):
+        """
+        This method detects the drift of the supplied stack set when enabled
+        and indexes the health of its stack instances
+        """
+        drift_detection = self.detect_drift(stack_set_name) if is_drift_detection else None
+        stack_instances = self.get_deployer(stack_set_name).iter_stack_instances(stack_set_name, HEALTH_FIELDS)
+        health_index.add_stack_set(stack_set_name, stack_instances, drift_detection)
+
+    def run(self, stack_set_names, is_drift_detection=True):
+        """
+        This method sweeps the supplied stack sets concurrently
+        and returns the health index of their stack instances.
+        """
+        max_parallel_drift_detections = self.get_max_parallel_drift_detections()
+        health_index = HealthIndex(self.deployment_configs.get_value('health_report_max_instances', DEFAULT_HEALTH_REPORT_MAX_INSTANCES))
+        LOGGER.info(f"Sweeping {len(stack_set_names)} stack set(s) with up to {max_parallel_drift_detections} parallel sweep(s)"
+                    f"{'' if is_drift_detection else ', drift detection skipped'}")
+        with ThreadPoolExecutor(max_workers=max_parallel_drift_detections) as executor:
+            futures = {executor.submit(self.sweep, stack_set_name, health_index, is_drift_detection): stack_set_name
+                       for stack_set_name in stack_set_names}
+            for future in as_completed(futures):
+                stack_set_name = futures[future]
+                try:
+                    future.result()
+                except Exception as excep:
+                    health_index.add_error(stack_set_name, str(excep))
+                    LOGGER.error(f"Health sweep of the stack set {stack_set_name} failed: {str(excep)}")
+        return health_index
+
+
+def log_health_report(report):
+    """
+    This function logs the summary of the health report
+    """
+    totals = report['totals']
+    LOGGER.info(f"{totals['instances']} stack instance(s) of {totals['stack_sets']} stack set(s): "
+                + ", ".join(f"{counter}={totals[counter]}" for counter in HEALTH_COUNTERS[1:]))
+    for stack_set_name, stack_set in report['stack_sets'].items():
+        if is_unhealthy(stack_set):
+            LOGGER.warning(f"Stack Set {stack_set_name} is {stack_set['drift_status']}: "
+                           + ", ".join(f"{counter}={stack_set[counter]}" for counter in UNHEALTHY_COUNTERS))
+    if report['unhealthy_instance_count'] > len(report['unhealthy_instances']):
+        LOGGER.info(f"{len(report['unhealthy_instances'])} of {report['unhealthy_instance_count']} unhealthy stack instance(s) reported")
+
+
+def sweep_stack_sets(region, deployment_config_file, stack_set_names=None, prefix=None, is_drift_detection=True,
+                     report_file=None, session=None):
+    """
+    This function sweeps the health of the supplied stack sets and the stack sets
+    matching the supplied prefix, writes the health report and returns it.
+    It raises an error listing the failed sweeps after the report is written.
+    """
+    deployment_configs = config_model.load_deployment_config(deployment_config_file)
+    if session is None:
+        import boto3
+        session = boto3
+    cf_client = api_rate_limiter.RateLimitedClient.from_config(session.client('cloudformation', region), deployment_configs)
+    inventory_ttl = deployment_configs.get_value('inventory_cache_ttl', stackset_inventory.DEFAULT_INVENTORY_CACHE_TTL)
+    inventory = stackset_inventory.StackSetInventory(cf_client, inventory_ttl)
+    health_sweep = StackSetHealthSweep(region, deployment_configs, cf_client, inventory)
+
+    stack_sets = inventory.resolve_stack_sets(stack_set_names, prefix)
+    if not stack_sets:
+        LOGGER.info("No stack set to sweep")
+        return None
+    report = health_sweep.run(stack_sets, is_drift_detection).get_report()
+    report_file = report_file if report_file else deployment_configs.get_value('health_report_file', DEFAULT_HEALTH_REPORT_FILE)
+    try:
+        with open(report_file, 'w') as file:
+            json.dump(report, file, indent=4)
+    except Exception as excep:
+        error_msg = f"Error while writing the health report to {report_file}: {str(excep)}"
+        raise Exception(error_msg)
+    LOGGER.info(f"Health report written to {report_file}")
+    log_health_report(report)
+    cf_client.log_stats()
+    health_sweep.waiter.log_latency_stats()
+
+    failed_stack_sets = {stack_set_name: stack_set['error'] for stack_set_name, stack_set in report['stack_sets'].items()
+                         if stack_set.get('error')}
+    if failed_stack_sets:
+        failures = "; ".join(f"{stack_set_name}: {error}" for stack_set_name, error in failed_stack_sets.items())
+        error_msg = f"{len(failed_stack_sets)} of {len(stack_sets)} stack set health sweep(s) failed - {failures}"
+        raise Exception(error_msg)
+    return report
+
+
+def main(args):
+    """
+    This is main function triggers the health sweep of the stack sets
+    """
+    stack_set_names = [name.strip() for name in args.stack_sets.split(',') if name.strip()] if args.stack_sets else []
+    sweep_stack_sets(args.region, args.deployment_config, stack_set_names, args.prefix,
+                     not args.skip_drift_detection, args.report_file)
+
+
+if __name__ == "__main__":
+    FORMAT = '%(asctime)s %(levelname)s %(message)s'
+    logging.basicConfig(format=FORMAT,
+                        datefmt="%Y-%m-%d %H:%M:%S",
+                        handlers=[logging.StreamHandler(sys.stdout)]
+                        )
+    LOGGER.setLevel(logging.INFO)
+
+    parser = argparse.ArgumentParser(prog='stackset_health.py',
+                                     usage='%(prog)s --region <aws region> [--stack_sets <name,name>] [--prefix <stack set name prefix>]',
+                                     description="Delegated Admin Service Managed Stack Set Drift and Health Sweep")
+    parser.add_argument('--region',
+                        action='store',
+                        type=str,
+                        required=True)
+    parser.add_argument('--stack_sets',
+                        action='store',
+                        type=str,
+                        required=False,
+                        help="comma separated names of the stack sets to sweep")
+    parser.add_argument('--prefix',
+                        action='store',
+                        type=str,
+                        required=False,
+                        help="sweep all the stack sets whose name starts with the prefix")
+    parser.add_argument('--deployment_config',
+                        action='store',
+                        type=str,
+                        default=f"{os.getcwd()}/deploy_configs/deployment_config.json")
+    parser.add_argument('--skip_drift_detection',
+                        action='store_true',
+                        help="report the last detected drift without starting a drift detection")
+    parser.add_argument('--report_file',
+                        action='store',
+                        type=str,
+                        required=False,
+                        help="health report file, health_report_file of the deployment config by default")
+    arguments = parser.parse_args()
+    main(arguments)
@@ -0,0 +1,153 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+stackset_inventory.py provides a cached inventory of the stack sets
+in the delegated admin account.
+
+Single stack set lookups are answered with describe_stack_set instead of
+listing every stack set, and both the lookups and the full listing are
+cached for a TTL. The deployer invalidates the cached entries of a stack
+set after creating or deleting it. One inventory can be shared by the
+deployers running in parallel.
+"""
+
+import logging
+import threading
+from time import monotonic
+from api_rate_limiter import get_client_error
+
+LOGGER = logging.getLogger()
+
+DEFAULT_INVENTORY_CACHE_TTL = 300
+
+
+class StackSetInventory:
+    def __init__(self, cf_client, ttl=DEFAULT_INVENTORY_CACHE_TTL):
+        self.cf_client = cf_client
+        self.ttl = ttl
+        # stack set name -> (is_exists, cached at)
+        self.stack_set_cache = {}
+        # stack set name -> stack set summary of the full listing
+        self.stack_sets = None
+        self.stack_sets_cached_at = None
+        self.cache_lock = threading.Lock()
+
+    def is_fresh(self, cached_at):
+        """
+        This method checks whether the cache entry is within the TTL
+        """
+        return cached_at is not None and monotonic() - cached_at < self.ttl
+
+    def iter_stack_set_summaries(self, status='ACTIVE'):
+        """
+        This method streams the summaries of the stack sets with the
+        supplied status page by page, bypassing the cache.
+        """
+        try:
+            paginator = self.cf_client.get_paginator('list_stack_sets')
+            for stackset_page in paginator.paginate(Status=status, CallAs='DELEGATED_ADMIN'):
+                yield from stackset_page['Summaries']
+        except Exception as excep:
+            error_msg = f"Error while listing the stack sets: {str(excep)}"
+            raise Exception(error_msg)
+
+    def iter_stack_sets(self, status='ACTIVE'):
+        """
+        This method streams the names of the stack sets with the
+        supplied status page by page, bypassing the cache.
+        """
+        for stackset in self.iter_stack_set_summaries(status):
+            yield stackset['StackSetName']
+
+    def list_stack_sets(self, refresh=False):
+        """
+        This method returns the names of the ACTIVE stack sets, listing
+        them only when the cached list is missing or expired.
+        """
+        with self.cache_lock:
+            if not refresh and self.is_fresh(self.stack_sets_cached_at):
+                return set(self.stack_sets)
+        stack_sets = {stackset['StackSetName']: stackset for stackset in self.iter_stack_set_summaries()}
+        with self.cache_lock:
+            self.stack_sets = stack_sets
+            self.stack_sets_cached_at = monotonic()
+        return set(stack_sets)
+
+    def resolve_stack_sets(self, stack_set_names=None, prefix=None):
+        """
+        This method returns the sorted names of the ACTIVE stack sets among
+        the supplied names and those starting with the supplied prefix,
+        listed afresh. Supplied names which do not exist are skipped with a warning.
+        """
+        if not stack_set_names and not prefix:
+            raise Exception("Stack set names or a stack set name prefix must be supplied")
+        active_stack_sets = self.list_stack_sets(refresh=True)
+        stack_sets = set()
+        for stack_set_name in stack_set_names or []:
+            if stack_set_name in active_stack_sets:
+                stack_sets.add(stack_set_name)
+            else:
+                LOGGER.warning(f"Stack Set {stack_set_name} does not exists, skipping it")
+        if prefix:
+            stack_sets.update(stack_set_name for stack_set_name in active_stack_sets if stack_set_name.startswith(prefix))
+        return sorted(stack_sets)
+
+    def get_stack_set_summary(self, stackset_name):
+        """
+        This method returns the summary of the supplied stack set from the
+        cached full listing, None when the stack set is not listed or the
+        listing is missing or expired.
+        """
+        with self.cache_lock:
+            if self.is_fresh(self.stack_sets_cached_at):
+                return self.stack_sets.get(stackset_name)
+        return None
+
+    def describe_stack_set(self, stackset_name):
+        """
+        This method returns the stack set description or None
+        when the stack set does not exist.
+        """
+        try:
+            return self.cf_client.describe_stack_set(StackSetName=stackset_name,
+                                                     CallAs='DELEGATED_ADMIN')['StackSet']
+        except get_client_error() as excep:
+            if excep.response['Error']['Code'] == 'StackSetNotFoundException':
+                return None
+            error_msg = f"Error while describing the stack set {stackset_name}: {str(excep)}"
+            raise Exception(error_msg)
+
+    def exists(self, stackset_name, refresh=False):
+        """
+        This method checks whether the supplied stack set exists and is ACTIVE,
+        using the cache unless refresh is requested.
+        """
+        with self.cache_lock:
+            if not refresh:
+                is_exists, cached_at = self.stack_set_cache.get(stackset_name, (None, None))
+                if self.is_fresh(cached_at):
+                    return is_exists
+                if self.is_fresh(self.stack_sets_cached_at):
+                    return stackset_name in self.stack_sets
+
+        stack_set = self.describe_stack_set(stackset_name)
+        is_exists = stack_set is not None and stack_set['Status'] == 'ACTIVE'
+        with self.cache_lock:
+            self.stack_set_cache[stackset_name] = (is_exists, monotonic())
+        return is_exists
+
+    def invalidate(self, stackset_name=None):
+        """
+        This method drops the cached entries of the supplied stack set,
+        or the whole cache when no stack set is supplied.
+        """
+        with self.cache_lock:
+            if stackset_name is None:
+                self.stack_set_cache.clear()
+                self.stack_sets = None
+                self.stack_sets_cached_at = None
+                return
+            self.stack_set_cache.pop(stackset_name, None)
+            # the full list no longer reflects this stack set, so
+            # it is listed again when next requested
+            self.stack_sets_cached_at = None
@@ -0,0 +1,434 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+stackset_lock.py serializes the deployments of a stack set across
+pipeline runs and processes.
+
+Every run joins the queue of the stack set with a ticket ordered by the
+commit time of the source revision it deploys, then by the time it was
+queued, and waits for the lock of the stack set. Queued runs coalesce: a run
+gives up as soon as a run of a newer revision is queued for the same stack
+set, so when several runs queue behind a running deployment only the newest
+revision is applied. The lock and the queue live in a local directory or in
+S3, where every change of the lock is a conditional write on the version
+(ETag) of the lock last read. The run holding the lock renews its lease
+every third of the lock TTL, so only the locks of crashed runs expire.
+"""
+
+import os
+import re
+import json
+import uuid
+import socket
+import logging
+import threading
+import subprocess
+from time import time, time_ns
+from contextlib import contextmanager
+from stackset_waiter import OperationWaiter
+from deployment_flow import Call, Wait, call_flow, run_flow
+from api_rate_limiter import get_client_error
+
+LOGGER = logging.getLogger()
+
+DEFAULT_STACKSET_LOCK_TTL = 900
+DEFAULT_STACKSET_LOCK_TIMEOUT = 3600
+LOCK_BACKENDS = ['none', 'file', 's3']
+CONDITION_FAILED_ERROR_CODES = ['PreconditionFailed', 'ConditionalRequestConflict', 'NoSuchKey', '412', '409', '404']
+
+
+def get_run_id():
+    """
+    This function returns the id of the current run, the CodeBuild
+    build id when running in CodeBuild
+    """
+    run_id = os.environ.get('CODEBUILD_BUILD_ID') or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    return re.sub(r'[^A-Za-z0-9_.-]', '-', run_id)
+
+
+def get_source_revision_time(app_path=None):
+    """
+    This function returns the commit time, in seconds, of the source revision
+    checked out in the application directory, 0 when it is not a git checkout
+    """
+    try:
+        return int(subprocess.run(['git', 'log', '-1', '--format=%ct', 'HEAD'], cwd=app_path or os.getcwd(),
+                                  capture_output=True, text=True, check=True, timeout=30).stdout.strip())
+    except Exception as excep:
+        LOGGER.info(f"Source revision time is not available, queued runs are ordered by queue time: {str(excep)}")
+        return 0
+
+
+class FileLockBackend:
+    def __init__(self, lock_dir):
+        self.lock_dir = lock_dir
+
+    def get_path(self, stackset_name, *parts):
+        """
+        This method returns the path of the lock directory entry of the stack set
+        """
+        return os.path.join(self.lock_dir, stackset_name, *parts)
+
+    def write_lock_file(self, stackset_name, lock):
+        """
+        This method writes the lock to a new temporary file of the stack set
+        and returns its path and the version of the lock
+        """
+        os.makedirs(self.get_path(stackset_name), exist_ok=True)
+        version = uuid.uuid4().hex
+        lock_path = self.get_path(stackset_name, f"lock.{version}.tmp")
+        with open(lock_path, 'w') as file:
+            json.dump(dict(lock, version=version), file)
+        return lock_path, version
+
+    @contextmanager
+    def guard(self, stackset_name):
+        """
+        This method serializes the conditional changes of the
+        lock file of the stack set across processes
+        """
+        # fcntl is only imported by the file backend, used for local runs
+        import fcntl
+        os.makedirs(self.get_path(stackset_name), exist_ok=True)
+        with open(self.get_path(stackset_name, 'lock.guard'), 'a') as guard_file:
+            fcntl.flock(guard_file, fcntl.LOCK_EX)
+            yield
+
+    def create_lock(self, stackset_name, lock):
+        """
+        This method creates the lock file of the stack set and returns the
+        version of the lock, None when the lock file already exists
+        """
+        lock_path, version = self.write_lock_file(stackset_name, lock)
+        try:
+            # the link is atomic and fails when the lock file exists
+            os.link(lock_path, self.get_path(stackset_name, 'lock.json'))
+            return version
+        except FileExistsError:
+            return None
+        finally:
+            os.remove(lock_path)
+
+    def read_lock(self, stackset_name):
+        """
+        This method returns the lock of the stack set and its version,
+        (None, None) when not locked
+        """
+        try:
+            with open(self.get_path(stackset_name, 'lock.json')) as file:
+                lock = json.load(file)
+            return lock, lock.get('version')
+        except FileNotFoundError:
+            return None, None
+
+    def replace_lock(self, stackset_name, lock, version):
+        """
+        This method replaces the lock of the stack set when it is still at the
+        supplied version and returns the new version, None otherwise
+        """
+        lock_path, new_version = self.write_lock_file(stackset_name, lock)
+        try:
+            with self.guard(stackset_name):
+                if self.read_lock(stackset_name)[1] != version:
+                    return None
+                os.replace(lock_path, self.get_path(stackset_name, 'lock.json'))
+                return new_version
+        finally:
+            if os.path.exists(lock_path):
+                os.remove(lock_path)
+
+    def delete_lock(self, stackset_name, version):
+        """
+        This method deletes the lock file of the stack set when it is still
+        at the supplied version, returns False otherwise
+        """
+        with self.guard(stackset_name):
+            if self.read_lock(stackset_name)[1] != version:
+                return False
+            os.remove(self.get_path(stackset_name, 'lock.json'))
+            return True
+
+    def enqueue(self, stackset_name, ticket):
+        """
+        This method adds the ticket to the queue of the stack set
+        """
+        os.makedirs(self.get_path(stackset_name, 'queue'), exist_ok=True)
+        open(self.get_path(stackset_name, 'queue', ticket), 'w').close()
+
+    def dequeue(self, stackset_name, ticket):
+        """
+        This method removes the ticket from the queue of the stack set
+        """
+        try:
+            os.remove(self.get_path(stackset_name, 'queue', ticket))
+        except FileNotFoundError:
+            pass
+
+    def list_queue(self, stackset_name):
+        """
+        This method returns the tickets queued for the stack set
+        """
+        try:
+            return os.listdir(self.get_path(stackset_name, 'queue'))
+        except FileNotFoundError:
+            return []
+
+
+class S3LockBackend:
+    def __init__(self, s3_client, bucket, prefix):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def get_key(self, stackset_name, *parts):
+        """
+        This method returns the S3 key of the lock object of the stack set
+        """
+        return '/'.join([self.prefix.rstrip('/'), stackset_name, *parts])
+
+    def put_lock(self, stackset_name, lock, **condition):
+        """
+        This method writes the lock object of the stack set with the supplied
+        write condition and returns its ETag, None when the condition failed
+        """
+        try:
+            return self.s3_client.put_object(Bucket=self.bucket,
+                                             Key=self.get_key(stackset_name, 'lock.json'),
+                                             Body=json.dumps(lock).encode(),
+                                             ContentType='application/json',
+                                             **condition)['ETag']
+        except get_client_error() as excep:
+            if excep.response['Error']['Code'] in CONDITION_FAILED_ERROR_CODES:
+                return None
+            raise
+
+    def create_lock(self, stackset_name, lock):
+        """
+        This method creates the lock object of the stack set with a conditional
+        write and returns its ETag, None when the lock object already exists
+        """
+        return self.put_lock(stackset_name, lock, IfNoneMatch='*')
+
+    def read_lock(self, stackset_name):
+        """
+        This method returns the lock of the stack set and its ETag,
+        (None, None) when not locked
+        """
+        try:
+            lock = self.s3_client.get_object(Bucket=self.bucket, Key=self.get_key(stackset_name, 'lock.json'))
+            return json.loads(lock['Body'].read()), lock['ETag']
+        except get_client_error() as excep:
+            if excep.response['Error']['Code'] in ['NoSuchKey', '404']:
+                return None, None
+            raise
+
+    def replace_lock(self, stackset_name, lock, version):
+        """
+        This method overwrites the lock object of the stack set when its ETag is
+        still the supplied version and returns the new ETag, None otherwise
+        """
+        return self.put_lock(stackset_name, lock, IfMatch=version)
+
+    def delete_lock(self, stackset_name, version):
+        """
+        This method deletes the lock object of the stack set when its ETag
+        is still the supplied version, returns False otherwise
+        """
+        try:
+            self.s3_client.delete_object(Bucket=self.bucket, Key=self.get_key(stackset_name, 'lock.json'), IfMatch=version)
+            return True
+        except get_client_error() as excep:
+            if excep.response['Error']['Code'] in CONDITION_FAILED_ERROR_CODES:
+                return False
+            raise
+
+    def enqueue(self, stackset_name, ticket):
+        """
+        This method adds the ticket to the queue of the stack set
+        """
+        self.s3_client.put_object(Bucket=self.bucket, Key=self.get_key(stackset_name, 'queue', ticket), Body=b'')
+
+    def dequeue(self, stackset_name, ticket):
+        """
+        This method removes the ticket from the queue of the stack set
+        """
+        self.s3_client.delete_object(Bucket=self.bucket, Key=self.get_key(stackset_name, 'queue', ticket))
+
+    def list_queue(self, stackset_name):
+        """
+        This method returns the tickets queued for the stack set
+        """
+        queue_prefix = self.get_key(stackset_name, 'queue', '')
+        tickets = []
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for queue_page in paginator.paginate(Bucket=self.bucket, Prefix=queue_prefix):
+            tickets.extend(queue_object['Key'][len(queue_prefix):] for queue_object in queue_page.get('Contents', []))
+        return tickets
+
+
+class StackSetQueue:
+    def __init__(self, backend, run_id=None, ttl=DEFAULT_STACKSET_LOCK_TTL, waiter=None, revision_time=None):
+        self.backend = backend
+        self.run_id = run_id if run_id else get_run_id()
+        self.ttl = ttl
+        self.waiter = waiter if waiter else OperationWaiter(timeout=DEFAULT_STACKSET_LOCK_TIMEOUT)
+        self.revision_time = revision_time if revision_time is not None else get_source_revision_time()
+        # stack set name -> [version of the held lock, event stopping its lease renewal]
+        self.leases = {}
+        self.leases_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, backend, deployment_configs):
+        """
+        This method creates the queue from the lock settings
+        of the deployment config, missing settings use the defaults.
+        """
+        try:
+            waiter = OperationWaiter.from_config(deployment_configs)
+            waiter.timeout = deployment_configs.get_value('stackset_lock_timeout', DEFAULT_STACKSET_LOCK_TIMEOUT)
+            return cls(backend,
+                       ttl=deployment_configs.get_value('stackset_lock_ttl', DEFAULT_STACKSET_LOCK_TTL),
+                       waiter=waiter)
+        except Exception as excep:
+            error_msg = f"Error while reading the stack set lock settings from deployment config: {str(excep)}"
+            raise Exception(error_msg)
+
+    def is_expired(self, ticket):
+        """
+        This method checks whether the ticket of a crashed run is past the longest
+        wait for the lock plus the TTL, tickets hold their queue time in nanoseconds
+        """
+        return int(ticket.split('-', 2)[1]) / 1e9 + self.waiter.timeout + self.ttl < time()
+
+    def enqueue(self, stackset_name):
+        """
+        This method queues the current run for the stack set and returns its ticket,
+        tickets sort by source revision time and then by queue time
+        """
+        ticket = f"{self.revision_time:012d}-{time_ns():020d}-{self.run_id}"
+        self.backend.enqueue(stackset_name, ticket)
+        return ticket
+
+    def get_lock(self):
+        """
+        This method returns the lock of the current run, expiring after the TTL
+        """
+        return {"owner": self.run_id, "expires_at": time() + self.ttl}
+
+    def try_lock(self, stackset_name):
+        """
+        This method takes the lock of the stack set when it is free or held by a
+        crashed run past the TTL, and starts renewing the lease of the lock
+        """
+        version = self.backend.create_lock(stackset_name, self.get_lock())
+        if version is None:
+            current_lock, current_version = self.backend.read_lock(stackset_name)
+            if current_lock is None:
+                version = self.backend.create_lock(stackset_name, self.get_lock())
+            elif current_lock['expires_at'] < time():
+                LOGGER.warning(f"Breaking the expired lock of the stack set {stackset_name} held by {current_lock['owner']}")
+                # the expired lock is only overwritten when it is still the one read,
+                # so of the runs breaking it at the same time only one takes it
+                version = self.backend.replace_lock(stackset_name, self.get_lock(), current_version)
+        if version is None:
+            return False
+        stop_event = threading.Event()
+        with self.leases_lock:
+            self.leases[stackset_name] = [version, stop_event]
+        threading.Thread(target=self.renew_lease, args=(stackset_name, stop_event), daemon=True).start()
+        return True
+
+    def renew_lease(self, stackset_name, stop_event):
+        """
+        This method extends the lock of the stack set held by the current run
+        every third of the TTL until the lock is released or taken over
+        """
+        while not stop_event.wait(self.ttl / 3):
+            with self.leases_lock:
+                if stop_event.is_set():
+                    return
+                lease = self.leases[stackset_name]
+                try:
+                    version = self.backend.replace_lock(stackset_name, self.get_lock(), lease[0])
+                except Exception as excep:
+                    LOGGER.warning(f"Unable to renew the lock of the stack set {stackset_name}, retrying: {str(excep)}")
+                    continue
+                if version is None:
+                    LOGGER.error(f"Lock of the stack set {stackset_name} is no longer held by {self.run_id}, its lease is not renewed")
+                    return
+                lease[0] = version
+
+    def check(self, stackset_name, ticket):
+        """
+        This method checks the queued ticket once and returns (is_completed, is_acquired),
+        the ticket is completed when the lock is taken or a run of a newer source
+        revision, or of the same revision queued later, is queued
+        """
+        newer_tickets = []
+        for queued_ticket in self.backend.list_queue(stackset_name):
+            if self.is_expired(queued_ticket):
+                self.backend.dequeue(stackset_name, queued_ticket)
+            elif queued_ticket > ticket:
+                newer_tickets.append(queued_ticket)
+        if newer_tickets:
+            LOGGER.info(f"{len(newer_tickets)} run(s) of a newer revision queued for the stack set {stackset_name}, skipping this run")
+            return True, False
+        if self.try_lock(stackset_name):
+            LOGGER.info(f"Lock of the stack set {stackset_name} acquired by {self.run_id}")
+            return True, True
+        LOGGER.info(f"Waiting for the lock of the stack set {stackset_name}..")
+        return False, None
+
+    def acquire_flow(self, stackset_name):
+        """
+        This method is the flow waiting until the current run holds the lock of the stack
+        set and returning True, or False when a newer run is queued for the stack set
+        """
+        try:
+            ticket = yield Call(self.enqueue, stackset_name)
+            try:
+                return (yield Wait(self.waiter, 'stack_set_lock', lambda: call_flow(self.check, stackset_name, ticket)))
+            finally:
+                yield Call(self.backend.dequeue, stackset_name, ticket)
+        except Exception as excep:
+            error_msg = f"Error while acquiring the lock of the stack set {stackset_name}: {str(excep)}"
+            raise Exception(error_msg)
+
+    def acquire(self, stackset_name):
+        """
+        This method waits on the calling thread until the current run holds the lock
+        of the stack set, see acquire_flow
+        """
+        return run_flow(self.acquire_flow(stackset_name), None)
+
+    def release(self, stackset_name):
+        """
+        This method releases the lock of the stack set held by the current run
+        """
+        with self.leases_lock:
+            version, stop_event = self.leases.pop(stackset_name, (None, None))
+            if stop_event:
+                stop_event.set()
+        if version is None:
+            return
+        try:
+            if self.backend.delete_lock(stackset_name, version):
+                LOGGER.info(f"Lock of the stack set {stackset_name} released by {self.run_id}")
+            else:
+                LOGGER.warning(f"Lock of the stack set {stackset_name} was taken over from {self.run_id}, it is not released")
+        except Exception as excep:
+            # an unreleased lock expires after the TTL
+            LOGGER.warning(f"Unable to release the lock of the stack set {stackset_name}: {str(excep)}")
+
+    @contextmanager
+    def hold(self, stackset_name):
+        """
+        This method holds the lock of the stack set for the duration of the
+        with block, the block gets False when a newer run is queued instead
+        """
+        is_acquired = self.acquire(stackset_name)
+        try:
+            yield is_acquired
+        finally:
+            if is_acquired:
+                self.release(stackset_name)
@@ -0,0 +1,190 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+stackset_progress.py tracks the progress of the stack instances
+of a stack set while a stack set operation is running.
+
+The tracker keeps the last seen status of each stack instance and counts
+the stack instances per status for every region and Org Unit. The counters
+are reported once per progress_report_interval and when the stack instances
+are no longer in progress, while a stack instance is only reported on its
+own when it reaches a terminal status. Reports are logged as single lines
+or, in the 'json' progress log format, printed to stdout as JSON lines.
+"""
+
+import sys
+import json
+import logging
+from time import monotonic
+from datetime import datetime, timezone
+
+LOGGER = logging.getLogger()
+
+DEFAULT_PROGRESS_POLL_INTERVAL = 10
+DEFAULT_PROGRESS_REPORT_INTERVAL = 60
+PROGRESS_LOG_FORMATS = ['text', 'json']
+PROGRESS_STATUS = ['PENDING', 'RUNNING']
+FAILED_STATUS = ['FAILED', 'CANCELLED', 'INOPERABLE', 'FAILED_IMPORT']
+TERMINAL_STATUS = ['SUCCEEDED', 'SKIPPED_SUSPENDED_ACCOUNT'] + FAILED_STATUS
+# stack instance fields fetched by the tracker, in the order of the tuples it is supplied
+PROGRESS_FIELDS = ('DeployedOUId', 'DeployedAccount', 'DeployedRegion', 'StackId', 'StackInstanceStatus')
+
+
+class ProgressReporter:
+    def __init__(self, stackset_name, log_format='text', report_interval=DEFAULT_PROGRESS_REPORT_INTERVAL, clock=monotonic):
+        self.stackset_name = stackset_name
+        self.log_format = log_format
+        self.report_interval = report_interval
+        self.clock = clock
+        self.reported_at = None
+
+    @classmethod
+    def from_config(cls, stackset_name, deployment_configs):
+        """
+        This method creates the reporter from the progress settings
+        of the deployment config, missing settings use the defaults.
+        """
+        try:
+            log_format = deployment_configs.get_value('progress_log_format', 'text')
+            if log_format not in PROGRESS_LOG_FORMATS:
+                raise Exception(f"invalid progress_log_format {log_format}, valid options are {', '.join(PROGRESS_LOG_FORMATS)}")
+            return cls(stackset_name,
+                       log_format=log_format,
+                       report_interval=deployment_configs.get_value('progress_report_interval', DEFAULT_PROGRESS_REPORT_INTERVAL))
+        except Exception as excep:
+            error_msg = f"Error while reading the progress settings from deployment config: {str(excep)}"
+            raise Exception(error_msg)
+
+    def emit(self, event, log_level=logging.INFO, **fields):
+        """
+        This method writes a progress event as a JSON line to stdout
+        or as a single log line of the supplied log level
+        """
+        if self.log_format == 'json':
+            record = dict({
+                            "timestamp": datetime.now(timezone.utc).isoformat(),
+                            "event": event,
+                            "stack_set": self.stackset_name
+                          }, **fields)
+            sys.stdout.write(json.dumps(record, separators=(',', ':')) + "\n")
+            sys.stdout.flush()
+            return
+        if not LOGGER.isEnabledFor(log_level):
+            return
+        details = " - ".join(f"{name}: {format_value(value)}" for name, value in fields.items())
+        log_line = f"Stack set {self.stackset_name} {event.replace('_', ' ')} - {details}"
+        LOGGER.log(log_level, log_line)
+
+    def report_instance(self, ou_id, account, region, stack_id, status):
+        """
+        This method reports the stack instance which reached a terminal status,
+        failures are logged as warnings and the other statuses as debug
+        as they are already counted in the progress counters
+        """
+        self.emit('stack_instance',
+                  log_level=logging.WARNING if status in FAILED_STATUS else logging.DEBUG,
+                  ou=ou_id,
+                  account=account,
+                  region=region,
+                  stack_id=stack_id,
+                  status=status)
+
+    def is_due(self):
+        """
+        This method checks whether the progress counters are due
+        to be reported, they are due on the first poll
+        """
+        return self.reported_at is None or self.clock() - self.reported_at >= self.report_interval
+
+    def report_counters(self, counters):
+        """
+        This method reports the stack instance counters per status
+        """
+        self.reported_at = self.clock()
+        self.emit('progress', **counters)
+
+
+def format_value(value):
+    """
+    This function formats a field of a progress log line,
+    counters are written as status=count lists
+    """
+    if not isinstance(value, dict):
+        return str(value)
+    if all(isinstance(count, int) for count in value.values()):
+        return ", ".join(f"{status}={count}" for status, count in sorted(value.items()))
+    return "; ".join(f"{name} [{format_value(counts)}]" for name, counts in sorted(value.items()))
+
+
+class InstanceProgressTracker:
+    def __init__(self, stackset_name, reporter=None):
+        self.stackset_name = stackset_name
+        self.reporter = reporter if reporter else ProgressReporter(stackset_name)
+        # (OU, Account, Region) -> last seen detailed status
+        self.instance_status = {}
+        self.status_counts = {}
+        self.region_counts = {}
+        self.ou_counts = {}
+        self.is_in_progress = False
+
+    def start_poll(self):
+        """
+        This method resets the counters before the stack instances of a poll are added
+        """
+        self.status_counts = {}
+        self.region_counts = {}
+        self.ou_counts = {}
+        self.is_in_progress = False
+
+    def add(self, stack_instance):
+        """
+        This method counts the supplied stack instance, a tuple of the
+        PROGRESS_FIELDS, and reports it when it reached a terminal status
+        since the previous poll
+        """
+        ou_id, account, region, stack_id, status = stack_instance
+        status = sys.intern(status)
+        self.is_in_progress = self.is_in_progress or status in PROGRESS_STATUS
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        region_counts = self.region_counts.setdefault(region, {})
+        region_counts[status] = region_counts.get(status, 0) + 1
+        ou_counts = self.ou_counts.setdefault(ou_id, {})
+        ou_counts[status] = ou_counts.get(status, 0) + 1
+
+        instance_key = (ou_id, account, region)
+        if self.instance_status.get(instance_key) != status:
+            self.instance_status[instance_key] = status
+            if status in TERMINAL_STATUS:
+                self.reporter.report_instance(ou_id, account, region, stack_id, status)
+
+    def finish_poll(self):
+        """
+        This method reports the counters of the poll when they are due or the stack
+        instances are no longer in progress, and returns True while any of the
+        stack instances is still in progress.
+        """
+        if self.reporter.is_due() or not self.is_in_progress:
+            self.reporter.report_counters(self.get_counters())
+        return self.is_in_progress
+
+    def update(self, stack_instances):
+        """
+        This method records the status of the supplied stack instances
+        and returns True while any of them is still in progress.
+        """
+        self.start_poll()
+        for stack_instance in stack_instances:
+            self.add(stack_instance)
+        return self.finish_poll()
+
+    def get_counters(self):
+        """
+        This method returns the stack instance counters per status
+        in total, per region and per Org Unit of the last poll
+        """
+        return {
+                    "instances": sum(self.status_counts.values()),
+                    "status": dict(self.status_counts),
+                    "regions": {region: dict(counts) for region, counts in self.region_counts.items()},
+                    "org_units": {ou_id: dict(counts) for ou_id, counts in self.ou_counts.items()}
+               }
@@ -0,0 +1,228 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+stackset_teardown.py deletes a list of stack sets, or all the stack sets
+whose name starts with a prefix, together with their stack instances.
+
+Each stack set is torn down by a Deployer: its stack instances are deleted
+with one operation per region when managed execution is active, with the
+teardown operation preferences, and the stack set is deleted as soon as
+its last stack instance is gone. Independent stack sets are torn down
+concurrently, up to max_parallel_teardowns of them, sharing one rate
+limited CloudFormation client and stack set inventory.
+
+The resolved stack sets are always listed first and only torn down when
+the teardown is confirmed with --yes, otherwise the run is a dry run.
+A prefix shorter than MIN_TEARDOWN_PREFIX_LENGTH is refused.
+
+This python module takes below inputs
+
+1. Current AWS Region (region where the stack sets are administered)
+2. Stack Set names (comma separated) and/or a Stack Set name prefix
+3. Deployment Configuration file (teardown and API settings)
+4. --yes to confirm the teardown of the listed stack sets
+"""
+
+import os
+import sys
+import argparse
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import stackset_deployer
+import config_model
+import stackset_inventory
+import api_rate_limiter
+import stackset_lock
+from stackset_waiter import OperationWaiter
+from run_metrics import RunMetrics
+
+LOGGER = logging.getLogger()
+
+DEFAULT_MAX_PARALLEL_TEARDOWNS = 8
+MIN_TEARDOWN_PREFIX_LENGTH = 4
+
+
+class StackSetTeardown:
+    def __init__(self, aws_region, deployment_configs, cf_client, inventory, stackset_queue=None, metrics=None):
+        self.aws_region = aws_region
+        self.deployment_configs = deployment_configs
+        self.cf_client = cf_client
+        self.inventory = inventory
+        self.stackset_queue = stackset_queue
+        self.metrics = metrics if metrics else RunMetrics()
+
+    def get_max_parallel_teardowns(self):
+        """
+        This method returns the maximum number of stack sets
+        torn down in parallel, read from the deployment config.
+        """
+        try:
+            max_parallel_teardowns = self.deployment_configs.get_value('max_parallel_teardowns', DEFAULT_MAX_PARALLEL_TEARDOWNS)
+            if max_parallel_teardowns < 1:
+                raise Exception("max_parallel_teardowns must be greater than zero")
+            return max_parallel_teardowns
+        except Exception as excep:
+            error_msg = f"Error while reading max_parallel_teardowns from deployment config: {str(excep)}"
+            raise Exception(error_msg)
+
+    def resolve_stack_sets(self, stack_set_names=None, prefix=None):
+        """
+        This method returns the ACTIVE stack sets to tear down, the supplied
+        names and the stack sets whose name starts with the supplied prefix.
+        Supplied names which do not exist are skipped so a teardown
+        can be run again after a partial failure. An empty or short prefix is
+        refused, so a typo cannot match every stack set of the account.
+        """
+        if prefix is not None and len(prefix.strip()) < MIN_TEARDOWN_PREFIX_LENGTH:
+            error_msg = f"Stack set name prefix '{prefix}' is too short, at least {MIN_TEARDOWN_PREFIX_LENGTH} characters are required"
+            raise Exception(error_msg)
+        return self.inventory.resolve_stack_sets(stack_set_names, prefix)
+
+    def get_deployer(self, stack_set_name):
+        """
+        This method returns the Deployer tearing down the supplied stack set
+        """
+        ss_deployer = stackset_deployer.Deployer(None, self.aws_region, self.inventory, cf_client=self.cf_client,
+                                                 metrics=self.metrics)
+        ss_deployer.deployment_configs = self.deployment_configs
+        ss_deployer.waiter = OperationWaiter.from_config(self.deployment_configs)
+        ss_deployer.stack_set_name = stack_set_name
+        return ss_deployer
+
+    def teardown(self, stack_set_name):
+        """
+        This method tears down the supplied stack set, holding its
+        lock when the stack set queue is enabled
+        """
+        ss_deployer = self.get_deployer(stack_set_name)
+        if self.stackset_queue:
+            with self.stackset_queue.hold(stack_set_name) as is_acquired:
+                if is_acquired:
+                    ss_deployer.teardown_stack_set()
+        else:
+            ss_deployer.teardown_stack_set()
+
+    def run(self, stack_set_names):
+        """
+        This method tears down the supplied stack sets concurrently
+        and returns the errors of the failed teardowns per stack set.
+        """
+        max_parallel_teardowns = self.get_max_parallel_teardowns()
+        LOGGER.info(f"Tearing down {len(stack_set_names)} stack set(s) with up to {max_parallel_teardowns} parallel teardown(s)")
+        failed_stack_sets = {}
+        with ThreadPoolExecutor(max_workers=max_parallel_teardowns) as executor:
+            futures = {executor.submit(self.teardown, stack_set_name): stack_set_name for stack_set_name in stack_set_names}
+            for future in as_completed(futures):
+                stack_set_name = futures[future]
+                try:
+                    future.result()
+                except Exception as excep:
+                    failed_stack_sets[stack_set_name] = str(excep)
+                    LOGGER.error(f"Teardown of the stack set {stack_set_name} failed: {str(excep)}")
+        return failed_stack_sets
+
+
+def get_stackset_queue(deployment_configs, s3_client, s3_bucket):
+    """
+    This function returns the queue serializing the operations of a stack set
+    across runs, None when stackset_lock_backend is 'none' in the deployment config.
+    """
+    lock_backend = deployment_configs.get_value('stackset_lock_backend', 'none')
+    if lock_backend not in stackset_lock.LOCK_BACKENDS:
+        error_msg = f"Invalid stackset_lock_backend {lock_backend}. Valid options are {', '.join(stackset_lock.LOCK_BACKENDS)}."
+        raise Exception(error_msg)
+    if lock_backend == 'none':
+        return None
+    if lock_backend == 'file':
+        lock_dir = deployment_configs.get_value('stackset_lock_dir', os.path.join(tempfile.gettempdir(), 'stackset_locks'))
+        backend = stackset_lock.FileLockBackend(lock_dir)
+    else:
+        if not s3_bucket:
+            raise Exception("The s3 stackset_lock_backend requires --s3_bucket")
+        backend = stackset_lock.S3LockBackend(s3_client, s3_bucket, 'stackset_locks/')
+    return stackset_lock.StackSetQueue.from_config(backend, deployment_configs)
+
+
+def teardown_stack_sets(region, deployment_config_file, stack_set_names=None, prefix=None, s3_bucket=None, session=None, is_confirmed=False):
+    """
+    This function lists the supplied stack sets and the stack sets matching the
+    supplied prefix and, when the teardown is confirmed, tears them down and
+    raises an error listing the failed teardowns
+    """
+    deployment_configs = config_model.load_deployment_config(deployment_config_file)
+    if session is None:
+        import boto3
+        session = boto3
+    cf_client = api_rate_limiter.RateLimitedClient.from_config(session.client('cloudformation', region), deployment_configs)
+    inventory_ttl = deployment_configs.get_value('inventory_cache_ttl', stackset_inventory.DEFAULT_INVENTORY_CACHE_TTL)
+    inventory = stackset_inventory.StackSetInventory(cf_client, inventory_ttl)
+    stackset_queue = get_stackset_queue(deployment_configs, session.client('s3', region), s3_bucket)
+    stackset_teardown = StackSetTeardown(region, deployment_configs, cf_client, inventory, stackset_queue)
+
+    stack_sets = stackset_teardown.resolve_stack_sets(stack_set_names, prefix)
+    if not stack_sets:
+        LOGGER.info("No stack set to tear down")
+        return
+    LOGGER.info(f"{len(stack_sets)} stack set(s) to tear down:")
+    for stack_set_name in stack_sets:
+        LOGGER.info(f"  {stack_set_name}")
+    if not is_confirmed:
+        LOGGER.info("Dry run, nothing is deleted. Run again with --yes to tear down the listed stack sets")
+        return
+    failed_stack_sets = stackset_teardown.run(stack_sets)
+    cf_client.log_stats()
+    if failed_stack_sets:
+        failures = "; ".join(f"{stack_set_name}: {error}" for stack_set_name, error in sorted(failed_stack_sets.items()))
+        error_msg = f"{len(failed_stack_sets)} of {len(stack_sets)} stack set teardown(s) failed - {failures}"
+        raise Exception(error_msg)
+    LOGGER.info(f"{len(stack_sets)} stack set(s) torn down")
+
+
+def main(args):
+    """
+    This is main function triggers the bulk teardown of the stack sets
+    """
+    stack_set_names = [name.strip() for name in args.stack_sets.split(',') if name.strip()] if args.stack_sets else []
+    teardown_stack_sets(args.region, args.deployment_config, stack_set_names, args.prefix, args.s3_bucket, is_confirmed=args.yes)
+
+
+if __name__ == "__main__":
+    FORMAT = '%(asctime)s %(levelname)s %(message)s'
+    logging.basicConfig(format=FORMAT,
+                        datefmt="%Y-%m-%d %H:%M:%S",
+                        handlers=[logging.StreamHandler(sys.stdout)]
+                        )
+    LOGGER.setLevel(logging.INFO)
+
+    parser = argparse.ArgumentParser(prog='stackset_teardown.py',
+                                     usage='%(prog)s --region <aws region> [--stack_sets <name,name>] [--prefix <stack set name prefix>] [--yes]',
+                                     description="Delegated Admin Service Managed Stack Set Bulk Teardown")
+    parser.add_argument('--region',
+                        action='store',
+                        type=str,
+                        required=True)
+    parser.add_argument('--stack_sets',
+                        action='store',
+                        type=str,
+                        required=False,
+                        help="comma separated names of the stack sets to tear down")
+    parser.add_argument('--prefix',
+                        action='store',
+                        type=str,
+                        required=False,
+                        help="tear down all the stack sets whose name starts with the prefix")
+    parser.add_argument('--deployment_config',
+                        action='store',
+                        type=str,
+                        default=f"{os.getcwd()}/deploy_configs/deployment_config.json")
+    parser.add_argument('--s3_bucket',
+                        action='store',
+                        type=str,
+                        required=False,
+                        help="artifact s3 bucket of the s3 stackset_lock_backend")
+    parser.add_argument('--yes',
+                        action='store_true',
+                        help="confirm the teardown of the listed stack sets, otherwise they are only listed")
+    arguments = parser.parse_args()
+    main(arguments)
@@ -0,0 +1,147 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+stackset_waiter.py provides the waiter used by the stack set deployer
+to wait for stack set operations to complete.
+
+The waiter checks the operation right away and then backs off exponentially
+with jitter up to a ceiling, so short operations finish quickly while long
+running operations are not polled aggressively. Latency of each waited
+operation is recorded and can be reported at the end of the deployment.
+"""
+
+import random
+import asyncio
+import logging
+import threading
+from time import sleep, monotonic
+
+LOGGER = logging.getLogger()
+
+DEFAULT_WAITER_INITIAL_DELAY = 2
+DEFAULT_WAITER_MAX_DELAY = 30
+DEFAULT_WAITER_BACKOFF_RATE = 2
+DEFAULT_WAITER_JITTER = 0.2
+DEFAULT_WAITER_TIMEOUT = 3600
+
+
+class OperationWaiter:
+    def __init__(self, initial_delay=DEFAULT_WAITER_INITIAL_DELAY, max_delay=DEFAULT_WAITER_MAX_DELAY,
+                 backoff_rate=DEFAULT_WAITER_BACKOFF_RATE, jitter=DEFAULT_WAITER_JITTER,
+                 timeout=DEFAULT_WAITER_TIMEOUT, sleep_func=sleep):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff_rate = backoff_rate
+        self.jitter = jitter
+        self.timeout = timeout
+        self.sleep_func = sleep_func
+        self.latency_stats = {}
+        self.stats_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, deployment_configs, sleep_func=sleep):
+        """
+        This method creates the waiter from the waiter settings
+        of the deployment config, missing settings use the defaults.
+        """
+        try:
+            return cls(initial_delay=deployment_configs.get_value('waiter_initial_delay', DEFAULT_WAITER_INITIAL_DELAY),
+                       max_delay=deployment_configs.get_value('waiter_max_delay', DEFAULT_WAITER_MAX_DELAY),
+                       backoff_rate=deployment_configs.get_value('waiter_backoff_rate', DEFAULT_WAITER_BACKOFF_RATE),
+                       jitter=deployment_configs.get_value('waiter_jitter', DEFAULT_WAITER_JITTER),
+                       timeout=deployment_configs.get_value('waiter_timeout', DEFAULT_WAITER_TIMEOUT),
+                       sleep_func=sleep_func)
+        except Exception as excep:
+            error_msg = f"Error while reading the waiter settings from deployment config: {str(excep)}"
+            raise Exception(error_msg)
+
+    def get_delay(self, attempt):
+        """
+        This method returns the delay before the next check, growing
+        exponentially from the initial delay up to the max delay with
+        a random jitter applied.
+        """
+        # the exponent is capped so long waits cannot overflow the float
+        delay = min(self.initial_delay * (self.backoff_rate ** min(attempt, 64)), self.max_delay)
+        if self.jitter:
+            delay = delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+        return max(0, min(delay, self.max_delay))
+
+    def wait(self, operation_name, check):
+        """
+        This method calls the supplied check until it reports completion
+        and returns the result of the check. The check must return
+        a tuple of (is_completed, result).
+        """
+        started = monotonic()
+        attempt = 0
+        while True:
+            is_completed, result = check()
+            elapsed = monotonic() - started
+            if is_completed:
+                self.record_latency(operation_name, elapsed, attempt + 1)
+                return result
+            if elapsed >= self.timeout:
+                error_msg = f"Timed out after {int(elapsed)} seconds waiting for {operation_name}"
+                raise Exception(error_msg)
+            delay = min(self.get_delay(attempt), max(0, self.timeout - elapsed))
+            attempt += 1
+            self.sleep_func(delay)
+
+    async def wait_async(self, operation_name, check):
+        """
+        This method is the asyncio version of wait, the supplied check
+        is a coroutine function returning (is_completed, result).
+        """
+        started = monotonic()
+        attempt = 0
+        while True:
+            is_completed, result = await check()
+            elapsed = monotonic() - started
+            if is_completed:
+                self.record_latency(operation_name, elapsed, attempt + 1)
+                return result
+            if elapsed >= self.timeout:
+                error_msg = f"Timed out after {int(elapsed)} seconds waiting for {operation_name}"
+                raise Exception(error_msg)
+            delay = min(self.get_delay(attempt), max(0, self.timeout - elapsed))
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def record_latency(self, operation_name, elapsed, checks):
+        """
+        This method records the wait latency and number of checks
+        of a completed operation.
+        """
+        with self.stats_lock:
+            stats = self.latency_stats.setdefault(operation_name, {
+                                                                        "count": 0,
+                                                                        "checks": 0,
+                                                                        "total_seconds": 0.0,
+                                                                        "min_seconds": None,
+                                                                        "max_seconds": 0.0
+                                                                    })
+            stats["count"] += 1
+            stats["checks"] += checks
+            stats["total_seconds"] += elapsed
+            stats["min_seconds"] = elapsed if stats["min_seconds"] is None else min(stats["min_seconds"], elapsed)
+            stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+
+    def get_latency_stats(self):
+        """
+        This method returns the latency stats per operation name
+        along with the average wait time.
+        """
+        with self.stats_lock:
+            latency_stats = {}
+            for operation_name, stats in self.latency_stats.items():
+                latency_stats[operation_name] = dict(stats, avg_seconds=stats["total_seconds"] / stats["count"])
+            return latency_stats
+
+    def log_latency_stats(self):
+        """
+        This method logs the latency stats of all the waited operations
+        """
+        for operation_name, stats in sorted(self.get_latency_stats().items()):
+            LOGGER.info(f"Waiter stats for {operation_name} - Count: {stats['count']} - Checks: {stats['checks']} "
+                        f"- Avg: {stats['avg_seconds']:.1f}s - Min: {stats['min_seconds']:.1f}s - Max: {stats['max_seconds']:.1f}s")
@@ -0,0 +1,150 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+target_diff.py evaluates the deployment targets at the stack instance level.
+
+The target Org Units are resolved to their accounts (with the account filter
+of the deployment config applied), the current and target stack instances are
+indexed by (Org Unit, Account, Region) and the difference is grouped into the
+fewest create/delete operations that touch only the stack instances to add or
+remove.
+"""
+
+import logging
+import threading
+from collections import defaultdict
+from operation_planner import PlannedOperation
+
+LOGGER = logging.getLogger()
+
+
+class OrganizationResolver:
+    def __init__(self, org_client):
+        self.org_client = org_client
+        # OU id -> active accounts of the OU and its child OUs
+        self.ou_accounts = {}
+        # the resolver is shared by the deployers of a run, so an Org Unit is resolved once
+        self.resolver_lock = threading.RLock()
+
+    def get_ou_accounts(self, ou_id):
+        """
+        This method returns the active accounts of the supplied Org Unit
+        including the accounts of its child Org Units
+        """
+        with self.resolver_lock:
+            if ou_id in self.ou_accounts:
+                return self.ou_accounts[ou_id]
+            try:
+                accounts = set()
+                accounts_paginator = self.org_client.get_paginator('list_accounts_for_parent')
+                for accounts_page in accounts_paginator.paginate(ParentId=ou_id):
+                    accounts.update(account['Id'] for account in accounts_page['Accounts'] if account.get('Status', 'ACTIVE') == 'ACTIVE')
+
+                child_ous_paginator = self.org_client.get_paginator('list_organizational_units_for_parent')
+                for child_ous_page in child_ous_paginator.paginate(ParentId=ou_id):
+                    for child_ou in child_ous_page['OrganizationalUnits']:
+                        accounts.update(self.get_ou_accounts(child_ou['Id']))
+            except Exception as excep:
+                error_msg = f"Error while getting the accounts of the Org Unit {ou_id}: {str(excep)}"
+                raise Exception(error_msg)
+
+            self.ou_accounts[ou_id] = accounts
+            return accounts
+
+
+class InstanceIndex:
+    def __init__(self, instance_keys=()):
+        # (OU, Account, Region) keys of the stack instances
+        self.instance_keys = set()
+        self.by_region = defaultdict(set)
+        self.by_account = defaultdict(set)
+        for instance_key in instance_keys:
+            self.add(instance_key)
+
+    def add(self, instance_key):
+        """
+        This method adds the supplied (OU, Account, Region) key to the index
+        """
+        self.instance_keys.add(instance_key)
+        self.by_region[instance_key[2]].add(instance_key)
+        self.by_account[instance_key[1]].add(instance_key)
+
+    def __len__(self):
+        return len(self.instance_keys)
+
+    def __contains__(self, instance_key):
+        return instance_key in self.instance_keys
+
+
+def filter_accounts(accounts, filter_accounts, filter_type):
+    """
+    This function applies the account filter of the deployment targets
+    to the accounts of an Org Unit
+    """
+    if not (filter_accounts and filter_type) or filter_type == 'NONE':
+        return set(accounts)
+    if filter_type == 'INTERSECTION':
+        return set(accounts) & set(filter_accounts)
+    if filter_type == 'DIFFERENCE':
+        return set(accounts) - set(filter_accounts)
+    error_msg = f"Account filter type {filter_type} is not supported by the account level diff"
+    raise Exception(error_msg)
+
+
+def get_target_index(org_resolver, tgt_ou_ids, tgt_regions, tgt_filter_accounts, tgt_filter_type):
+    """
+    This function returns the index of the stack instances
+    the deployment targets resolve to
+    """
+    target_index = InstanceIndex()
+    for ou_id in tgt_ou_ids:
+        ou_accounts = filter_accounts(org_resolver.get_ou_accounts(ou_id), tgt_filter_accounts, tgt_filter_type)
+        for account in ou_accounts:
+            for region in tgt_regions:
+                target_index.add((ou_id, account, region))
+    return target_index
+
+
+def diff_instances(current_index, target_index):
+    """
+    This function returns the stack instance keys to add, to remove
+    and to leave unchanged
+    """
+    to_add = target_index.instance_keys - current_index.instance_keys
+    to_remove = current_index.instance_keys - target_index.instance_keys
+    unchanged = current_index.instance_keys & target_index.instance_keys
+    return to_add, to_remove, unchanged
+
+
+def group_operations(action, instance_keys):
+    """
+    This function groups the supplied stack instance keys into operations,
+    accounts needing the same set of regions share one operation that
+    targets them with an INTERSECTION account filter
+    """
+    account_regions = defaultdict(set)
+    for ou_id, account, region in instance_keys:
+        account_regions[(ou_id, account)].add(region)
+
+    region_groups = defaultdict(list)
+    for (ou_id, account), regions in account_regions.items():
+        region_groups[frozenset(regions)].append((ou_id, account))
+
+    planned_operations = []
+    for regions, ou_accounts in sorted(region_groups.items(), key=lambda group: sorted(group[0])):
+        planned_operations.append(PlannedOperation(action,
+                                                   sorted({ou_id for ou_id, _ in ou_accounts}),
+                                                   sorted(regions),
+                                                   sorted({account for _, account in ou_accounts})))
+    return planned_operations
+
+
+def plan_account_operations(current_index, target_index):
+    """
+    This function returns the create/delete operations for the difference
+    between the current and target stack instances, the delete operations
+    come first
+    """
+    to_add, to_remove, unchanged = diff_instances(current_index, target_index)
+    LOGGER.info(f"Stack instances to add: {len(to_add)}, to remove: {len(to_remove)}, unchanged: {len(unchanged)}")
+    return group_operations('delete', to_remove) + group_operations('create', to_add)
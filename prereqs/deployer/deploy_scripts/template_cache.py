@@ -0,0 +1,136 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+template_cache.py provides the content hashes used to skip redundant
+template uploads and stack set updates.
+
+The hash of a template file is stored as metadata of its S3 object, and
+the hash of each deployed stack set (template, parameters, the staged
+artifacts and the stack set related deployment config) is stored in a deployment manifest JSON
+object in the artifacts bucket.
+"""
+
+import json
+import hashlib
+import logging
+import threading
+from api_rate_limiter import get_client_error
+
+LOGGER = logging.getLogger()
+
+CONTENT_HASH_METADATA_KEY = 'content-hash'
+# deployment config values sent in the create_stack_set/update_stack_set
+# request or otherwise changing the deployed stack set, operation preferences
+# and tuning values only affect how it is deployed
+STACK_SET_CONFIG_KEYS = ['deployment_action',
+                         'stack_set_name',
+                         'stack_set_desciption',
+                         'cft_capabilities',
+                         'auto_deployement',
+                         'retain_stacks_on_account_removal',
+                         'managed_execution']
+
+
+def get_file_hash(file_path):
+    """
+    This function returns the SHA-256 hash of the supplied file
+    """
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def get_artifacts_hash(artifact_files):
+    """
+    This function returns the hash of the supplied (relative path, file path)
+    artifacts, covering their paths and content
+    """
+    artifacts_hash = hashlib.sha256()
+    for artifact, artifact_file in sorted(artifact_files):
+        artifacts_hash.update(f"{artifact}:{get_file_hash(artifact_file)}\n".encode())
+    return artifacts_hash.hexdigest()
+
+
+def get_deployment_hash(template_file, parameter_file, deployment_config, env_key, artifacts_hash=None):
+    """
+    This function returns the content hash of a stack set deployment from
+    the template, its parameter file, the hash of the artifacts staged with
+    it and the stack set related values of the deployment config for the
+    supplied environment, the deployment targets of an extended environment included.
+    """
+    stack_set_config = {key: deployment_config.get(key) for key in STACK_SET_CONFIG_KEYS}
+    stack_set_config['deployment_targets'] = deployment_config.get_env_targets(env_key)
+    deployment_hash = hashlib.sha256()
+    deployment_hash.update(get_file_hash(template_file).encode())
+    deployment_hash.update(get_file_hash(parameter_file).encode())
+    if artifacts_hash:
+        # templates reference the artifacts, e.g. nested stacks, so changing
+        # an artifact changes the deployment
+        deployment_hash.update(artifacts_hash.encode())
+    deployment_hash.update(json.dumps(stack_set_config, sort_keys=True).encode())
+    return deployment_hash.hexdigest()
+
+
+class DeploymentManifest:
+    def __init__(self, s3_client, bucket, key):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.deployments = {}
+        self.is_modified = False
+        self.manifest_lock = threading.Lock()
+
+    def load(self):
+        """
+        This method loads the deployment manifest from S3,
+        a missing manifest is treated as empty.
+        """
+        try:
+            manifest = self.s3_client.get_object(Bucket=self.bucket, Key=self.key)
+            self.deployments = json.loads(manifest['Body'].read())
+        except get_client_error() as excep:
+            if excep.response['Error']['Code'] not in ['NoSuchKey', '404']:
+                error_msg = f"Error while loading the deployment manifest s3://{self.bucket}/{self.key}: {str(excep)}"
+                raise Exception(error_msg)
+            LOGGER.info(f"Deployment manifest s3://{self.bucket}/{self.key} not found, all stack sets will be deployed")
+            self.deployments = {}
+        return self
+
+    def is_unchanged(self, stack_set_name, content_hash):
+        """
+        This method checks whether the stack set was last deployed
+        with the supplied content hash.
+        """
+        with self.manifest_lock:
+            return content_hash is not None and self.deployments.get(stack_set_name) == content_hash
+
+    def record(self, stack_set_name, content_hash):
+        """
+        This method records the content hash of a successful deployment,
+        None removes the stack set from the manifest.
+        """
+        with self.manifest_lock:
+            if content_hash is None:
+                self.is_modified = self.deployments.pop(stack_set_name, None) is not None or self.is_modified
+            elif self.deployments.get(stack_set_name) != content_hash:
+                self.deployments[stack_set_name] = content_hash
+                self.is_modified = True
+
+    def save(self):
+        """
+        This method saves the deployment manifest to S3 when modified
+        """
+        with self.manifest_lock:
+            if not self.is_modified:
+                return
+            try:
+                self.s3_client.put_object(Bucket=self.bucket,
+                                          Key=self.key,
+                                          Body=json.dumps(self.deployments, indent=4, sort_keys=True).encode(),
+                                          ContentType='application/json')
+                self.is_modified = False
+            except Exception as excep:
+                error_msg = f"Error while saving the deployment manifest s3://{self.bucket}/{self.key}: {str(excep)}"
+                raise Exception(error_msg)
@@ -0,0 +1,218 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+template_index.py discovers the CloudFormation Templates of the application
+and their parameter files for the deployment environment.
+
+The templates and parameters directories are walked recursively and indexed
+by template stem, the path of the template relative to the templates
+directory without its extension, so a template is matched with its
+(stem)-parameter-(env).json parameter file in constant time. The index can
+be kept in a cache file and is reused as long as none of the indexed
+directories changed. The templates changed since a base git commit can be
+selected, so only those enter the deployment.
+"""
+
+import os
+import json
+import logging
+import subprocess
+
+LOGGER = logging.getLogger()
+
+TEMPLATE_EXTENSIONS = ('.yml', '.yaml')
+PARAMETER_EXTENSION = '.json'
+DEFAULT_TEMPLATES = ['template.yml', 'template.yaml']
+DEFAULT_TEMPLATE_PARAMETERS = ['template-parameter-dev.json', 'template-parameter-test.json', 'template-parameter-prod.json']
+INDEX_VERSION = 1
+
+
+def get_parameter_suffix(env):
+    """
+    This function returns the file name suffix of the parameter files of the environment
+    """
+    return f"-parameter-{env}{PARAMETER_EXTENSION}"
+
+
+def scan_files(root_path):
+    """
+    This function walks the supplied directory and returns the files as paths
+    relative to it with '/' separators, and the modification time of every directory
+    """
+    files = []
+    directories = {}
+    pending = ['']
+    while pending:
+        relative_dir = pending.pop()
+        dir_path = os.path.join(root_path, relative_dir)
+        directories[relative_dir] = os.stat(dir_path).st_mtime_ns
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                relative_path = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+                if entry.is_dir():
+                    pending.append(relative_path)
+                elif entry.is_file():
+                    files.append(relative_path)
+    return sorted(files), directories
+
+
+def is_unchanged(root_path, directories):
+    """
+    This function checks whether none of the supplied directories changed
+    since their modification times were recorded
+    """
+    try:
+        return all(os.stat(os.path.join(root_path, relative_dir)).st_mtime_ns == mtime
+                   for relative_dir, mtime in directories.items())
+    except OSError:
+        return False
+
+
+class TemplateIndex:
+    def __init__(self, template_path, parameters_path, env, cache_file=None):
+        self.template_path = template_path
+        self.parameters_path = parameters_path
+        self.env = env
+        self.cache_file = cache_file
+        # template stem -> template file
+        self.templates = {}
+        # template stem -> parameter file of the environment
+        self.parameters = {}
+        # directory -> modification time of the directories the index was built from
+        self.template_dirs = {}
+        self.parameter_dirs = {}
+
+    def build(self):
+        """
+        This method builds the index from the templates and parameters directories,
+        or loads it from the cache file when none of the directories changed
+        """
+        if self.load_cache():
+            LOGGER.info(f"Template index loaded from {self.cache_file}, {len(self.templates)} template(s)")
+            return self
+        try:
+            template_files, self.template_dirs = scan_files(self.template_path)
+            parameter_files, self.parameter_dirs = scan_files(self.parameters_path)
+        except Exception as excep:
+            error_msg = f"Error while scanning the templates and parameters directories: {str(excep)}"
+            raise Exception(error_msg)
+
+        self.templates = {os.path.splitext(template_file)[0]: template_file for template_file in template_files
+                          if template_file.endswith(TEMPLATE_EXTENSIONS)}
+        parameter_suffix = get_parameter_suffix(self.env)
+        self.parameters = {parameter_file[:-len(parameter_suffix)]: parameter_file for parameter_file in parameter_files
+                           if parameter_file.endswith(parameter_suffix)}
+        self.check_default_names(template_files, parameter_files)
+        self.save_cache()
+        LOGGER.info(f"Template index built with {len(self.templates)} template(s) and {len(self.parameters)} {self.env} parameter file(s)")
+        return self
+
+    def check_default_names(self, template_files, parameter_files):
+        """
+        This method checks that the default template and parameter
+        file names of the sample application are not used
+        """
+        if any(os.path.basename(template_file) in DEFAULT_TEMPLATES for template_file in template_files):
+            raise Exception("Change the Name of CloudFormaiton Template as <application name>.yml, default template.yml or template.yaml are not allowed")
+        if any(os.path.basename(parameter_file) in DEFAULT_TEMPLATE_PARAMETERS for parameter_file in parameter_files):
+            raise Exception("Change the Name of Template Parameter file as <application name>-parameter-<evn>.json with, default names are not allowed")
+
+    def load_cache(self):
+        """
+        This method loads the index from the cache file, returns False
+        when there is no cache or the indexed directories changed
+        """
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return False
+        try:
+            with open(self.cache_file) as file:
+                cache = json.load(file)
+        except Exception as excep:
+            LOGGER.warning(f"Ignoring the unreadable template index cache {self.cache_file}: {str(excep)}")
+            return False
+        if cache.get("version") != INDEX_VERSION or cache.get("env") != self.env \
+                or cache.get("template_path") != self.template_path or cache.get("parameters_path") != self.parameters_path:
+            return False
+        if not (is_unchanged(self.template_path, cache["template_dirs"]) and is_unchanged(self.parameters_path, cache["parameter_dirs"])):
+            return False
+        self.templates = cache["templates"]
+        self.parameters = cache["parameters"]
+        self.template_dirs = cache["template_dirs"]
+        self.parameter_dirs = cache["parameter_dirs"]
+        return True
+
+    def save_cache(self):
+        """
+        This method saves the index to the cache file
+        """
+        if not self.cache_file:
+            return
+        try:
+            with open(self.cache_file, 'w') as file:
+                json.dump({
+                            "version": INDEX_VERSION,
+                            "env": self.env,
+                            "template_path": self.template_path,
+                            "parameters_path": self.parameters_path,
+                            "templates": self.templates,
+                            "parameters": self.parameters,
+                            "template_dirs": self.template_dirs,
+                            "parameter_dirs": self.parameter_dirs
+                          }, file)
+        except Exception as excep:
+            # the cache only saves the next scan
+            LOGGER.warning(f"Unable to save the template index cache {self.cache_file}: {str(excep)}")
+
+    def get_templates(self, stems=None):
+        """
+        This method returns the (template file, parameter file) of the templates
+        having a parameter file for the environment, only those of the supplied
+        template stems when supplied
+        """
+        selected_stems = self.templates if stems is None else [stem for stem in stems if stem in self.templates]
+        return [(self.templates[stem], self.parameters[stem]) for stem in sorted(selected_stems) if stem in self.parameters]
+
+    def get_changed_stems(self, changed_files, template_dir='templates', parameters_dir='parameters'):
+        """
+        This method returns the template stems affected by the supplied changed
+        files (paths relative to the application root), None when a change
+        outside the templates and their parameter files affects all of them
+        """
+        parameter_suffix = get_parameter_suffix(self.env)
+        changed_stems = set()
+        for changed_file in changed_files:
+            if changed_file.startswith(f"{template_dir}/"):
+                changed_stems.add(os.path.splitext(changed_file[len(template_dir) + 1:])[0])
+            elif changed_file.startswith(f"{parameters_dir}/"):
+                parameter_file = changed_file[len(parameters_dir) + 1:]
+                if parameter_file.endswith(parameter_suffix):
+                    changed_stems.add(parameter_file[:-len(parameter_suffix)])
+            else:
+                # deployment config and artifacts changes can affect any template
+                return None
+        return changed_stems
+
+
+def get_changed_files(base_ref, app_path, paths):
+    """
+    This function returns the files under the supplied paths of the application
+    which differ from the base git commit, including the untracked files,
+    as paths relative to the application root
+    """
+    try:
+        repo_root = subprocess.run(['git', 'rev-parse', '--show-toplevel'], cwd=app_path, capture_output=True,
+                                   text=True, check=True).stdout.strip()
+        app_prefix = os.path.relpath(os.path.realpath(app_path), os.path.realpath(repo_root)).replace(os.sep, '/')
+        app_prefix = '' if app_prefix == '.' else f"{app_prefix}/"
+        diff_files = subprocess.run(['git', 'diff', '--name-only', '--no-renames', base_ref, '--', *paths], cwd=app_path,
+                                    capture_output=True, text=True, check=True).stdout.split('\n')
+        untracked_files = subprocess.run(['git', 'ls-files', '--others', '--exclude-standard', '--full-name', '--', *paths],
+                                         cwd=app_path, capture_output=True, text=True, check=True).stdout.split('\n')
+    except subprocess.CalledProcessError as excep:
+        error_msg = f"Error while comparing with the base commit {base_ref}: {excep.stderr.strip()}"
+        raise Exception(error_msg)
+    except Exception as excep:
+        error_msg = f"Error while comparing with the base commit {base_ref}: {str(excep)}"
+        raise Exception(error_msg)
+    return sorted({changed_file[len(app_prefix):] for changed_file in diff_files + untracked_files
+                   if changed_file and changed_file.startswith(app_prefix)})
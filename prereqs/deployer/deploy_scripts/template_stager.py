@@ -0,0 +1,115 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+template_stager.py stages the CloudFormation Templates and their local
+artifacts to the Artifacts S3 bucket before the stack set deployment.
+
+All the files are uploaded concurrently through one shared S3 transfer
+manager, files whose content is unchanged since their last upload are
+skipped, and the HTTPS URL of every staged file is returned.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import template_cache
+from api_rate_limiter import get_client_error
+
+LOGGER = logging.getLogger()
+
+DEFAULT_S3_MAX_CONCURRENCY = 10
+DEFAULT_S3_MULTIPART_THRESHOLD_MB = 8
+MB = 1024 * 1024
+
+
+class TemplateStager:
+    def __init__(self, s3_client, bucket, max_concurrency=DEFAULT_S3_MAX_CONCURRENCY,
+                 multipart_threshold_mb=DEFAULT_S3_MULTIPART_THRESHOLD_MB):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.max_concurrency = max_concurrency
+        from boto3.s3.transfer import TransferConfig
+        self.transfer_config = TransferConfig(multipart_threshold=int(multipart_threshold_mb * MB),
+                                              multipart_chunksize=int(max(multipart_threshold_mb, 5) * MB),
+                                              max_concurrency=max_concurrency,
+                                              use_threads=True)
+
+    @classmethod
+    def from_config(cls, s3_client, bucket, deployment_config):
+        """
+        This method creates the stager from the S3 transfer settings
+        of the deployment config, missing settings use the defaults.
+        """
+        try:
+            return cls(s3_client,
+                       bucket,
+                       max_concurrency=deployment_config.get_value('s3_max_concurrency', DEFAULT_S3_MAX_CONCURRENCY),
+                       multipart_threshold_mb=deployment_config.get_value('s3_multipart_threshold_mb', DEFAULT_S3_MULTIPART_THRESHOLD_MB))
+        except Exception as excep:
+            error_msg = f"Error while reading the S3 transfer settings from deployment config: {str(excep)}"
+            raise Exception(error_msg)
+
+    def get_url(self, s3_key):
+        """
+        This method returns the HTTPS URL of the supplied S3 key
+        """
+        return f"https://{self.bucket}.s3.amazonaws.com/{s3_key}"
+
+    def get_staged_hash(self, s3_key):
+        """
+        This method returns the content hash of the file already
+        staged in the S3 bucket, None if it is not staged.
+        """
+        try:
+            staged_file = self.s3_client.head_object(Bucket=self.bucket, Key=s3_key)
+            return staged_file.get('Metadata', {}).get(template_cache.CONTENT_HASH_METADATA_KEY)
+        except get_client_error() as excep:
+            if excep.response['Error']['Code'] in ['404', 'NoSuchKey', 'NotFound']:
+                return None
+            raise
+
+    def is_staged(self, s3_key, source_file):
+        """
+        This method returns the content hash of the source file and
+        whether the same content is already staged.
+        """
+        file_hash = template_cache.get_file_hash(source_file)
+        return file_hash, self.get_staged_hash(s3_key) == file_hash
+
+    def stage(self, files):
+        """
+        This method uploads the supplied (S3 key, source file) pairs
+        and returns the map of S3 key to HTTPS URL. Unchanged files
+        are not uploaded again.
+        """
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                staged_status = list(executor.map(lambda file: self.is_staged(*file), files))
+
+            uploads = []
+            from boto3.s3.transfer import create_transfer_manager
+            with create_transfer_manager(self.s3_client, self.transfer_config) as transfer_manager:
+                for (s3_key, source_file), (file_hash, is_staged) in zip(files, staged_status):
+                    if is_staged:
+                        LOGGER.info(f"{source_file} is unchanged in S3 bucket {self.bucket}, skipping the upload")
+                        continue
+                    future = transfer_manager.upload(source_file,
+                                                     self.bucket,
+                                                     s3_key,
+                                                     extra_args={'Metadata': {template_cache.CONTENT_HASH_METADATA_KEY: file_hash}})
+                    uploads.append((source_file, future))
+
+                failed_uploads = []
+                for source_file, future in uploads:
+                    try:
+                        future.result()
+                    except Exception as excep:
+                        failed_uploads.append(f"{source_file}: {str(excep)}")
+
+            if failed_uploads:
+                raise Exception("; ".join(failed_uploads))
+
+            LOGGER.info(f"Staged {len(files)} file(s) to S3 bucket {self.bucket}, {len(uploads)} uploaded")
+            return {s3_key: self.get_url(s3_key) for s3_key, _ in files}
+        except Exception as excep:
+            error_msg = f"Error while staging the files to S3 bucket {self.bucket}, {str(excep)}"
+            raise Exception(error_msg)
@@ -0,0 +1,104 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+conftest.py puts the deploy scripts and the simulated StackSets service of
+the benchmarks on the import path and provides the shared test fixtures,
+the simulated organization and session and an application of two templates.
+"""
+
+import os
+import sys
+import json
+import pytest
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_PATH, 'prereqs', 'deployer', 'deploy_scripts'))
+sys.path.insert(0, os.path.join(REPO_PATH, 'benchmarks'))
+
+import fake_stacksets
+import deploy
+
+SAMPLE_CONFIG_FILE = os.path.join(REPO_PATH, 'prereqs', 'app_prereqs', 'deploy_configs', 'deployment_config.json')
+APP_NAME = 'app'
+ENVIRONMENTS = ['dev', 'test']
+TEMPLATES = ['app0', 'app1']
+
+
+@pytest.fixture
+def sample_config():
+    """
+    This fixture returns the values of the sample deployment config
+    """
+    with open(SAMPLE_CONFIG_FILE) as file:
+        return json.load(file)
+
+
+@pytest.fixture
+def service():
+    """
+    This fixture returns a simulated organization of 2 Org Units x 3 accounts x 2 regions
+    whose operations complete right away
+    """
+    return fake_stacksets.FakeStackSetsService(ou_count=2, accounts_per_ou=3, regions=['us-east-1', 'us-west-2'], seed=7)
+
+
+@pytest.fixture
+def session(service):
+    """
+    This fixture returns the session handing out the simulated clients
+    """
+    return fake_stacksets.FakeSession(service)
+
+
+@pytest.fixture
+def app_dir(tmp_path, monkeypatch, service, sample_config):
+    """
+    This fixture writes an application of two templates deployed to dev and test
+    to a temporary directory and runs the test from it
+    """
+    for folder in ['templates', 'parameters', 'deploy_configs']:
+        (tmp_path / folder).mkdir()
+    sample_config.update({
+                            "deployment_action": "deploy",
+                            "stack_set_name": APP_NAME,
+                            "stack_set_desciption": "Deployment test",
+                            "metrics_report_file": str(tmp_path / 'deploy_run_report.json'),
+                            "waiter_initial_delay": 0.01,
+                            "waiter_max_delay": 0.05,
+                            "progress_poll_interval": 0.01
+                         })
+    for environment in ENVIRONMENTS:
+        sample_config['deployment_targets'][environment].update(org_units=service.get_ou_ids(), regions=['us-east-1'])
+    (tmp_path / 'deploy_configs' / 'deployment_config.json').write_text(json.dumps(sample_config))
+    for template in TEMPLATES:
+        (tmp_path / 'templates' / f"{template}.yml").write_text("Resources:\n  Topic:\n    Type: AWS::SNS::Topic\n")
+        for environment in ENVIRONMENTS:
+            (tmp_path / 'parameters' / f"{template}-parameter-{environment}.json").write_text(json.dumps({"Parameters": {"Name": template}}))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def set_config(app_dir):
+    """
+    This fixture returns the function updating the deployment config of the application
+    """
+    def update_config(**values):
+        config_file = app_dir / 'deploy_configs' / 'deployment_config.json'
+        deployment_config = json.loads(config_file.read_text())
+        deployment_config.update(values)
+        config_file.write_text(json.dumps(deployment_config))
+
+    return update_config
+
+
+@pytest.fixture
+def run_deploy(app_dir, session):
+    """
+    This fixture returns the function running the AutoDeployer of the application
+    for dev and test, or the supplied environments
+    """
+    def run(environments=ENVIRONMENTS, is_plan=False):
+        deploy.AutoDeployer(','.join(environments), 'us-east-1', 'artifacts', APP_NAME, session, is_plan=is_plan).deploy()
+
+    return run
@@ -0,0 +1,98 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+Tests of the rate limited CloudFormation client on the simulated StackSets service.
+"""
+
+import os
+import sys
+import subprocess
+import pytest
+import api_rate_limiter
+from api_rate_limiter import RateLimitedClient, TokenBucket
+
+
+@pytest.fixture
+def cf_client(service, session):
+    """
+    This fixture returns the rate limited client of a service whose stack set
+    app-dev runs one operation at a time, operations lasting 0.1 seconds
+    """
+    service.seed_stack_set('app-dev', managed_execution=False)
+    service.operation_duration = 0.1
+    return RateLimitedClient(session.cf_client, rate=1000, burst=1000, retry_base_delay=0.02, retry_max_delay=0.05)
+
+
+def test_reservations_are_served_in_order():
+    """
+    This test checks that an empty bucket schedules the reservations one
+    refill interval apart
+    """
+    bucket = TokenBucket(rate=10, burst=1)
+    assert [round(bucket.reserve(), 2) for _ in range(3)] == [0, 0.1, 0.2]
+
+
+def test_throttled_calls_are_retried(service, cf_client):
+    """
+    This test checks that throttled calls are retried and counted as retries
+    """
+    service.throttle_rate = 0.5
+    service.random.seed(1)
+    for _ in range(10):
+        assert cf_client.describe_stack_set(StackSetName='app-dev')['StackSet']['StackSetName'] == 'app-dev'
+    stats = cf_client.get_stats()['describe_stack_set']
+    assert stats['retries'] == stats['throttled'] == stats['calls'] - 10 > 0
+
+
+def test_mutating_calls_are_retried_while_an_operation_is_in_progress(cf_client):
+    """
+    This test checks that a mutating call waits for the operation in progress
+    """
+    cf_client.update_stack_set(StackSetName='app-dev')
+    assert cf_client.update_stack_set(StackSetName='app-dev')['OperationId']
+    assert cf_client.get_stats()['update_stack_set']['retries'] > 0
+
+
+def test_in_progress_retries_are_bounded(cf_client):
+    """
+    This test checks that OperationInProgressException is raised once
+    api_in_progress_max_retries retries failed
+    """
+    cf_client.in_progress_max_retries = 2
+    cf_client.client.service.operation_duration = 5
+    cf_client.update_stack_set(StackSetName='app-dev')
+    with pytest.raises(Exception, match="OperationInProgressException"):
+        cf_client.update_stack_set(StackSetName='app-dev')
+    stats = cf_client.get_stats()['update_stack_set']
+    assert (stats['calls'], stats['retries']) == (4, 2)
+
+
+def test_callers_opt_out_of_in_progress_retries(cf_client):
+    """
+    This test checks that retry_in_progress False raises right away
+    """
+    cf_client.update_stack_set(StackSetName='app-dev')
+    with pytest.raises(Exception, match="OperationInProgressException"):
+        cf_client.call('update_stack_set', retry_in_progress=False, StackSetName='app-dev')
+    assert cf_client.get_stats()['update_stack_set']['retries'] == 0
+
+
+def test_only_mutating_calls_are_retried_while_in_progress(cf_client):
+    """
+    This test checks that the read calls are not retried on OperationInProgressException
+    """
+    assert cf_client.is_retryable('create_stack_instances', {}, 'OperationInProgressException')
+    assert not cf_client.is_retryable('describe_stack_set', {}, 'OperationInProgressException')
+    assert not cf_client.is_retryable('update_stack_set', {}, 'OperationInProgressException', retry_in_progress=False)
+
+
+def test_deploy_scripts_import_without_botocore():
+    """
+    This test checks that importing the deploy scripts does not load botocore,
+    ClientError being imported by get_client_error on first use
+    """
+    scripts_path = os.path.dirname(os.path.abspath(api_rate_limiter.__file__))
+    check = ("import sys, deploy, stackset_deployer, stackset_health, stackset_teardown, async_deployer; "
+             "sys.exit('botocore' in sys.modules)")
+    assert subprocess.run([sys.executable, '-c', check], cwd=scripts_path).returncode == 0
+    assert api_rate_limiter.get_client_error().__module__ == 'botocore.exceptions'
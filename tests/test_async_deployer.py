@@ -0,0 +1,61 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+Tests of the asyncio deployment engine on the simulated StackSets service.
+"""
+
+import asyncio
+import pytest
+from api_rate_limiter import RateLimitedClient
+from async_deployer import AsyncStackSetApi
+
+FAST_RETRIES = {"api_retry_base_delay": 0.01, "api_retry_max_delay": 0.05}
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_throttled_deployment_is_retried(service, set_config, run_deploy, seed):
+    """
+    This test checks that the async engine deploys every template while
+    20% of the API calls are throttled
+    """
+    service.throttle_rate = 0.2
+    service.random.seed(seed)
+    set_config(deployment_engine="async", template_stack_sets="True", **FAST_RETRIES)
+    run_deploy()
+    assert sorted(service.get_instance_count(stackset_name) for stackset_name in service.stack_sets) == [6, 6, 6, 6]
+
+
+def test_calls_share_the_budgets_and_stats_of_the_rate_limited_client(service, session):
+    """
+    This test checks that the async calls take the tokens of the rate limited
+    client and are counted and retried in its stats
+    """
+    service.seed_stack_set('app-dev')
+    cf_client = RateLimitedClient(session.cf_client, rate=1000, burst=1000, api_budgets={"describe_stack_set": {"rate": 0.01, "burst": 5}},
+                                  retry_base_delay=0.01, retry_max_delay=0.01)
+    api = AsyncStackSetApi(cf_client, max_pool_connections=2)
+    service.throttle_rate = 1
+    service.random.seed(0)
+
+    async def describe_throttled_then_succeed():
+        calls = asyncio.ensure_future(api.call('describe_stack_set', StackSetName='app-dev'))
+        await asyncio.sleep(0.005)
+        service.throttle_rate = 0
+        return await calls
+
+    assert asyncio.run(describe_throttled_then_succeed())['StackSet']['StackSetName'] == 'app-dev'
+    api.close()
+    stats = cf_client.get_stats()['describe_stack_set']
+    assert stats['calls'] >= 2 and stats['retries'] == stats['calls'] - 1 and stats['throttled'] == stats['retries']
+    assert cf_client.api_buckets['describe_stack_set'].tokens == pytest.approx(5 - stats['calls'], abs=0.1)
+
+
+def test_errors_which_are_not_retryable_are_raised(service, session):
+    """
+    This test checks that the errors other than throttling are raised right away
+    """
+    api = AsyncStackSetApi(RateLimitedClient(session.cf_client), max_pool_connections=1)
+    with pytest.raises(Exception, match="StackSetNotFoundException"):
+        asyncio.run(api.call('describe_stack_set', StackSetName='missing-dev'))
+    api.close()
+    assert service.api_counter.get_counts() == {'describe_stack_set': 1}
@@ -0,0 +1,182 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+Tests of the deployment config model: schema errors, environments
+extending each other and the conversion of the values.
+"""
+
+import json
+import logging
+import pytest
+import config_model
+
+
+def load_config(tmp_path, values):
+    """
+    This function writes the supplied values as deployment config file and loads it
+    """
+    config_file = tmp_path / 'deployment_config.json'
+    config_file.write_text(json.dumps(values))
+    return config_model.load_deployment_config(str(config_file))
+
+
+@pytest.fixture
+def app_config(sample_config):
+    """
+    This fixture returns the sample deployment config filled in for a deployment
+    """
+    sample_config.update({
+                            "deployment_action": "Deploy",
+                            "stack_set_name": "app",
+                            "stack_set_desciption": "Test application"
+                         })
+    for env_key in config_model.ENV_KEYS:
+        sample_config['deployment_targets'][env_key].update(org_units=[f"ou-{env_key}"], regions=['us-east-1'])
+    return sample_config
+
+
+def test_values_are_converted_once(tmp_path, app_config):
+    """
+    This test checks the typed values of the booleans, numbers and choice keys
+    """
+    app_config.update({"stop_on_failure": "true", "max_parallel_deployments": "6", "waiter_timeout": "90",
+                       "deployment_engine": "Async", "max_concurrent_percentage": 25.0})
+    deployment_config = load_config(tmp_path, app_config).validate_stack_set()
+    assert deployment_config.is_enabled('stop_on_failure') is True
+    assert deployment_config.is_enabled('managed_execution') is False
+    assert deployment_config.get_value('max_parallel_deployments') == 6
+    assert deployment_config.get_value('waiter_timeout') == 90.0
+    assert deployment_config.get_value('max_concurrent_percentage') == 25
+    assert deployment_config.get_value('deployment_engine') == 'async'
+    assert deployment_config.deployment_action == 'deploy'
+    assert deployment_config.get_value('plan_batch_seconds') == 60.0
+    assert deployment_config.get_value('api_in_progress_max_retries') == 20
+    assert deployment_config.get_value('missing_key', 'default') == 'default'
+    # the raw values are kept for the deployment content hashes
+    assert deployment_config['stop_on_failure'] == 'true'
+
+
+def test_unset_booleans_use_their_defaults(tmp_path, app_config):
+    """
+    This test checks the defaults of the boolean keys missing from the config
+    """
+    del app_config['skip_unchanged_deployments']
+    del app_config['stop_on_failure']
+    del app_config['template_stack_sets']
+    deployment_config = load_config(tmp_path, app_config)
+    assert deployment_config.is_enabled('skip_unchanged_deployments') is True
+    assert deployment_config.is_enabled('stop_on_failure') is False
+    assert deployment_config.is_enabled('template_stack_sets') is False
+
+
+@pytest.mark.parametrize("key, value, error", [
+    ('max_parallel_deployments', "many", "max_parallel_deployments expected an integer"),
+    ('max_concurrent_percentage', 12.5, "max_concurrent_percentage expected an integer, got 12.5"),
+    ('max_concurrent_percentage', True, "max_concurrent_percentage expected an integer"),
+    ('stop_on_failure', "yes", "stop_on_failure expected \"True\" or \"False\""),
+    ('waiter_timeout', [], "waiter_timeout expected a number"),
+    ('template_stack_sets', "per template", "template_stack_sets expected \"True\" or \"False\""),
+    ('api_in_progress_max_retries', 2.5, "api_in_progress_max_retries expected an integer, got 2.5"),
+    ('cft_capabilities', "CAPABILITY_IAM", "cft_capabilities expected a list"),
+    ('deployment_targets', [], "deployment_targets expected an object")
+])
+def test_schema_errors(tmp_path, app_config, key, value, error):
+    """
+    This test checks that the values of the wrong type are rejected when the config is loaded
+    """
+    app_config[key] = value
+    with pytest.raises(Exception, match=error):
+        load_config(tmp_path, app_config)
+
+
+def test_all_schema_errors_are_reported_at_once(tmp_path, app_config):
+    """
+    This test checks that one error lists every invalid value
+    """
+    app_config.update({"max_parallel_deployments": "many", "metrics_emf": "maybe"})
+    with pytest.raises(Exception) as excinfo:
+        load_config(tmp_path, app_config)
+    assert "max_parallel_deployments" in str(excinfo.value) and "metrics_emf" in str(excinfo.value)
+
+
+def test_unknown_keys_are_reported(tmp_path, app_config, caplog):
+    """
+    This test checks that a misspelled key is logged as a likely typo
+    """
+    app_config["stop_on_failur"] = "True"
+    with caplog.at_level(logging.WARNING):
+        load_config(tmp_path, app_config)
+    assert "stop_on_failur" in caplog.text
+
+
+def test_stack_set_settings_are_checked(tmp_path, app_config):
+    """
+    This test checks the required stack set settings and their allowed values
+    """
+    del app_config['stack_set_desciption']
+    app_config.update({"deployment_action": "redeploy", "failure_tolerance_percentage": 120})
+    with pytest.raises(Exception) as excinfo:
+        load_config(tmp_path, app_config).validate_stack_set()
+    assert "stack_set_desciption is missing" in str(excinfo.value)
+    assert "deployment_action must be one of deploy, delete" in str(excinfo.value)
+    assert "failure_tolerance_percentage must be between 0 and 100" in str(excinfo.value)
+
+
+def test_environment_extends_another_environment(tmp_path, app_config):
+    """
+    This test checks that an environment inherits the targets it does not set
+    and overrides the operation preferences it sets
+    """
+    app_config['deployment_targets']['test'].update(regions=['us-east-1', 'eu-west-1'], filter_accounts=['111111111111'],
+                                                    filter_type='DIFFERENCE')
+    app_config['deployment_targets']['prod'] = {"extends": "qa", "org_units": ["ou-prod"], "max_concurrent_percentage": "50"}
+    environment_config = load_config(tmp_path, app_config).validate_stack_set().get_environment('production')
+    assert environment_config.org_units == ['ou-prod']
+    assert environment_config.regions == ['us-east-1', 'eu-west-1']
+    assert environment_config.filter_accounts == ['111111111111']
+    assert environment_config.filter_type == 'DIFFERENCE'
+    assert environment_config.operation_preferences == {
+                                                            "RegionConcurrencyType": "PARALLEL",
+                                                            "MaxConcurrentPercentage": 50,
+                                                            "FailureTolerancePercentage": 19,
+                                                            "ConcurrencyMode": "STRICT_FAILURE_TOLERANCE"
+                                                       }
+
+
+def test_extended_targets_are_part_of_the_content_hash_targets(tmp_path, app_config):
+    """
+    This test checks that the targets hashed for an extending environment include the extended targets
+    """
+    app_config['deployment_targets']['prod'] = {"extends": "test", "org_units": ["ou-prod"]}
+    deployment_config = load_config(tmp_path, app_config).validate_stack_set()
+    assert deployment_config.get_env_targets('prod')['regions'] == ['us-east-1']
+    assert deployment_config.get_env_targets('dev') == app_config['deployment_targets']['dev']
+
+
+@pytest.mark.parametrize("targets, error", [
+    ({"dev": {"extends": "prod"}, "test": {"extends": "dev"}, "prod": {"extends": "test"}}, "extends cycle"),
+    ({"dev": {"extends": "staging"}}, "extends must be one of dev, test, prod"),
+    ({"dev": {"org_units": ["ou-dev"], "region": ["us-east-1"]}}, "deployment_targets.dev.region is not a valid key"),
+    ({"dev": {"org_units": [], "regions": ["us-east-1"]}}, "Organization Units is mandatory"),
+    ({"dev": {"org_units": ["ou-dev"], "filter_type": "EXCEPT"}}, "filter_type must be one of"),
+    ({"dev": {"org_units": ["ou-dev"], "max_concurrent_percentage": 12.5}}, "deployment_targets.dev.max_concurrent_percentage expected an integer"),
+    ({"test": {"org_units": ["ou-test"]}}, "deployment_targets.dev is missing")
+])
+def test_environment_errors(tmp_path, app_config, targets, error):
+    """
+    This test checks the errors of the deployment targets of an environment
+    """
+    app_config['deployment_targets'] = targets
+    deployment_config = load_config(tmp_path, app_config).validate_stack_set()
+    with pytest.raises(Exception, match=error):
+        deployment_config.get_environment('dev')
+
+
+def test_invalid_json_is_reported(tmp_path):
+    """
+    This test checks the error of a deployment config file which is not a JSON object
+    """
+    config_file = tmp_path / 'deployment_config.json'
+    config_file.write_text('["not", "an", "object"]')
+    with pytest.raises(Exception, match="expected a JSON object"):
+        config_model.load_deployment_config(str(config_file))
@@ -0,0 +1,180 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+Tests of AutoDeployer.deploy on the simulated StackSets service, including
+the environment waves: a failed wave gates the next waves while the failures
+of a wave are collected per template.
+"""
+
+import json
+import pytest
+import deploy
+
+
+def test_templates_share_the_legacy_stack_set_by_default(service, run_deploy):
+    """
+    This test checks that without template_stack_sets the templates are deployed
+    one after the other to the single stack set of each environment
+    """
+    run_deploy()
+    assert sorted(service.stack_sets) == ['app-dev', 'app-test']
+    assert service.get_instance_count('app-dev') == 6
+    assert service.api_counter.get_counts()['create_stack_set'] == 2
+    assert service.api_counter.get_counts()['update_stack_set'] == 2
+
+
+def test_templates_sharing_a_stack_set_are_never_skipped(service, set_config, run_deploy):
+    """
+    This test checks that the templates sharing a stack set are deployed again
+    on the next run, as the stack set only holds the last one
+    """
+    set_config(skip_unchanged_deployments="True")
+    run_deploy()
+    run_deploy()
+    assert service.api_counter.get_counts()['update_stack_set'] == 6
+
+
+def test_template_stack_sets_deploys_a_stack_set_per_template(service, set_config, run_deploy):
+    """
+    This test checks that template_stack_sets deploys each template to its own stack set
+    """
+    set_config(template_stack_sets="True")
+    run_deploy()
+    assert sorted(service.stack_sets) == ['app-app0-dev', 'app-app0-test', 'app-app1-dev', 'app-app1-test']
+    assert service.get_instance_count('app-app0-test') == 6
+
+
+def test_deployments_of_a_stack_set_run_in_separate_rounds():
+    """
+    This test checks that the deployments sharing a stack set are split across
+    rounds while the other deployments run in the first round
+    """
+    dev, test = type('Deployer', (), {'environment': 'dev'})(), type('Deployer', (), {'environment': 'test'})()
+    deployments = [(dev, 'a.yml', 'url', None, 'hash'), (dev, 'b.yml', 'url', None, 'hash'),
+                   (test, 'a.yml', 'url', 'a', 'hash'), (test, 'b.yml', 'url', 'b', 'hash')]
+    rounds = deploy.AutoDeployer.get_deployment_rounds(None, deployments)
+    assert [[(deployment[0].environment, deployment[1]) for deployment in deployment_round] for deployment_round in rounds] == \
+        [[('dev', 'a.yml'), ('test', 'a.yml'), ('test', 'b.yml')], [('dev', 'b.yml')]]
+
+
+def test_shared_stack_set_is_deleted_once(service, set_config, run_deploy):
+    """
+    This test checks that the delete action deletes the stack set shared by
+    the templates once
+    """
+    run_deploy()
+    set_config(deployment_action="delete")
+    run_deploy()
+    assert not service.stack_sets
+    assert service.api_counter.get_counts()['delete_stack_set'] == 2
+
+
+def test_artifact_change_updates_the_unchanged_templates(service, app_dir, set_config, run_deploy):
+    """
+    This test checks that unchanged deployments are skipped until an artifact
+    referenced by the templates changes
+    """
+    set_config(template_stack_sets="True", skip_unchanged_deployments="True")
+    (app_dir / 'artifacts').mkdir()
+    (app_dir / 'artifacts' / 'nested.yml').write_text("Resources: {}\n")
+    run_deploy()
+    run_deploy()
+    assert 'update_stack_set' not in service.api_counter.get_counts()
+    (app_dir / 'artifacts' / 'nested.yml').write_text("Resources:\n  Queue:\n    Type: AWS::SQS::Queue\n")
+    run_deploy()
+    assert service.api_counter.get_counts()['update_stack_set'] == 4
+
+
+def test_all_waves_are_deployed(service, set_config, run_deploy):
+    """
+    This test checks that every template is deployed to every environment
+    """
+    set_config(template_stack_sets="True")
+    run_deploy()
+    assert sorted(service.stack_sets) == ['app-app0-dev', 'app-app0-test', 'app-app1-dev', 'app-app1-test']
+    assert service.get_instance_count('app-app0-test') == 6
+
+
+@pytest.mark.parametrize("stop_on_failure", ["False", "True"])
+def test_failed_wave_gates_the_next_waves(service, app_dir, set_config, run_deploy, stop_on_failure):
+    """
+    This test checks that a failed dev deployment skips the test wave,
+    whatever stop_on_failure is set to
+    """
+    set_config(template_stack_sets="True", stop_on_failure=stop_on_failure, max_parallel_deployments=1)
+    (app_dir / 'parameters' / 'app1-parameter-dev.json').write_text('{"Parameters": ')
+    with pytest.raises(Exception) as excinfo:
+        run_deploy()
+    assert "dev/app1.yml" in str(excinfo.value)
+    assert "test/app0.yml" in str(excinfo.value) and "test/app1.yml" in str(excinfo.value)
+    assert not [stackset_name for stackset_name in service.stack_sets if stackset_name.endswith('-test')]
+
+
+def test_failures_are_collected_per_template_within_a_wave(service, app_dir, set_config, run_deploy):
+    """
+    This test checks that without stop_on_failure a failed template does not
+    stop the other templates of its wave
+    """
+    set_config(template_stack_sets="True", max_parallel_deployments=1)
+    (app_dir / 'parameters' / 'app0-parameter-dev.json').write_text('{"Parameters": ')
+    with pytest.raises(Exception, match="3 of 4 template deployment"):
+        run_deploy()
+    assert service.get_instance_count('app-app1-dev') == 6
+    assert 'app-app0-test' not in service.stack_sets
+
+
+def test_concurrent_fanout_deploys_all_environments_at_once(service, app_dir, set_config, run_deploy):
+    """
+    This test checks that the concurrent fanout deploys the other environments
+    even when a deployment of one environment fails
+    """
+    set_config(template_stack_sets="True", environment_fanout="concurrent")
+    (app_dir / 'parameters' / 'app1-parameter-dev.json').write_text('{"Parameters": ')
+    with pytest.raises(Exception, match="1 of 4 template deployment"):
+        run_deploy()
+    assert service.get_instance_count('app-app0-test') == 6
+    assert service.get_instance_count('app-app1-test') == 6
+
+
+def test_delete_action_keeps_the_operation_preferences_of_the_environment(service, app_dir, set_config, run_deploy):
+    """
+    This test checks that the pipeline deletion deletes the stack instances of all
+    the regions with a single operation using the configured operation preferences
+    """
+    deployment_targets = json.loads((app_dir / 'deploy_configs' / 'deployment_config.json').read_text())['deployment_targets']
+    deployment_targets['dev']['regions'] = ['us-east-1', 'us-west-2']
+    set_config(deployment_targets=deployment_targets, managed_execution="True", region_deployment_concurrency="SEQUENTIAL")
+    run_deploy(['dev'])
+    set_config(deployment_action="delete")
+    run_deploy(['dev'])
+    delete_operations = [operation for operation in service.operations.values() if operation['action'] == 'DELETE']
+    assert not service.stack_sets and len(delete_operations) == 1
+    assert delete_operations[0]['regions'] == {'us-east-1', 'us-west-2'}
+    assert delete_operations[0]['preferences']['RegionConcurrencyType'] == 'SEQUENTIAL'
+    assert delete_operations[0]['preferences']['MaxConcurrentPercentage'] == 20
+
+
+@pytest.mark.parametrize("account_level_diff", ["False", "True"])
+def test_plan_resolves_the_accounts_only_for_the_account_level_diff(service, app_dir, set_config, run_deploy, account_level_diff):
+    """
+    This test checks that the plan only lists the Org Unit accounts and counts
+    the stack instances to create with account_level_diff enabled, and otherwise
+    plans the Org Unit level diff
+    """
+    run_deploy(['dev'])
+    deployment_targets = json.loads((app_dir / 'deploy_configs' / 'deployment_config.json').read_text())['deployment_targets']
+    deployment_targets['dev']['regions'] = ['us-east-1', 'us-west-2']
+    set_config(deployment_targets=deployment_targets, account_level_diff=account_level_diff)
+    service.api_counter.reset()
+    run_deploy(['dev'], is_plan=True)
+    plan = json.loads((app_dir / 'deploy_plan.json').read_text())
+    api_counts = service.api_counter.get_counts()
+    assert not [api_method for api_method in api_counts if api_method not in ['list_stack_sets', 'describe_stack_set', 'list_stack_instances',
+                                                                              'list_accounts_for_parent', 'list_organizational_units_for_parent']]
+    assert [operation['type'] for operation in plan['deployments'][0]['operations']] == ['create_stack_instances', 'update_stack_set']
+    if account_level_diff == "True":
+        assert api_counts['list_accounts_for_parent'] == 2
+        assert plan['deployments'][0]['instances']['create'] == {'us-west-2': 6}
+    else:
+        assert 'list_accounts_for_parent' not in api_counts
+        assert plan['deployments'][0]['instances']['create'] is None
@@ -0,0 +1,127 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+Tests of the operation journal: a restarted run resumes the deployment
+and reuses the idempotency tokens of the interrupted run.
+"""
+
+import pytest
+import stackset_deployer
+import operation_history
+import operation_journal
+
+STACK_SET_NAME = 'app-dev'
+CONTENT_HASH = 'content-hash-1'
+
+
+@pytest.fixture
+def s3_client(session):
+    """
+    This fixture returns the S3 client of the in memory S3 store
+    """
+    return session.client('s3', 'us-east-1')
+
+
+def get_journal(s3_client):
+    """
+    This function returns a journal stored in the simulated S3 bucket, a new
+    journal on the same store stands for a restarted run
+    """
+    return operation_journal.OperationJournal(lambda stackset_name: operation_history.S3HistoryStore(s3_client, 'artifacts', f"journal/{stackset_name}.json"))
+
+
+def get_deployer(session, journal, run_id):
+    """
+    This function returns a deployer of the stack set on the simulated service
+    """
+    ss_deployer = stackset_deployer.Deployer('dev', 'us-east-1', cf_client=session.cf_client, operation_journal=journal)
+    ss_deployer.stack_set_name = STACK_SET_NAME
+    ss_deployer.run_id = run_id
+    return ss_deployer
+
+
+def submit_create(ss_deployer, service, run_id):
+    """
+    This function submits the create step of the run with its idempotency token
+    and returns the operation id
+    """
+    api_request = {
+                    "StackSetName": STACK_SET_NAME,
+                    "DeploymentTargets": {"OrganizationalUnitIds": service.get_ou_ids()},
+                    "Regions": ['us-east-1'],
+                    "OperationId": operation_journal.get_operation_token(run_id, CONTENT_HASH, STACK_SET_NAME, 'create-0'),
+                    "CallAs": 'DELEGATED_ADMIN'
+                  }
+    return ss_deployer.run_flow(ss_deployer.submit_operation_flow('create_stack_instances', api_request, 'create'))
+
+
+def test_operation_token_is_stable():
+    """
+    This test checks that the token only depends on the run, content hash, stack set and step
+    """
+    token = operation_journal.get_operation_token('run-1', CONTENT_HASH, STACK_SET_NAME, 'create-0')
+    assert token == operation_journal.get_operation_token('run-1', CONTENT_HASH, STACK_SET_NAME, 'create-0')
+    assert token != operation_journal.get_operation_token('run-2', CONTENT_HASH, STACK_SET_NAME, 'create-0')
+    assert token != operation_journal.get_operation_token('run-1', CONTENT_HASH, STACK_SET_NAME, 'create-1')
+
+
+def test_restarted_run_resumes_the_journaled_run(s3_client):
+    """
+    This test checks that a restarted run of the same content adopts the run id of the
+    journal and sees the operations left in flight
+    """
+    journal = get_journal(s3_client)
+    assert journal.start(STACK_SET_NAME, 'run-1', CONTENT_HASH) == 'run-1'
+    journal.record_submitted(STACK_SET_NAME, 'operation-1', 'update')
+    journal.record_submitted(STACK_SET_NAME, 'operation-2', 'create')
+    journal.record_completed(STACK_SET_NAME, 'operation-1', 'SUCCEEDED')
+
+    restarted_journal = get_journal(s3_client)
+    assert restarted_journal.start(STACK_SET_NAME, 'run-2', CONTENT_HASH) == 'run-1'
+    assert restarted_journal.get_pending_operations(STACK_SET_NAME) == [('operation-2', 'create')]
+    assert restarted_journal.get_operation_status(STACK_SET_NAME, 'operation-1') == 'SUCCEEDED'
+    assert restarted_journal.get_operation_status(STACK_SET_NAME, 'operation-2') is None
+
+
+def test_completed_or_changed_deployment_starts_a_new_run(s3_client):
+    """
+    This test checks that a completed deployment, or one of another content hash,
+    is not resumed and starts an empty journal
+    """
+    journal = get_journal(s3_client)
+    journal.start(STACK_SET_NAME, 'run-1', CONTENT_HASH)
+    journal.record_submitted(STACK_SET_NAME, 'operation-1', 'update')
+    assert get_journal(s3_client).start(STACK_SET_NAME, 'run-2', 'content-hash-2') == 'run-2'
+    assert get_journal(s3_client).get_pending_operations(STACK_SET_NAME) == []
+
+    journal = get_journal(s3_client)
+    journal.complete(STACK_SET_NAME)
+    assert get_journal(s3_client).start(STACK_SET_NAME, 'run-3', 'content-hash-2') == 'run-3'
+
+
+def test_resumed_run_reuses_the_operation_token(service, session, s3_client):
+    """
+    This test checks that the step submitted by the interrupted run is recognized by its
+    token, skipped once it succeeded, and never submitted twice
+    """
+    service.seed_stack_set(STACK_SET_NAME, ou_ids=[], regions=[])
+    journal = get_journal(s3_client)
+    run_id = journal.start(STACK_SET_NAME, 'run-1', CONTENT_HASH)
+    operation_id = submit_create(get_deployer(session, journal, run_id), service, run_id)
+    assert operation_id == operation_journal.get_operation_token('run-1', CONTENT_HASH, STACK_SET_NAME, 'create-0')
+    assert journal.get_pending_operations(STACK_SET_NAME) == [(operation_id, 'create')]
+
+    # the run is interrupted before it saw the operation complete
+    restarted_journal = get_journal(s3_client)
+    run_id = restarted_journal.start(STACK_SET_NAME, 'run-2', CONTENT_HASH)
+    assert run_id == 'run-1'
+    service.api_counter.reset()
+    assert submit_create(get_deployer(session, restarted_journal, run_id), service, run_id) is None
+    assert service.api_counter.get_counts() == {"create_stack_instances": 1, "describe_stack_set_operation": 1}
+    assert restarted_journal.get_operation_status(STACK_SET_NAME, operation_id) == 'SUCCEEDED'
+    assert len([operation for operation in service.operations.values() if operation['stackset_name'] == STACK_SET_NAME]) == 1
+
+    # once journaled as succeeded the step is skipped without any API call
+    service.api_counter.reset()
+    assert submit_create(get_deployer(session, get_journal(s3_client), run_id), service, run_id) is None
+    assert service.api_counter.get_counts() == {}
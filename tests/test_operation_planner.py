@@ -0,0 +1,89 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+Tests of the Org Unit and region level operation planner.
+"""
+
+import random
+import pytest
+import operation_planner
+
+OU_IDS = ['ou-a', 'ou-b', 'ou-c', 'ou-d']
+REGIONS = ['us-east-1', 'us-west-2', 'eu-west-1']
+
+
+def get_cells(planned_operation):
+    """
+    This function returns the (Org Unit, Region) cells covered by the operation
+    """
+    return {(ou_id, region) for ou_id in planned_operation.org_units for region in planned_operation.regions}
+
+
+def check_plan(tgt_ou_ids, tgt_regions, current_ou_ids, current_regions):
+    """
+    This function checks that the planned operations do not overlap, delete
+    exactly the cells not targeted any more and create exactly the new cells
+    """
+    planned_operations = operation_planner.plan_operations(tgt_ou_ids, tgt_regions, current_ou_ids, current_regions)
+    current_cells = {(ou_id, region) for ou_id in current_ou_ids for region in current_regions}
+    target_cells = {(ou_id, region) for ou_id in tgt_ou_ids for region in tgt_regions}
+
+    covered_cells = set()
+    for planned_operation in planned_operations:
+        cells = get_cells(planned_operation)
+        assert cells, f"empty operation {planned_operation}"
+        assert not cells & covered_cells, f"operation {planned_operation} overlaps an earlier operation"
+        covered_cells |= cells
+
+    actions = [planned_operation.action for planned_operation in planned_operations]
+    assert actions == sorted(actions, key=lambda action: action != 'delete'), "delete operations must come first"
+    deleted_cells = set().union(*[get_cells(op) for op in planned_operations if op.action == 'delete'])
+    created_cells = set().union(*[get_cells(op) for op in planned_operations if op.action == 'create'])
+    assert deleted_cells == current_cells - target_cells
+    assert created_cells == target_cells - current_cells
+
+
+@pytest.mark.parametrize("tgt_ou_ids, tgt_regions, current_ou_ids, current_regions", [
+    (['ou-a'], ['us-east-1'], [], []),
+    (['ou-a', 'ou-b'], ['us-east-1', 'us-west-2'], ['ou-a'], ['us-east-1']),
+    (['ou-b'], ['us-west-2'], ['ou-a'], ['us-east-1']),
+    (['ou-a', 'ou-c'], ['us-east-1'], ['ou-a', 'ou-b'], ['us-east-1', 'us-west-2']),
+    ([], [], ['ou-a', 'ou-b'], ['us-east-1']),
+    (['ou-a'], ['us-east-1'], ['ou-a'], ['us-east-1'])
+])
+def test_plan_operations_do_not_overlap(tgt_ou_ids, tgt_regions, current_ou_ids, current_regions):
+    """
+    This test checks the plans of the typical target changes
+    """
+    check_plan(tgt_ou_ids, tgt_regions, current_ou_ids, current_regions)
+
+
+def test_random_plans_do_not_overlap():
+    """
+    This test checks the plans of random target changes
+    """
+    rand = random.Random(42)
+    for _ in range(500):
+        check_plan(rand.sample(OU_IDS, rand.randint(0, len(OU_IDS))),
+                   rand.sample(REGIONS, rand.randint(0, len(REGIONS))),
+                   rand.sample(OU_IDS, rand.randint(0, len(OU_IDS))),
+                   rand.sample(REGIONS, rand.randint(0, len(REGIONS))))
+
+
+def test_unchanged_targets_plan_nothing():
+    """
+    This test checks that unchanged targets plan no operation
+    """
+    assert operation_planner.plan_operations(['ou-a'], REGIONS, ['ou-a'], REGIONS) == []
+
+
+def test_new_region_is_created_in_the_existing_org_units_only():
+    """
+    This test checks that a new region is only deployed to the kept Org Units
+    and a new Org Unit to every target region
+    """
+    planned_operations = operation_planner.plan_operations(['ou-a', 'ou-b'], ['us-east-1', 'us-west-2'], ['ou-a'], ['us-east-1'])
+    assert planned_operations == [
+        operation_planner.PlannedOperation('create', ['ou-b'], ['us-east-1', 'us-west-2']),
+        operation_planner.PlannedOperation('create', ['ou-a'], ['us-west-2'])
+    ]
@@ -0,0 +1,101 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+Tests of the stack set deployer on the simulated StackSets service.
+"""
+
+import pytest
+import fake_stacksets
+import stackset_deployer
+
+
+@pytest.fixture
+def paged_service():
+    """
+    This fixture returns a simulated organization of 2 Org Units x 3 accounts x 2 regions
+    listing 4 stack instances per page, with the stack set app-dev deployed to all of them
+    """
+    service = fake_stacksets.FakeStackSetsService(ou_count=2, accounts_per_ou=3, regions=['us-east-1', 'us-west-2'], page_size=4, seed=7)
+    service.seed_stack_set('app-dev')
+    return service
+
+
+@pytest.fixture
+def deployer(paged_service):
+    """
+    This fixture returns the deployer of the dev environment
+    """
+    return stackset_deployer.Deployer('dev', 'us-east-1', cf_client=fake_stacksets.FakeSession(paged_service).cf_client)
+
+
+def test_stack_instances_are_streamed_page_by_page(paged_service, deployer):
+    """
+    This test checks that the stack instances are fetched one page at a time
+    as they are consumed
+    """
+    stack_instances = deployer.iter_stack_instances('app-dev', fields=['DeployedAccount', 'DeployedRegion'])
+    assert next(stack_instances) == ('000000000000', 'us-east-1')
+    assert paged_service.api_counter.get_counts() == {'list_stack_instances': 1}
+    assert len(list(stack_instances)) == 11
+    assert paged_service.api_counter.get_counts() == {'list_stack_instances': 3}
+
+
+def test_stack_instances_project_the_supplied_fields(deployer):
+    """
+    This test checks that the stack instances are dicts of all the fields
+    unless fields are supplied
+    """
+    stack_instance = deployer.get_stack_instances('app-dev')[0]
+    assert set(stack_instance) == set(stackset_deployer.STACK_INSTANCE_FIELDS)
+    assert stack_instance['StackInstanceStatus'] == 'SUCCEEDED'
+
+
+def test_columns_are_collected_in_a_single_pass(paged_service, deployer):
+    """
+    This test checks that the distinct values of the fields are collected
+    across all the pages
+    """
+    ou_ids, regions = deployer.run_flow(deployer.get_stack_instance_columns_flow('app-dev', ['DeployedOUId', 'DeployedRegion']))
+    assert ou_ids == set(paged_service.get_ou_ids()) and regions == {'us-east-1', 'us-west-2'}
+    assert paged_service.api_counter.get_counts() == {'list_stack_instances': 3}
+
+
+def test_pagination_stops_once_the_page_is_consumed(paged_service, deployer):
+    """
+    This test checks that paginate_flow stops fetching pages
+    once consume_page returns True
+    """
+    pages = []
+    deployer.run_flow(deployer.paginate_flow('list_stack_instances', {"StackSetName": 'app-dev'}, lambda page: pages.append(page) or True))
+    assert len(pages) == 1 and pages[0]['NextToken']
+    assert paged_service.api_counter.get_counts() == {'list_stack_instances': 1}
+
+
+def test_stack_instance_queries_are_filtered_by_the_api(paged_service, deployer):
+    """
+    This test checks that the account, region, detailed status and operation id
+    queries are sent to list_stack_instances and only the matching stack instances
+    are returned
+    """
+    accounts = paged_service.ou_accounts[paged_service.get_ou_ids()[0]]
+    paged_service.operation_duration = 3600
+    paged_service.submit_operation('app-dev', 'UPDATE', 'update-1', [(paged_service.get_ou_ids()[0], accounts[0], 'us-west-2')])
+
+    stack_instances = deployer.get_stack_instances('app-dev', account=accounts[1], region='us-east-1')
+    assert [(stack_instance['DeployedAccount'], stack_instance['DeployedRegion']) for stack_instance in stack_instances] == [(accounts[1], 'us-east-1')]
+    assert [stack_instance['DeployedAccount'] for stack_instance in deployer.get_stack_instances('app-dev', operation_id='update-1')] == [accounts[0]]
+    assert len(deployer.get_stack_instances('app-dev', detailed_status='SUCCEEDED')) == 11
+    assert paged_service.api_counter.get_counts() == {'list_stack_instances': 5}
+
+
+def test_stack_instances_query_lists_the_api_filters(deployer):
+    """
+    This test checks the list_stack_instances request of a query
+    """
+    assert deployer.get_stack_instances_query('app-dev', region='us-east-1', detailed_status='FAILED', operation_id='op-1') == {
+                                                                    "StackSetName": 'app-dev',
+                                                                    "CallAs": 'DELEGATED_ADMIN',
+                                                                    "StackInstanceRegion": 'us-east-1',
+                                                                    "Filters": [{"Name": "DETAILED_STATUS", "Values": 'FAILED'},
+                                                                                {"Name": "LAST_OPERATION_ID", "Values": 'op-1'}]
+                                                                 }
@@ -0,0 +1,93 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+Tests of the stack set drift and health sweep on the simulated StackSets service.
+"""
+
+import json
+import pytest
+import stackset_health
+
+EMPTY_COUNTERS = dict.fromkeys(stackset_health.HEALTH_COUNTERS, 0)
+
+
+@pytest.fixture
+def config_file(tmp_path, sample_config):
+    """
+    This fixture returns the deployment config file of the health sweep
+    """
+    config_file = tmp_path / 'deployment_config.json'
+    config_file.write_text(json.dumps(dict(sample_config, waiter_initial_delay=0.01, waiter_max_delay=0.05)))
+    return str(config_file)
+
+
+@pytest.fixture
+def report_file(tmp_path):
+    """
+    This fixture returns the path of the health report file
+    """
+    return str(tmp_path / 'stackset_health.json')
+
+
+def test_sweep_reports_the_drifted_instances(service, session, config_file, report_file):
+    """
+    This test checks that the sweep detects the drift of each stack set and counts
+    the drifted stack instances per stack set, Org Unit, region and account
+    """
+    service.drift_rate = 1.0
+    service.seed_stack_set('app-dev')
+    service.seed_stack_set('app-test', regions=['us-east-1'])
+    report = stackset_health.sweep_stack_sets('us-east-1', config_file, prefix='app-', report_file=report_file, session=session)
+    assert service.api_counter.get_counts()['detect_stack_set_drift'] == 2
+    assert report['totals']['stack_sets'] == 2 and report['totals']['unhealthy_stack_sets'] == 2
+    assert report['totals']['instances'] == report['totals']['drifted'] == 18
+    assert report['stack_sets']['app-dev']['drift_status'] == 'DRIFTED'
+    assert report['stack_sets']['app-dev']['drift_detection'] == 'SUCCEEDED'
+    assert report['regions'] == {'us-east-1': dict(EMPTY_COUNTERS, instances=12, drifted=12),
+                                 'us-west-2': dict(EMPTY_COUNTERS, instances=6, drifted=6)}
+    assert len(report['unhealthy_accounts']) == 6
+    with open(report_file) as file:
+        assert json.load(file) == report
+
+
+def test_sweep_without_drift_detection_reports_the_last_drift(service, session, config_file, report_file):
+    """
+    This test checks that skipping the drift detection only lists the stack instances
+    """
+    service.seed_stack_set('app-dev')
+    report = stackset_health.sweep_stack_sets('us-east-1', config_file, stack_set_names=['app-dev'], is_drift_detection=False,
+                                              report_file=report_file, session=session)
+    assert 'detect_stack_set_drift' not in service.api_counter.get_counts()
+    assert report['stack_sets']['app-dev']['drift_status'] == 'NOT_CHECKED'
+    assert report['stack_sets']['app-dev']['drift_detection'] is None
+    assert report['totals']['unchecked'] == 12 and report['totals']['unhealthy_stack_sets'] == 0
+
+
+def test_stack_set_with_an_operation_in_progress_is_skipped(service, session, config_file, report_file):
+    """
+    This test checks that the drift detection of a stack set running an operation
+    is skipped without retrying and its last detected drift is reported
+    """
+    service.seed_stack_set('app-dev', managed_execution=False)
+    service.operation_duration = 5
+    service.submit_operation('app-dev', 'UPDATE', instance_keys=list(service.stack_instances['app-dev']))
+    report = stackset_health.sweep_stack_sets('us-east-1', config_file, stack_set_names=['app-dev'],
+                                              report_file=report_file, session=session)
+    assert service.api_counter.get_counts()['detect_stack_set_drift'] == 1
+    assert report['stack_sets']['app-dev']['drift_detection'] == 'SKIPPED'
+    assert report['totals']['outdated'] == 12
+
+
+def test_report_caps_the_unhealthy_instances(service, session, config_file, report_file, sample_config):
+    """
+    This test checks that the report lists up to health_report_max_instances
+    unhealthy stack instances while counting all of them
+    """
+    with open(config_file, 'w') as file:
+        json.dump(dict(sample_config, waiter_initial_delay=0.01, waiter_max_delay=0.05, health_report_max_instances=5), file)
+    service.drift_rate = 1.0
+    service.seed_stack_set('app-dev')
+    report = stackset_health.sweep_stack_sets('us-east-1', config_file, stack_set_names=['app-dev'],
+                                              report_file=report_file, session=session)
+    assert len(report['unhealthy_instances']) == 5 and report['unhealthy_instance_count'] == 12
+    assert report['unhealthy_instances'] == sorted(report['unhealthy_instances'])
@@ -0,0 +1,73 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+Tests of the cached stack set inventory on the simulated StackSets service.
+"""
+
+import pytest
+from stackset_inventory import StackSetInventory
+
+
+@pytest.fixture
+def inventory(service, session):
+    """
+    This fixture returns the inventory of a service with three stack sets
+    """
+    for stackset_name in ['app-dev', 'app-test', 'other-dev']:
+        service.seed_stack_set(stackset_name, ou_ids=[])
+    return StackSetInventory(session.cf_client)
+
+
+def test_lookups_describe_the_stack_set_once(service, inventory):
+    """
+    This test checks that a stack set lookup describes the single stack set
+    and is answered from the cache afterwards
+    """
+    assert inventory.exists('app-dev') and inventory.exists('app-dev')
+    assert not inventory.exists('missing-dev') and not inventory.exists('missing-dev')
+    assert service.api_counter.get_counts() == {'describe_stack_set': 2}
+
+
+def test_listing_answers_the_lookups(service, inventory):
+    """
+    This test checks that the cached listing answers the lookups of all
+    the stack sets without further calls
+    """
+    assert inventory.list_stack_sets() == {'app-dev', 'app-test', 'other-dev'}
+    assert inventory.exists('app-test') and not inventory.exists('missing-dev')
+    assert inventory.list_stack_sets() == {'app-dev', 'app-test', 'other-dev'}
+    assert service.api_counter.get_counts() == {'list_stack_sets': 1}
+
+
+def test_invalidate_refreshes_the_stack_set(service, inventory):
+    """
+    This test checks that an invalidated stack set is looked up again
+    while refresh bypasses the cache
+    """
+    assert not inventory.exists('new-dev')
+    service.seed_stack_set('new-dev', ou_ids=[])
+    assert not inventory.exists('new-dev')
+    assert inventory.exists('new-dev', refresh=True)
+    del service.stack_sets['new-dev']
+    inventory.invalidate('new-dev')
+    assert not inventory.exists('new-dev')
+    assert service.api_counter.get_counts() == {'describe_stack_set': 3}
+
+
+def test_expired_entries_are_looked_up_again(service, session):
+    """
+    This test checks that the cache entries expire after the TTL
+    """
+    service.seed_stack_set('app-dev', ou_ids=[])
+    inventory = StackSetInventory(session.cf_client, ttl=0)
+    assert inventory.exists('app-dev') and inventory.exists('app-dev')
+    assert service.api_counter.get_counts() == {'describe_stack_set': 2}
+
+
+def test_resolve_stack_sets_by_name_and_prefix(inventory):
+    """
+    This test checks that names and prefixes resolve to the active stack sets
+    """
+    assert inventory.resolve_stack_sets(['other-dev', 'missing-dev'], prefix='app-') == ['app-dev', 'app-test', 'other-dev']
+    with pytest.raises(Exception, match="must be supplied"):
+        inventory.resolve_stack_sets()
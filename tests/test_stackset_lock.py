@@ -0,0 +1,150 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+Tests of the stack set lock and queue on the local file backend:
+contention, expiry, lease renewal and coalescing by source revision.
+"""
+
+from time import time, sleep
+import pytest
+import stackset_lock
+from stackset_waiter import OperationWaiter
+
+STACK_SET_NAME = 'app-dev'
+
+
+@pytest.fixture
+def backend(tmp_path):
+    """
+    This fixture returns a file lock backend in a temporary directory
+    """
+    return stackset_lock.FileLockBackend(str(tmp_path / 'stackset_locks'))
+
+
+def get_queue(backend, run_id, ttl=60, revision_time=100, timeout=1):
+    """
+    This function returns the queue of a run polling every few milliseconds
+    """
+    waiter = OperationWaiter(initial_delay=0.01, max_delay=0.02, jitter=0, timeout=timeout)
+    return stackset_lock.StackSetQueue(backend, run_id=run_id, ttl=ttl, waiter=waiter, revision_time=revision_time)
+
+
+def test_lock_is_exclusive(backend):
+    """
+    This test checks that a held lock is only taken once released
+    """
+    first_queue = get_queue(backend, 'run-1')
+    second_queue = get_queue(backend, 'run-2')
+    assert first_queue.try_lock(STACK_SET_NAME)
+    assert not second_queue.try_lock(STACK_SET_NAME)
+    first_queue.release(STACK_SET_NAME)
+    assert backend.read_lock(STACK_SET_NAME) == (None, None)
+    assert second_queue.try_lock(STACK_SET_NAME)
+    assert backend.read_lock(STACK_SET_NAME)[0]['owner'] == 'run-2'
+    second_queue.release(STACK_SET_NAME)
+
+
+def test_expired_lock_is_broken(backend):
+    """
+    This test checks that the lock of a crashed run is taken once past its TTL
+    """
+    backend.create_lock(STACK_SET_NAME, {"owner": "crashed-run", "expires_at": time() - 1})
+    queue = get_queue(backend, 'run-1')
+    assert queue.try_lock(STACK_SET_NAME)
+    assert backend.read_lock(STACK_SET_NAME)[0]['owner'] == 'run-1'
+    queue.release(STACK_SET_NAME)
+
+
+def test_live_lock_is_not_broken(backend):
+    """
+    This test checks that a lock within its TTL is left to its owner
+    """
+    backend.create_lock(STACK_SET_NAME, {"owner": "running-run", "expires_at": time() + 60})
+    assert not get_queue(backend, 'run-1').try_lock(STACK_SET_NAME)
+    assert backend.read_lock(STACK_SET_NAME)[0]['owner'] == 'running-run'
+
+
+def test_only_one_run_breaks_an_expired_lock(backend):
+    """
+    This test checks that of two runs breaking the same expired lock only one takes it
+    """
+    backend.create_lock(STACK_SET_NAME, {"owner": "crashed-run", "expires_at": time() - 1})
+    _, version = backend.read_lock(STACK_SET_NAME)
+    assert backend.replace_lock(STACK_SET_NAME, {"owner": "run-1", "expires_at": time() + 60}, version)
+    assert backend.replace_lock(STACK_SET_NAME, {"owner": "run-2", "expires_at": time() + 60}, version) is None
+    assert backend.read_lock(STACK_SET_NAME)[0]['owner'] == 'run-1'
+
+
+def test_release_keeps_a_lock_taken_over(backend):
+    """
+    This test checks that a run does not delete the lock another run took over
+    """
+    queue = get_queue(backend, 'run-1')
+    assert queue.try_lock(STACK_SET_NAME)
+    _, version = backend.read_lock(STACK_SET_NAME)
+    backend.replace_lock(STACK_SET_NAME, {"owner": "run-2", "expires_at": time() + 60}, version)
+    queue.release(STACK_SET_NAME)
+    assert backend.read_lock(STACK_SET_NAME)[0]['owner'] == 'run-2'
+
+
+def test_lease_is_renewed_while_held(backend):
+    """
+    This test checks that the held lock does not expire while the run holds it
+    """
+    queue = get_queue(backend, 'run-1', ttl=0.3)
+    assert queue.try_lock(STACK_SET_NAME)
+    sleep(0.7)
+    lock, _ = backend.read_lock(STACK_SET_NAME)
+    assert lock['owner'] == 'run-1' and lock['expires_at'] > time()
+    assert not get_queue(backend, 'run-2').try_lock(STACK_SET_NAME)
+    queue.release(STACK_SET_NAME)
+    assert backend.read_lock(STACK_SET_NAME) == (None, None)
+
+
+def test_queued_runs_coalesce_to_the_newest_revision(backend):
+    """
+    This test checks that a run of an older revision gives up for a run of a newer
+    revision, even when the older revision was queued later
+    """
+    newer_queue = get_queue(backend, 'run-newer', revision_time=200)
+    older_queue = get_queue(backend, 'run-older', revision_time=100)
+    newer_ticket = newer_queue.enqueue(STACK_SET_NAME)
+    older_ticket = older_queue.enqueue(STACK_SET_NAME)
+    assert older_queue.check(STACK_SET_NAME, older_ticket) == (True, False)
+    assert newer_queue.check(STACK_SET_NAME, newer_ticket) == (True, True)
+    newer_queue.release(STACK_SET_NAME)
+
+
+def test_acquire_waits_for_the_lock(backend):
+    """
+    This test checks that acquire waits for the lock and leaves the queue
+    """
+    backend.create_lock(STACK_SET_NAME, {"owner": "running-run", "expires_at": time() + 0.1})
+    queue = get_queue(backend, 'run-1')
+    with queue.hold(STACK_SET_NAME) as is_acquired:
+        assert is_acquired
+        assert backend.read_lock(STACK_SET_NAME)[0]['owner'] == 'run-1'
+        assert backend.list_queue(STACK_SET_NAME) == []
+    assert backend.read_lock(STACK_SET_NAME) == (None, None)
+
+
+def test_acquire_times_out(backend):
+    """
+    This test checks that acquire gives up once the lock timeout is reached
+    """
+    backend.create_lock(STACK_SET_NAME, {"owner": "running-run", "expires_at": time() + 60})
+    with pytest.raises(Exception, match="Timed out"):
+        get_queue(backend, 'run-1', timeout=0.1).acquire(STACK_SET_NAME)
+    assert backend.list_queue(STACK_SET_NAME) == []
+
+
+def test_expired_tickets_are_dropped(backend):
+    """
+    This test checks that the ticket of a crashed run does not hold back the queue
+    """
+    backend.enqueue(STACK_SET_NAME, f"{300:012d}-{0:020d}-crashed-run")
+    queue = get_queue(backend, 'run-1')
+    ticket = queue.enqueue(STACK_SET_NAME)
+    assert queue.check(STACK_SET_NAME, ticket) == (True, True)
+    assert backend.list_queue(STACK_SET_NAME) == [ticket]
+    queue.release(STACK_SET_NAME)
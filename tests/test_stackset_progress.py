@@ -0,0 +1,85 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+Tests of the stack instance progress tracking on the simulated StackSets service.
+"""
+
+import json
+import pytest
+import fake_stacksets
+import stackset_deployer
+from config_model import DeploymentConfig
+from stackset_progress import InstanceProgressTracker, ProgressReporter
+
+POLL_INTERVAL = 0.02
+OPERATION_DURATION = 0.2
+
+
+class RecordingReporter(ProgressReporter):
+    def __init__(self):
+        super().__init__('app-dev', report_interval=3600)
+        self.instances = []
+        self.counters = []
+
+    def report_instance(self, ou_id, account, region, stack_id, status):
+        self.instances.append((account, region, status))
+
+    def report_counters(self, counters):
+        super().report_counters(counters)
+        self.counters.append(counters)
+
+
+@pytest.fixture
+def deployer(sample_config):
+    """
+    This fixture returns a deployer polling the progress of the stack instances
+    of a stack set whose operations last OPERATION_DURATION seconds
+    """
+    service = fake_stacksets.FakeStackSetsService(ou_count=1, accounts_per_ou=3, regions=['us-east-1'],
+                                                  operation_duration=OPERATION_DURATION, seed=7)
+    service.seed_stack_set('app-dev', ou_ids=[])
+    ss_deployer = stackset_deployer.Deployer('dev', 'us-east-1', cf_client=fake_stacksets.FakeSession(service).cf_client)
+    ss_deployer.stack_set_name = 'app-dev'
+    ss_deployer.deployment_configs = DeploymentConfig(dict(sample_config, progress_poll_interval=POLL_INTERVAL)).validate()
+    return ss_deployer
+
+
+def test_progress_is_polled_once_per_poll_interval(deployer):
+    """
+    This test checks that the progress of a running operation is polled
+    at the poll interval instead of busy waiting, and the final counters
+    cover all the stack instances
+    """
+    service = deployer.cf_client.service
+    operation_id = deployer.cf_client.create_stack_instances(StackSetName='app-dev',
+                                                             DeploymentTargets={"OrganizationalUnitIds": service.get_ou_ids()},
+                                                             Regions=['us-east-1'])['OperationId']
+    counters = deployer.run_flow(deployer.check_stack_instances_progress_flow('app-dev', operation_id))
+    assert counters['instances'] == 3 and counters['status'] == {'SUCCEEDED': 3}
+    assert service.api_counter.get_counts()['list_stack_instances'] <= OPERATION_DURATION / POLL_INTERVAL + 2
+
+
+def test_terminal_instances_are_reported_once():
+    """
+    This test checks that a stack instance is reported when it reaches
+    a terminal status and the counters only when due or finished
+    """
+    reporter = RecordingReporter()
+    tracker = InstanceProgressTracker('app-dev', reporter)
+    assert tracker.update([('ou-1', '1', 'us-east-1', 'stack-1', 'RUNNING'), ('ou-1', '2', 'us-east-1', 'stack-2', 'FAILED')])
+    assert tracker.update([('ou-1', '1', 'us-east-1', 'stack-1', 'RUNNING'), ('ou-1', '2', 'us-east-1', 'stack-2', 'FAILED')])
+    assert not tracker.update([('ou-1', '1', 'us-east-1', 'stack-1', 'SUCCEEDED'), ('ou-1', '2', 'us-east-1', 'stack-2', 'FAILED')])
+    assert reporter.instances == [('2', 'us-east-1', 'FAILED'), ('1', 'us-east-1', 'SUCCEEDED')]
+    assert len(reporter.counters) == 2
+    assert reporter.counters[-1]['regions'] == {'us-east-1': {'SUCCEEDED': 1, 'FAILED': 1}}
+
+
+def test_json_progress_is_written_as_json_lines(capsys):
+    """
+    This test checks that the json log format prints one JSON object per event
+    """
+    tracker = InstanceProgressTracker('app-dev', ProgressReporter('app-dev', log_format='json'))
+    tracker.update([('ou-1', '1', 'us-east-1', 'stack-1', 'SUCCEEDED')])
+    events = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [event['event'] for event in events] == ['stack_instance', 'progress']
+    assert events[1]['stack_set'] == 'app-dev' and events[1]['status'] == {'SUCCEEDED': 1}
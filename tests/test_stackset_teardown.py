@@ -0,0 +1,55 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+Tests of the bulk stack set teardown on the simulated StackSets service.
+"""
+
+import json
+import pytest
+import stackset_teardown
+
+
+@pytest.fixture
+def config_file(tmp_path, sample_config):
+    """
+    This fixture returns the deployment config file of the teardown
+    """
+    config_file = tmp_path / 'deployment_config.json'
+    config_file.write_text(json.dumps(dict(sample_config, waiter_initial_delay=0.01, waiter_max_delay=0.05)))
+    return str(config_file)
+
+
+def test_teardown_deletes_the_regions_side_by_side(service, session, config_file):
+    """
+    This test checks that the teardown deletes each region with its own operation
+    using the teardown operation preferences when managed execution is active
+    """
+    service.seed_stack_set('app-dev')
+    service.seed_stack_set('app-test')
+    stackset_teardown.teardown_stack_sets('us-east-1', config_file, prefix='app-', session=session, is_confirmed=True)
+    delete_operations = [operation for operation in service.operations.values() if operation['action'] == 'DELETE']
+    assert not service.stack_sets and len(delete_operations) == 4
+    assert {tuple(operation['regions']) for operation in delete_operations} == {('us-east-1',), ('us-west-2',)}
+    assert all(operation['preferences'] == {"RegionConcurrencyType": "PARALLEL", "MaxConcurrentPercentage": 100,
+                                            "FailureTolerancePercentage": 0, "ConcurrencyMode": "SOFT_FAILURE_TOLERANCE"}
+               for operation in delete_operations)
+
+
+def test_teardown_without_managed_execution_uses_a_single_operation(service, session, config_file):
+    """
+    This test checks that a stack set running one operation at a time
+    deletes all its regions with a single operation
+    """
+    service.seed_stack_set('app-dev', managed_execution=False)
+    stackset_teardown.teardown_stack_sets('us-east-1', config_file, ['app-dev'], session=session, is_confirmed=True)
+    delete_operations = [operation for operation in service.operations.values() if operation['action'] == 'DELETE']
+    assert not service.stack_sets and len(delete_operations) == 1
+
+
+def test_unconfirmed_teardown_deletes_nothing(service, session, config_file):
+    """
+    This test checks that the teardown only lists the stack sets unless confirmed
+    """
+    service.seed_stack_set('app-dev')
+    stackset_teardown.teardown_stack_sets('us-east-1', config_file, ['app-dev'], session=session)
+    assert list(service.stack_sets) == ['app-dev'] and not service.operations
@@ -0,0 +1,74 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+Tests of the operation waiter on the simulated StackSets service.
+"""
+
+import asyncio
+import pytest
+import fake_stacksets
+import stackset_deployer
+from stackset_waiter import OperationWaiter
+
+
+@pytest.fixture
+def deployer():
+    """
+    This fixture returns a deployer of a stack set whose operations last 0.1 seconds
+    """
+    service = fake_stacksets.FakeStackSetsService(ou_count=1, accounts_per_ou=2, regions=['us-east-1'], operation_duration=0.1, seed=7)
+    service.seed_stack_set('app-dev')
+    ss_deployer = stackset_deployer.Deployer('dev', 'us-east-1', cf_client=fake_stacksets.FakeSession(service).cf_client)
+    ss_deployer.stack_set_name = 'app-dev'
+    ss_deployer.waiter = OperationWaiter(initial_delay=0.01, max_delay=0.04, jitter=0, timeout=5)
+    return ss_deployer
+
+
+def test_delay_backs_off_up_to_the_max_delay():
+    """
+    This test checks that the delay doubles from the initial delay
+    and stays within the jitter of the max delay
+    """
+    waiter = OperationWaiter(initial_delay=1, max_delay=10, jitter=0)
+    assert [waiter.get_delay(attempt) for attempt in range(6)] == [1, 2, 4, 8, 10, 10]
+    assert waiter.get_delay(10000) == 10
+    jittered_waiter = OperationWaiter(initial_delay=4, max_delay=10, jitter=0.5)
+    assert all(2 <= jittered_waiter.get_delay(0) <= 6 for _ in range(100))
+
+
+def test_waits_for_the_operation_to_complete(deployer):
+    """
+    This test checks that the waiter polls the operation until it completes
+    and records its latency
+    """
+    operation_id = deployer.cf_client.update_stack_set(StackSetName='app-dev')['OperationId']
+    status = deployer.run_flow(deployer.check_stack_instances_opeartion_status_flow(operation_id, 'app-dev', 'update_stack_set'))
+    assert status == 'SUCCEEDED'
+    stats = deployer.waiter.get_latency_stats()['update_stack_set']
+    assert stats['count'] == 1 and stats['checks'] > 1
+    assert stats['min_seconds'] >= 0.1
+
+
+def test_async_wait_matches_the_threaded_wait():
+    """
+    This test checks that wait_async waits for the check coroutine as wait does
+    """
+    waiter = OperationWaiter(initial_delay=0.001, max_delay=0.001, jitter=0)
+    checks = iter([(False, None), (False, None), (True, 'SUCCEEDED')])
+
+    async def check():
+        return next(checks)
+
+    assert asyncio.run(waiter.wait_async('operation', check)) == 'SUCCEEDED'
+    assert waiter.get_latency_stats()['operation']['checks'] == 3
+
+
+def test_times_out_waiting_for_a_long_operation(deployer):
+    """
+    This test checks that the waiter stops at its timeout
+    """
+    deployer.waiter.timeout = 0.03
+    deployer.cf_client.service.operation_duration = 5
+    operation_id = deployer.cf_client.update_stack_set(StackSetName='app-dev')['OperationId']
+    with pytest.raises(Exception, match="Timed out"):
+        deployer.run_flow(deployer.check_stack_instances_opeartion_status_flow(operation_id, 'app-dev'))
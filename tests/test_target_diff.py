@@ -0,0 +1,139 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+Tests of the account level diff of the deployment targets, resolved
+against the Org Units of the simulated organization.
+"""
+
+import pytest
+import target_diff
+
+REGIONS = ['us-east-1', 'us-west-2']
+
+
+def get_instance_keys(service, planned_operation):
+    """
+    This function returns the stack instance keys the operation targets
+    when it is submitted to the simulated service
+    """
+    deployment_targets = {"OrganizationalUnitIds": planned_operation.org_units}
+    if planned_operation.accounts:
+        deployment_targets.update(Accounts=planned_operation.accounts, AccountFilterType='INTERSECTION')
+    return set(service.get_target_keys('app-dev', deployment_targets, planned_operation.regions))
+
+
+def check_plan(service, current_index, target_index):
+    """
+    This function checks that the planned operations do not overlap and
+    touch exactly the stack instances to add and to remove
+    """
+    planned_operations = target_diff.plan_account_operations(current_index, target_index)
+    covered_keys = set()
+    deleted_keys = set()
+    created_keys = set()
+    for planned_operation in planned_operations:
+        instance_keys = get_instance_keys(service, planned_operation)
+        assert not instance_keys & covered_keys, f"operation {planned_operation} overlaps an earlier operation"
+        covered_keys |= instance_keys
+        (deleted_keys if planned_operation.action == 'delete' else created_keys).update(instance_keys)
+    assert deleted_keys == current_index.instance_keys - target_index.instance_keys
+    assert created_keys == target_index.instance_keys - current_index.instance_keys
+    return planned_operations
+
+
+@pytest.fixture
+def org_resolver(session):
+    """
+    This fixture returns the Org Unit resolver of the simulated organization
+    """
+    return target_diff.OrganizationResolver(session.org_client)
+
+
+def test_org_unit_accounts_are_resolved_once(service, org_resolver):
+    """
+    This test checks that the accounts of an Org Unit are listed once per run
+    """
+    ou_id = service.get_ou_ids()[0]
+    assert org_resolver.get_ou_accounts(ou_id) == set(service.ou_accounts[ou_id])
+    calls = service.api_counter.get_counts()
+    org_resolver.get_ou_accounts(ou_id)
+    assert service.api_counter.get_counts() == calls
+
+
+@pytest.mark.parametrize("filter_type, expected_accounts", [
+    ('', {'a1', 'a2', 'a3'}),
+    ('NONE', {'a1', 'a2', 'a3'}),
+    ('INTERSECTION', {'a2'}),
+    ('DIFFERENCE', {'a1', 'a3'})
+])
+def test_filter_accounts(filter_type, expected_accounts):
+    """
+    This test checks the account filter types of the account level diff
+    """
+    assert target_diff.filter_accounts(['a1', 'a2', 'a3'], ['a2'], filter_type) == expected_accounts
+
+
+def test_filter_accounts_rejects_union():
+    """
+    This test checks that the UNION account filter is not supported by the account level diff
+    """
+    with pytest.raises(Exception, match="UNION"):
+        target_diff.filter_accounts(['a1'], ['a2'], 'UNION')
+
+
+def test_target_index_applies_the_account_filter(service, org_resolver):
+    """
+    This test checks that the target index only holds the filtered accounts of the target Org Units
+    """
+    ou_id = service.get_ou_ids()[0]
+    accounts = service.ou_accounts[ou_id]
+    target_index = target_diff.get_target_index(org_resolver, [ou_id], REGIONS, [accounts[0]], 'INTERSECTION')
+    assert target_index.instance_keys == {(ou_id, accounts[0], region) for region in REGIONS}
+    target_index = target_diff.get_target_index(org_resolver, [ou_id], REGIONS, [accounts[0]], 'DIFFERENCE')
+    assert target_index.instance_keys == {(ou_id, account, region) for account in accounts[1:] for region in REGIONS}
+
+
+def test_intersection_filter_change_plans_account_operations(service, org_resolver):
+    """
+    This test checks that narrowing an INTERSECTION filter only deletes the stack
+    instances of the accounts dropped from the filter
+    """
+    ou_id = service.get_ou_ids()[0]
+    accounts = service.ou_accounts[ou_id]
+    current_index = target_diff.get_target_index(org_resolver, [ou_id], REGIONS, accounts[:2], 'INTERSECTION')
+    target_index = target_diff.get_target_index(org_resolver, [ou_id], REGIONS, accounts[:1], 'INTERSECTION')
+    planned_operations = check_plan(service, current_index, target_index)
+    assert [(op.action, op.accounts) for op in planned_operations] == [('delete', [accounts[1]])]
+
+
+def test_difference_filter_change_plans_account_operations(service, org_resolver):
+    """
+    This test checks that excluding another account with a DIFFERENCE filter
+    and adding a region plans non-overlapping account operations
+    """
+    ou_ids = service.get_ou_ids()
+    excluded_account = service.ou_accounts[ou_ids[1]][0]
+    current_index = target_diff.get_target_index(org_resolver, ou_ids, REGIONS[:1], [], 'NONE')
+    target_index = target_diff.get_target_index(org_resolver, ou_ids, REGIONS, [excluded_account], 'DIFFERENCE')
+    planned_operations = check_plan(service, current_index, target_index)
+    assert planned_operations[0] == target_diff.PlannedOperation('delete', [ou_ids[1]], REGIONS[:1], [excluded_account])
+    assert all(op.action == 'create' for op in planned_operations[1:])
+
+
+def test_org_unit_change_plans_account_operations(service, org_resolver):
+    """
+    This test checks the account operations of an Org Unit swapped for another
+    """
+    ou_ids = service.get_ou_ids()
+    current_index = target_diff.get_target_index(org_resolver, ou_ids[:1], REGIONS, [], '')
+    target_index = target_diff.get_target_index(org_resolver, ou_ids[1:], REGIONS, [], '')
+    planned_operations = check_plan(service, current_index, target_index)
+    assert [(op.action, op.org_units) for op in planned_operations] == [('delete', ou_ids[:1]), ('create', ou_ids[1:])]
+
+
+def test_unchanged_targets_plan_nothing(service, org_resolver):
+    """
+    This test checks that unchanged targets plan no account operation
+    """
+    target_index = target_diff.get_target_index(org_resolver, service.get_ou_ids(), REGIONS, [], 'NONE')
+    assert target_diff.plan_account_operations(target_diff.InstanceIndex(target_index.instance_keys), target_index) == []
@@ -0,0 +1,59 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+"""
+Tests of the template staging to the in memory S3 bucket of the simulated session.
+"""
+
+import pytest
+import template_cache
+from template_stager import TemplateStager
+
+BUCKET = 'artifacts'
+
+
+@pytest.fixture
+def files(tmp_path):
+    """
+    This fixture returns the (S3 key, source file) pairs of a template and an artifact
+    """
+    (tmp_path / 'app.yml').write_text("Resources: {}\n")
+    (tmp_path / 'nested.yml').write_text("Resources: {}\n")
+    return [('template/app/app.yml', str(tmp_path / 'app.yml')),
+            ('template/app/artifacts/nested.yml', str(tmp_path / 'nested.yml'))]
+
+
+def test_files_are_staged_with_their_content_hash(session, files):
+    """
+    This test checks that every file is uploaded with its content hash
+    and the HTTPS URLs of the staged files are returned
+    """
+    urls = TemplateStager(session.client('s3'), BUCKET).stage(files)
+    assert urls == {s3_key: f"https://{BUCKET}.s3.amazonaws.com/{s3_key}" for s3_key, _ in files}
+    for s3_key, source_file in files:
+        body, metadata = session.s3_store.objects[(BUCKET, s3_key)]
+        assert body == open(source_file, 'rb').read()
+        assert metadata[template_cache.CONTENT_HASH_METADATA_KEY] == template_cache.get_file_hash(source_file)
+
+
+def test_only_changed_files_are_uploaded_again(session, files):
+    """
+    This test checks that the files staged with the same content are not uploaded again
+    """
+    stager = TemplateStager(session.client('s3'), BUCKET, max_concurrency=2)
+    stager.stage(files)
+    for s3_key, _ in files:
+        _, metadata = session.s3_store.objects[(BUCKET, s3_key)]
+        session.s3_store.objects[(BUCKET, s3_key)] = (b'not uploaded again', metadata)
+    with open(files[1][1], 'a') as file:
+        file.write("Outputs: {}\n")
+    stager.stage(files)
+    assert session.s3_store.objects[(BUCKET, files[0][0])][0] == b'not uploaded again'
+    assert session.s3_store.objects[(BUCKET, files[1][0])][0] == b"Resources: {}\nOutputs: {}\n"
+
+
+def test_missing_file_fails_the_staging(session, files, tmp_path):
+    """
+    This test checks that a file which cannot be read fails the staging
+    """
+    with pytest.raises(Exception, match="Error while staging the files"):
+        TemplateStager(session.client('s3'), BUCKET).stage(files + [('template/app/missing.yml', str(tmp_path / 'missing.yml'))])